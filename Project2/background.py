@@ -0,0 +1,214 @@
+"""CSC111 Project 2: Background Jobs
+
+Runs slow work (loading the graph, scoring users, computing layouts) on worker threads, so the Tk
+window stays responsive. Tk widgets may only be used from the thread running the event loop, so the
+results are handed back to that thread: it polls the running jobs with widget.after and calls each
+job's callback there.
+"""
+from __future__ import annotations
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# How often (in ms) the event loop checks whether a job has finished.
+POLL_MS = 50
+
+
+class Job:
+    """A unit of work submitted to a BackgroundRunner.
+
+    Instance Attributes:
+        - name: the name of the job. Only one job with a given name runs at a time.
+        - cancelled: set when the job is cancelled. The work is given this event, so long work can check it
+          to stop early.
+    """
+    name: str
+    cancelled: threading.Event
+    # Private Instance Attributes:
+    #     - _future:
+    #         The future of the work running on the executor.
+    #     - _on_done:
+    #         Called on the event loop thread with the result of the work.
+    #     - _on_error:
+    #         Called on the event loop thread with the exception raised by the work, or None to re-raise it.
+    _future: Future
+    _on_done: Callable[[Any], None]
+    _on_error: Optional[Callable[[BaseException], None]]
+
+    def __init__(self, name: str, cancelled: threading.Event, future: Future, on_done: Callable[[Any], None],
+                 on_error: Optional[Callable[[BaseException], None]]) -> None:
+        """Initialize a job with the given name, the event given to its work, the future of its work and
+        its callbacks."""
+        self.name = name
+        self.cancelled = cancelled
+        self._future = future
+        self._on_done = on_done
+        self._on_error = on_error
+
+    def cancel(self) -> None:
+        """Cancel this job: it does not start if it has not started yet, and its callbacks are never called.
+
+        Work that has already started keeps running until it returns (or checks self.cancelled).
+        """
+        self.cancelled.set()
+        self._future.cancel()
+
+    def done(self) -> bool:
+        """Return whether the work of this job has finished or was cancelled."""
+        return self._future.done()
+
+    def deliver(self) -> None:
+        """Call the callback of this finished job with its result or exception, unless it was cancelled.
+
+        Preconditions:
+            - self.done()
+        """
+        if self.cancelled.is_set():
+            return
+        error = self._future.exception()
+        if error is None:
+            self._on_done(self._future.result())
+        elif self._on_error is not None:
+            self._on_error(error)
+        else:
+            raise error
+
+
+class BackgroundRunner:
+    """Runs jobs on a pool of worker threads, and calls their callbacks on the Tk event loop thread.
+
+    Instance Attributes:
+        - on_busy: called on the event loop thread with True when the first job starts,
+          and with False when no job is left running
+
+    Representation Invariants:
+        - all(name == job.name for name, job in self._jobs.items())
+        - all(name == job.name and job.cancelled.is_set() for name, job in self._cancelled.items())
+    """
+    on_busy: Callable[[bool], None]
+    # Private Instance Attributes:
+    #     - _widget:
+    #         The Tk widget whose after method schedules the polling of the jobs.
+    #     - _executor:
+    #         The pool of worker threads.
+    #     - _jobs:
+    #         Maps the name of each running job to the job.
+    #     - _cancelled:
+    #         Maps the name of each cancelled job whose work may still be running to the job.
+    #     - _polling:
+    #         Whether a poll of the jobs is scheduled.
+    _widget: Any
+    _executor: ThreadPoolExecutor
+    _jobs: dict[str, Job]
+    _cancelled: dict[str, Job]
+    _polling: bool
+
+    def __init__(self, widget: Any, max_workers: int = 2,
+                 on_busy: Callable[[bool], None] = lambda busy: None) -> None:
+        """Initialize a runner whose jobs are polled through the given Tk widget.
+
+        Preconditions:
+            - max_workers >= 1
+        """
+        self.on_busy = on_busy
+        self._widget = widget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='harmonify')
+        self._jobs = {}
+        self._cancelled = {}
+        self._polling = False
+
+    def submit(self, name: str, work: Callable[[threading.Event], Any], on_done: Callable[[Any], None],
+               on_error: Optional[Callable[[BaseException], None]] = None) -> Optional[Job]:
+        """Run work(cancelled) on a worker thread, then call on_done with its result on the event loop thread.
+
+        cancelled is the event set when the job is cancelled, so long work can check it and return early.
+        If work raises an exception, on_error is called with it instead (or it is raised on the
+        event loop thread if on_error is None). If a job with the same name is still running, or was
+        cancelled but its work has not returned yet, nothing is submitted and None is returned, so a
+        double click does not run the work twice.
+
+        This method must be called from the event loop thread.
+        """
+        if self.is_running(name) or self._is_stopping(name):
+            return None
+        cancelled = threading.Event()
+        job = Job(name, cancelled, self._executor.submit(work, cancelled), on_done, on_error)
+        self._jobs[name] = job
+        if len(self._jobs) == 1:
+            self.on_busy(True)
+        if not self._polling:
+            self._polling = True
+            self._widget.after(POLL_MS, self._poll)
+        return job
+
+    def is_running(self, name: str) -> bool:
+        """Return whether a job with the given name is running."""
+        return name in self._jobs
+
+    def is_busy(self) -> bool:
+        """Return whether any job is running."""
+        return len(self._jobs) > 0
+
+    def cancel(self, name: str) -> None:
+        """Cancel the running job with the given name. Do nothing if there is none.
+
+        A new job with the same name can only be submitted once the work of this one has returned.
+        """
+        if name in self._jobs:
+            job = self._jobs.pop(name)
+            job.cancel()
+            if not job.done():
+                self._cancelled[name] = job
+            if not self._jobs:
+                self.on_busy(False)
+
+    def cancel_all(self) -> None:
+        """Cancel every running job."""
+        for name in list(self._jobs):
+            self.cancel(name)
+
+    def shutdown(self) -> None:
+        """Cancel every job and stop the worker threads once their current work returns."""
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _is_stopping(self, name: str) -> bool:
+        """Return whether the work of a cancelled job with the given name is still running."""
+        job = self._cancelled.get(name)
+        if job is not None and job.done():
+            del self._cancelled[name]
+            job = None
+        return job is not None
+
+    def _poll(self) -> None:
+        """Deliver the results of the finished jobs, and poll again later if any job is still running.
+
+        A callback that raises does not stop the polling, so the jobs after it are still delivered.
+        """
+        try:
+            for name, job in list(self._jobs.items()):
+                if job.done() and self._jobs.get(name) is job:
+                    del self._jobs[name]
+                    if not self._jobs:
+                        self.on_busy(False)
+                    job.deliver()
+        finally:
+            if self._jobs:
+                self._widget.after(POLL_MS, self._poll)
+            else:
+                self._polling = False
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['threading', 'concurrent.futures'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
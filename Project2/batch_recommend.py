@@ -0,0 +1,174 @@
+"""CSC111 Project 2: Batch Recommendations
+
+Computes the best match and the recommended songs of every user in the graph, without the GUI.
+The users are split into batches that are scored by a pool of processes. Every worker opens the
+same memory-mapped graph snapshot, so the graph is shared read-only between them.
+
+Usage:
+    python batch_recommend.py --output recommendations.jsonl
+    python batch_recommend.py --output recommendations.csv --format csv --processes 8 --genre pop --duration medium
+    python batch_recommend.py --check  (runs the doctests and python_ta instead)
+"""
+from __future__ import annotations
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+from collections import Counter
+from typing import Any, Iterable, Iterator, Optional
+
+from compact_graph import CompactGraph
+from graph_functions import DURATION_BUCKETS, GENRE_NAMES
+from snapshot import load_snapshot
+
+# The fields of each output record, in CSV column order.
+FIELDS = ('user', 'genre', 'duration', 'match', 'score', 'common_songs', 'recommended_songs')
+
+# The graph of a worker process, opened by _init_worker.
+_graph = CompactGraph()
+
+
+def favourite_profile(graph: CompactGraph, user: str) -> tuple[str, str]:
+    """Return the (genre, duration) that the given user listens to most often.
+
+    Ties are broken deterministically, by the order of the user's song ids.
+
+    Preconditions:
+        - graph.has_vertex(user, 'user')
+        - graph.get_neighbours(user) != set()
+    """
+    features = [graph.get_song_features(song) for song in sorted(graph.get_neighbours(user))]
+    genre = Counter(f.genre for f in features).most_common(1)[0][0]
+    bucket = Counter(f.bucket for f in features).most_common(1)[0][0]
+    duration = next(name for name, code in DURATION_BUCKETS.items() if code == bucket)
+    return GENRE_NAMES[genre], duration
+
+
+def recommend(graph: CompactGraph, user: str, genre: Optional[str] = None,
+              duration: Optional[str] = None) -> dict[str, Any]:
+    """Return the output record of the given user's best match.
+
+    If genre or duration is None, the user's favourite (see favourite_profile) is used instead.
+    The match and score of a user with no positive match are None.
+
+    Preconditions:
+        - graph.has_vertex(user, 'user')
+    """
+    if graph.get_neighbours(user) and (genre is None or duration is None):
+        favourite_genre, favourite_duration = favourite_profile(graph, user)
+        genre = genre or favourite_genre
+        duration = duration or favourite_duration
+
+    record = {'user': user, 'genre': genre, 'duration': duration, 'match': None, 'score': None,
+              'common_songs': [], 'recommended_songs': []}
+    matches = graph.top_k_matches(user, genre or '', duration or '', 1)
+    if matches:
+        item, (common_songs, recommended_songs), [score] = matches[0]
+        record.update(match=item[0], score=score, common_songs=common_songs, recommended_songs=recommended_songs)
+    return record
+
+
+def recommend_all(snapshot: str, users: str, songs: str, processes: Optional[int] = None, batch_size: int = 256,
+                  genre: Optional[str] = None, duration: Optional[str] = None) -> Iterator[dict[str, Any]]:
+    """Yield the output record of every user of the graph of the given source files, in graph order.
+
+    The graph is read from (or first written to) the snapshot file at the given path.
+    Batches of batch_size users are scored by a pool of processes (os.cpu_count() by default;
+    1 scores every batch in this process), and the records are yielded as soon as their batch is done.
+
+    Preconditions:
+        - batch_size >= 1
+    """
+    graph = load_snapshot(snapshot, users, songs)
+    keys = graph.get_ordered_vertices('user')
+    tasks = [(keys[i:i + batch_size], genre, duration) for i in range(0, len(keys), batch_size)]
+
+    if processes == 1:
+        _init_worker(snapshot, users, songs)
+        for records in map(_recommend_batch, tasks):
+            yield from records
+    else:
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(snapshot, users, songs)) as pool:
+            for records in pool.imap(_recommend_batch, tasks):
+                yield from records
+
+
+def write_records(records: Iterable[dict[str, Any]], output: Any, output_format: str) -> int:
+    """Write the given records to the open text file output, and return how many were written.
+
+    output_format is 'jsonl' for one JSON object per line, or 'csv' for a CSV file with a header row,
+    where song lists are joined with ';'.
+
+    Preconditions:
+        - output_format in {'jsonl', 'csv'}
+    """
+    writer = None
+    if output_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(FIELDS)
+
+    count = 0
+    for record in records:
+        if writer is None:
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            writer.writerow([';'.join(record[f]) if isinstance(record[f], list) else record[f] for f in FIELDS])
+        count += 1
+    return count
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the batch job with the given command line arguments."""
+    parser = argparse.ArgumentParser(description='Compute the best match and recommended songs of every user.')
+    parser.add_argument('--users', default='all_user_data_200_songs.csv', help='CSV file of user listens')
+    parser.add_argument('--songs', default='songs_by_popularity.csv', help='CSV file of songs')
+    parser.add_argument('--snapshot', default='graph.snapshot', help='graph snapshot file shared by the workers')
+    parser.add_argument('--output', default='-', help="output file, or '-' for standard output")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl', dest='output_format')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--batch-size', type=int, default=256, help='number of users scored per task')
+    parser.add_argument('--genre', default=None, help="favourite genre of every user (default: each user's own)")
+    parser.add_argument('--duration', choices=tuple(DURATION_BUCKETS), default=None,
+                        help="preferred duration of every user (default: each user's own)")
+    args = parser.parse_args(argv)
+
+    records = recommend_all(args.snapshot, args.users, args.songs, args.processes, args.batch_size,
+                            args.genre, args.duration)
+    if args.output == '-':
+        count = write_records(records, sys.stdout, args.output_format)
+    else:
+        with open(args.output, 'w', encoding='utf-8', newline='') as output:
+            count = write_records(records, output, args.output_format)
+    print(f'Wrote {count} recommendations.', file=sys.stderr)
+
+
+def _init_worker(snapshot: str, users: str, songs: str) -> None:
+    """Open the shared graph snapshot for the _recommend_batch calls of this process."""
+    global _graph
+    _graph = load_snapshot(snapshot, users, songs)
+
+
+def _recommend_batch(task: tuple[list[str], Optional[str], Optional[str]]) -> list[dict[str, Any]]:
+    """Return the output records of the given (users, genre, duration) batch."""
+    users, genre, duration = task
+    return [recommend(_graph, user, genre, duration) for user in users]
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        import doctest
+
+        doctest.testmod()
+
+        import python_ta
+
+        python_ta.check_all(config={
+            'max-line-length': 120,
+            'extra-imports': ['argparse', 'csv', 'json', 'multiprocessing', 'sys', 'collections', 'compact_graph',
+                              'graph_functions', 'snapshot'],
+            'allowed-io': ['main'],
+            'max-nested-blocks': 4
+        })
+    else:
+        main()
@@ -0,0 +1,241 @@
+"""CSC111 Project 2: Benchmarks
+
+Times the main operations of the recommender on synthetic datasets of several sizes, and writes the
+results as JSON so that runs can be compared to size hardware and to catch regressions.
+
+The datasets are written by generate_dataset in the same CSV formats as all_user_data_200_songs.csv and
+songs_by_popularity.csv. Song popularity follows a Zipf distribution, so a few songs have most of the
+listens, as in the real data.
+
+Usage:
+    python benchmark.py --sizes 1000,10000,100000 --output benchmark.json
+    python benchmark.py --sizes 2000 --songs 200 --listens 20 --repeats 5
+    python benchmark.py --check  (runs the doctests and python_ta instead)
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from graph_functions import load_review_graph
+from graph_visualization import graph_figure
+from instrumentation import PROFILER
+
+# The version of the JSON output format. Increase it when a field changes meaning.
+BENCHMARK_VERSION = 1
+
+# The values used for the generated user and song records.
+NAMES = ('Liam', 'Noah', 'Olivia', 'Emma', 'Lucas', 'Amelia', 'Owen', 'Charlotte', 'Leo', 'Ava')
+CITIES = ('Calgary', 'Edmonton', 'Halifax', 'Montreal', 'Ottawa', 'Quebec City', 'Toronto', 'Vancouver',
+          'Victoria', 'Winnipeg')
+GENRES = ('dance', 'latino', 'pop', 'hip-hop', 'latin', 'k-pop', 'indie-pop', 'alt-rock', 'piano', 'rock',
+          'edm', 'country')
+
+
+def generate_dataset(directory: str, num_users: int, num_songs: int, listens_per_user: int,
+                     zipf_exponent: float = 1.1, seed: int = 0) -> tuple[str, str]:
+    """Write a synthetic user file and song file to the given directory, and return their paths.
+
+    Song ids are '1' to str(num_songs) in order of popularity: the probability that a listen is of
+    the song with id i is proportional to 1 / i ** zipf_exponent. Each user listens to a Poisson number
+    of distinct songs with mean listens_per_user (at least 1, at most num_songs). Song durations are
+    log-normal around 3.5 minutes, so every duration bucket appears. The same arguments always
+    produce the same files.
+
+    Preconditions:
+        - num_users >= 1 and num_songs >= 1 and listens_per_user >= 1
+        - zipf_exponent > 0
+    """
+    rng = np.random.default_rng(seed)
+    users_path = os.path.join(directory, f'users_{num_users}_{num_songs}_{listens_per_user}_{seed}.csv')
+    songs_path = os.path.join(directory, f'songs_{num_users}_{num_songs}_{listens_per_user}_{seed}.csv')
+
+    durations = np.clip(rng.lognormal(np.log(210000), 0.45, num_songs), 30000, 1200000).astype(np.int64)
+    genres = rng.integers(0, len(GENRES), num_songs)
+    with open(songs_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        for i in range(num_songs):
+            writer.writerow([i + 1, f'Song {i + 1}', f'Artist {i % 997 + 1}', durations[i], GENRES[genres[i]]])
+
+    popularity = 1 / np.arange(1, num_songs + 1) ** zipf_exponent
+    cumulative = np.cumsum(popularity / popularity.sum())
+    counts = np.clip(rng.poisson(listens_per_user, num_users), 1, num_songs)
+    with open(users_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        for u in range(num_users):
+            user = [f'user{u + 1}', NAMES[u % len(NAMES)], int(rng.integers(16, 80)), CITIES[u % len(CITIES)]]
+            for song in _distinct_songs(rng, cumulative, int(counts[u])):
+                writer.writerow(user + [song + 1])
+    return users_path, songs_path
+
+
+def run_benchmarks(sizes: list[int], num_songs: int = 2000, listens_per_user: int = 20, repeats: int = 3,
+                   queries: int = 50, max_vertices: int = 1000, seed: int = 0,
+                   directory: Optional[str] = None) -> dict[str, Any]:
+    """Return the benchmark results of a synthetic dataset with each given number of users.
+
+    For each size, every operation is timed repeats times, and then run once more while tracing
+    allocations to find its peak memory use. The similarity_score and compatible_user_rec_songs timings
+    are of a batch of the given number of queries, by the first users of the graph.
+
+    The datasets are written to directory, or to a temporary directory (removed afterwards) if it is None.
+
+    Preconditions:
+        - all(size >= 1 for size in sizes)
+        - num_songs >= 1 and listens_per_user >= 1 and repeats >= 1 and queries >= 1
+    """
+    results = {'version': BENCHMARK_VERSION, 'environment': _environment(),
+               'parameters': {'num_songs': num_songs, 'listens_per_user': listens_per_user, 'repeats': repeats,
+                              'queries': queries, 'max_vertices': max_vertices, 'seed': seed},
+               'sizes': []}
+
+    with contextlib.ExitStack() as stack:
+        if directory is None:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+        for size in sizes:
+            users, songs = generate_dataset(directory, size, num_songs, listens_per_user, seed=seed)
+            graph = load_review_graph(users, songs)
+            keys = graph.get_ordered_vertices('user')
+            query_users = keys[:queries]
+
+            def similarity_scores() -> None:
+                for i, user in enumerate(query_users):
+                    graph.get_similarity_score(user, keys[(i * 7919 + 1) % len(keys)], 'pop', 'medium')
+
+            def recommendations() -> None:
+                for user in query_users:
+                    try:
+                        graph.compatible_user_rec_songs(user, 'pop', 'medium')
+                    except ValueError:
+                        pass
+
+            operations = {
+                'load_review_graph': lambda: load_review_graph(users, songs),
+                'similarity_score': similarity_scores,
+                'compatible_user_rec_songs': recommendations,
+                'to_networkx': lambda: graph.to_networkx(max_vertices),
+                'visualize_graph_prep': lambda: graph_figure(graph, max_vertices=max_vertices)
+            }
+            results['sizes'].append({
+                'users': size,
+                'songs': graph.num_songs(),
+                'listens': sum(len(graph.get_neighbours(user)) for user in keys),
+                'queries': len(query_users),
+                'operations': {name: _measure(operation, repeats) for name, operation in operations.items()}
+            })
+
+    results['max_rss_kb'] = _max_rss_kb()
+    return results
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the benchmarks with the given command line arguments."""
+    parser = argparse.ArgumentParser(description='Time the recommender on synthetic datasets.')
+    parser.add_argument('--sizes', default='1000,5000,20000', help='comma-separated numbers of users')
+    parser.add_argument('--songs', type=int, default=2000, help='number of songs')
+    parser.add_argument('--listens', type=int, default=20, help='mean number of songs per user')
+    parser.add_argument('--repeats', type=int, default=3, help='number of timed runs of each operation')
+    parser.add_argument('--queries', type=int, default=50, help='number of queries per timed run')
+    parser.add_argument('--max-vertices', type=int, default=1000, help='vertices drawn by to_networkx')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the dataset generator')
+    parser.add_argument('--data-dir', default=None, help='keep the generated datasets in this directory')
+    parser.add_argument('--output', default='-', help="output JSON file, or '-' for standard output")
+    parser.add_argument('--profile', action='store_true',
+                        help='also record the stage timers and counters of the instrumented functions')
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        PROFILER.enable()
+    results = run_benchmarks([int(size) for size in args.sizes.split(',')], args.songs, args.listens,
+                             args.repeats, args.queries, args.max_vertices, args.seed, args.data_dir)
+    if args.profile:
+        results['profile'] = PROFILER.stats()
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+
+
+def _distinct_songs(rng: np.random.Generator, cumulative: np.ndarray, count: int) -> list[int]:
+    """Return count distinct song indices drawn from the given cumulative popularity distribution.
+
+    Songs are drawn in rounds with replacement, keeping the first draw of each song, so a user with
+    many listens does not need one pass over every song per listen.
+    """
+    chosen = {}
+    while len(chosen) < count:
+        draws = np.searchsorted(cumulative, rng.random(2 * count), side='right')
+        for song in np.minimum(draws, len(cumulative) - 1).tolist():
+            chosen.setdefault(song, None)
+            if len(chosen) == count:
+                break
+    return list(chosen)
+
+
+def _measure(operation: Callable[[], Any], repeats: int) -> dict[str, float]:
+    """Return the timings (in seconds) and the peak traced memory (in bytes) of the given operation."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'min_seconds': min(times), 'median_seconds': statistics.median(times), 'max_seconds': max(times),
+            'peak_bytes': peak}
+
+
+def _environment() -> dict[str, Any]:
+    """Return a description of the machine and interpreter running the benchmarks."""
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'numpy': np.__version__, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+def _max_rss_kb() -> Optional[int]:
+    """Return the peak resident set size of this process in KiB, or None where it is not available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other platforms report KiB.
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        import doctest
+
+        doctest.testmod()
+
+        import python_ta
+
+        python_ta.check_all(config={
+            'max-line-length': 120,
+            'extra-imports': ['argparse', 'contextlib', 'csv', 'json', 'os', 'platform', 'statistics', 'sys',
+                              'tempfile', 'time', 'tracemalloc', 'numpy', 'graph_functions', 'graph_visualization',
+                              'instrumentation', 'resource'],
+            'allowed-io': ['generate_dataset', 'main'],
+            'max-nested-blocks': 4
+        })
+    else:
+        main()
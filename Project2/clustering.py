@@ -0,0 +1,215 @@
+"""CSC111 Project 2: Taste Communities
+
+Splits the user-song graph into communities of users and the songs they listen to. Two algorithms are
+available, and both return a map from vertex key to community id:
+    - louvain greedily maximizes the modularity of the communities, merging them level by level.
+      It finds meaningful communities even when a few very popular songs connect most users.
+    - label_propagation lets every vertex join the community most of its neighbours are in. It is faster,
+      but on a dense listening graph it tends to merge everything into one community.
+
+Both only read get_ordered_vertices and get_neighbours, so they work on a Graph, a GraphOverlay or a
+CompactGraph. Each pass over the vertices takes time proportional to the number of edges.
+"""
+import random
+from typing import Any, Optional
+
+# The default maximum number of passes over the vertices.
+MAX_ITERATIONS = 30
+
+
+def label_propagation(graph: Any, max_iterations: int = MAX_ITERATIONS, seed: Optional[int] = 0) -> dict[Any, int]:
+    """Return a map from every vertex key of graph to the id of its community.
+
+    Community ids are 0, 1, 2, ..., numbered in the order their first vertex was added to the graph.
+    The vertices are visited in a random order in each pass, and each one takes the community most
+    common among its neighbours, keeping its own if that is one of the most common. Other ties are
+    broken at random. The same seed always gives the same communities. A vertex with no neighbours
+    is a community of its own.
+
+    Preconditions:
+        - max_iterations >= 1
+
+    >>> from graph_functions import Graph
+    >>> g = Graph()
+    >>> for key, kind in [('u1', 'user'), ('u2', 'user'), ('u3', 'user'), ('u4', 'user')]:
+    ...     g.add_vertex(key, [key], kind)
+    >>> for key in ['1', '2', '3', '4']:
+    ...     g.add_vertex(key, [key, 'Title', 'Artist', '200000', 'pop'], 'song')
+    >>> for user, song in [('u1', '1'), ('u1', '2'), ('u2', '1'), ('u2', '2'), ('u3', '3'), ('u3', '4'),
+    ...                    ('u4', '3'), ('u4', '4')]:
+    ...     g.add_edge(user, song)
+    >>> communities = label_propagation(g)
+    >>> communities['u1'] == communities['u2'] == communities['1'] != communities['u3'] == communities['u4']
+    True
+    """
+    keys = graph.get_ordered_vertices('')
+    index = {key: i for i, key in enumerate(keys)}
+    # Sorted, since the order of a set of keys changes between runs and would change how ties are broken.
+    neighbours = [sorted(index[u] for u in graph.get_neighbours(key)) for key in keys]
+    labels = list(range(len(keys)))
+
+    rng = random.Random(seed)
+    order = [i for i in range(len(keys)) if neighbours[i]]
+    for _ in range(max_iterations):
+        rng.shuffle(order)
+        changed = False
+        for i in order:
+            counts = {}
+            for j in neighbours[i]:
+                counts[labels[j]] = counts.get(labels[j], 0) + 1
+            most = max(counts.values())
+            if counts.get(labels[i], 0) == most:
+                continue
+            best = [label for label, count in counts.items() if count == most]
+            labels[i] = best[0] if len(best) == 1 else rng.choice(best)
+            changed = True
+        if not changed:
+            break
+
+    ids = {}
+    return {key: ids.setdefault(labels[i], len(ids)) for i, key in enumerate(keys)}
+
+
+def louvain(graph: Any, resolution: float = 1.0, seed: Optional[int] = 0) -> dict[Any, int]:
+    """Return a map from every vertex key of graph to the id of its community, found with the Louvain method.
+
+    Each level moves vertices one at a time (in a random order) to the neighbouring community that
+    increases modularity the most, until no move helps. Each community then becomes one vertex of the
+    next level. This stops at the first level where no vertex moves. A higher resolution gives more,
+    smaller communities.
+
+    Community ids are 0, 1, 2, ..., numbered in the order their first vertex was added to the graph.
+    The same seed always gives the same communities. A vertex with no neighbours is a community of its own.
+
+    Preconditions:
+        - resolution > 0
+
+    >>> from graph_functions import Graph
+    >>> g = Graph()
+    >>> for key, kind in [('u1', 'user'), ('u2', 'user'), ('u3', 'user'), ('u4', 'user')]:
+    ...     g.add_vertex(key, [key], kind)
+    >>> for key in ['1', '2', '3', '4']:
+    ...     g.add_vertex(key, [key, 'Title', 'Artist', '200000', 'pop'], 'song')
+    >>> for user, song in [('u1', '1'), ('u1', '2'), ('u2', '1'), ('u2', '2'), ('u3', '3'), ('u3', '4'),
+    ...                    ('u4', '3'), ('u4', '4'), ('u2', '3')]:
+    ...     g.add_edge(user, song)
+    >>> communities = louvain(g)
+    >>> communities['u1'] == communities['u2'] == communities['1'] != communities['u3'] == communities['u4']
+    True
+    """
+    keys = graph.get_ordered_vertices('')
+    index = {key: i for i, key in enumerate(keys)}
+    # Sorted, since the order of a set of keys changes between runs and would change how ties are broken.
+    adjacency = [{i: 1.0 for i in sorted(index[u] for u in graph.get_neighbours(key))} for key in keys]
+    community_of = list(range(len(keys)))
+
+    rng = random.Random(seed)
+    while True:
+        communities, moved = _louvain_level(adjacency, resolution, rng)
+        if not moved:
+            break
+        community_of = [communities[c] for c in community_of]
+        adjacency = _aggregate(adjacency, communities)
+
+    ids = {}
+    return {key: ids.setdefault(community_of[i], len(ids)) for i, key in enumerate(keys)}
+
+
+def community_members(communities: dict[Any, int]) -> list[set]:
+    """Return the set of vertex keys of each community, indexed by community id.
+
+    >>> community_members({'a': 0, 'b': 1, 'c': 0}) == [{'a', 'c'}, {'b'}]
+    True
+    """
+    members = [set() for _ in range(max(communities.values(), default=-1) + 1)]
+    for key, community in communities.items():
+        members[community].add(key)
+    return members
+
+
+def membership(clusters: list[set]) -> dict[Any, int]:
+    """Return the map from each vertex key in the given clusters to the index of its cluster.
+
+    A key that is in several clusters is mapped to the first of them.
+
+    >>> membership([{'a', 'c'}, {'b', 'c'}]) == {'a': 0, 'b': 1, 'c': 0}
+    True
+    """
+    result = {}
+    for i, cluster in enumerate(clusters):
+        for key in cluster:
+            result.setdefault(key, i)
+    return result
+
+
+def _louvain_level(adjacency: list[dict[int, float]], resolution: float,
+                   rng: random.Random) -> tuple[list[int], bool]:
+    """Return the community (numbered from 0) of each vertex of the given weighted graph after the local
+    moving phase of one Louvain level, and whether any vertex moved.
+
+    adjacency[i] maps each neighbour of vertex i to the weight of their edge. A self-loop of weight w
+    is stored as adjacency[i][i] == 2 * w, so that the degree of i is sum(adjacency[i].values()).
+    """
+    degrees = [sum(weights.values()) for weights in adjacency]
+    total = sum(degrees)
+    community = list(range(len(adjacency)))
+    community_degrees = list(degrees)
+    order = [i for i in range(len(adjacency)) if degrees[i] > 0]
+
+    moved = False
+    improved = True
+    while improved and total > 0:
+        improved = False
+        rng.shuffle(order)
+        for i in order:
+            links = {}
+            for j, weight in adjacency[i].items():
+                if j != i:
+                    links[community[j]] = links.get(community[j], 0.0) + weight
+
+            current = community[i]
+            community_degrees[current] -= degrees[i]
+            scale = resolution * degrees[i] / total
+            best = current
+            best_gain = links.get(current, 0.0) - scale * community_degrees[current]
+            for c, weight in links.items():
+                gain = weight - scale * community_degrees[c]
+                if gain > best_gain + 1e-12:
+                    best, best_gain = c, gain
+            community_degrees[best] += degrees[i]
+
+            if best != current:
+                community[i] = best
+                improved = moved = True
+
+    ids = {}
+    return [ids.setdefault(c, len(ids)) for c in community], moved
+
+
+def _aggregate(adjacency: list[dict[int, float]], communities: list[int]) -> list[dict[int, float]]:
+    """Return the weighted graph whose vertices are the given communities of the vertices of adjacency.
+
+    The weight between two communities is the total weight of the edges between them, and the edges
+    within a community become its self-loop (stored as in _louvain_level).
+    """
+    aggregated = [{} for _ in range(max(communities, default=-1) + 1)]
+    for i, weights in enumerate(adjacency):
+        row = aggregated[communities[i]]
+        for j, weight in weights.items():
+            row[communities[j]] = row.get(communities[j], 0.0) + weight
+    return aggregated
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['random', 'graph_functions'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,173 @@
+"""CSC111 Project 2: Co-listen Index
+
+Relates songs to each other through the users who listen to them. The bipartite user-song graph is
+projected onto a song x song matrix whose entry (a, b) is the number of users who listen to both
+songs a and b, computed as the sparse product L.T @ L of the user-song matrix L. Only the top N
+most co-listened songs of each song are kept, so a "more like these songs" query is a few lookups.
+"""
+from typing import Any, Iterable
+
+import numpy as np
+from scipy import sparse
+
+from graph_functions import Graph
+
+# The ways co-listen counts can be normalized (see CoListenIndex).
+NORMALIZATIONS = ('count', 'cosine', 'jaccard')
+
+# The number of songs whose rows of the co-listen matrix are computed at once, which bounds the
+# memory used while building the index.
+BLOCK_SIZE = 1024
+
+
+class CoListenIndex:
+    """The top N most co-listened songs of every song of a user-song graph.
+
+    The score of a pair of songs listened to together by c users, where a and b users listen to each one, is:
+        - 'count': c
+        - 'cosine': c / sqrt(a * b)
+        - 'jaccard': c / (a + b - c)
+    A song is never its own neighbour, and songs no user listens to together are not neighbours.
+
+    Instance Attributes:
+        - songs: the song keys, in the order they were added to the graph
+        - top_n: the number of neighbours kept per song
+        - normalization: one of NORMALIZATIONS
+
+    Representation Invariants:
+        - self.top_n >= 1
+        - self.normalization in NORMALIZATIONS
+        - len(self._offsets) == len(self.songs) + 1
+        - len(self._neighbours) == len(self._scores) == self._offsets[-1]
+    """
+    songs: list
+    top_n: int
+    normalization: str
+    # Private Instance Attributes:
+    #     - _song_index:
+    #         Maps each song key to its position in songs.
+    #     - _offsets, _neighbours, _scores:
+    #         The neighbours of song i are _neighbours[_offsets[i]:_offsets[i + 1]] (positions in songs),
+    #         best first, and _scores holds their scores.
+    _song_index: dict[Any, int]
+    _offsets: np.ndarray
+    _neighbours: np.ndarray
+    _scores: np.ndarray
+
+    def __init__(self, graph: Graph, top_n: int = 50, normalization: str = 'cosine') -> None:
+        """Initialize the co-listen index of the current users, songs and listens of the given graph.
+
+        Preconditions:
+            - top_n >= 1
+            - normalization in NORMALIZATIONS
+        """
+        self.songs = graph.get_ordered_vertices('song')
+        self.top_n = top_n
+        self.normalization = normalization
+        self._song_index = {song: i for i, song in enumerate(self.songs)}
+
+        users = graph.get_ordered_vertices('user')
+        indptr = [0]
+        indices = []
+        for user in users:
+            indices.extend(self._song_index[song] for song in graph.get_neighbours(user))
+            indptr.append(len(indices))
+        listens = sparse.csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr),
+                                    shape=(len(users), len(self.songs)))
+        by_song = listens.T.tocsr()
+        listeners = np.asarray(listens.sum(axis=0)).ravel()
+
+        offsets = [0]
+        neighbours = []
+        scores = []
+        for start in range(0, len(self.songs), BLOCK_SIZE):
+            block = (by_song[start:start + BLOCK_SIZE] @ listens).tocsr()
+            for row in range(block.shape[0]):
+                row_slice = slice(block.indptr[row], block.indptr[row + 1])
+                columns, values = self._top_neighbours(start + row, block.indices[row_slice],
+                                                       block.data[row_slice], listeners)
+                neighbours.append(columns)
+                scores.append(values)
+                offsets.append(offsets[-1] + len(columns))
+
+        self._offsets = np.array(offsets, dtype=np.int64)
+        self._neighbours = np.concatenate(neighbours) if neighbours else np.zeros(0, dtype=np.int64)
+        self._scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float64)
+
+    def similar_songs(self, song: Any, n: int = 10) -> list[tuple[Any, float]]:
+        """Return up to n (song, score) pairs of the songs most co-listened with the given song, best first.
+
+        Songs with the same score are ordered by when they were added to the graph.
+
+        Preconditions:
+            - n >= 1
+
+        Raise a ValueError if song is not in this index.
+        """
+        if song not in self._song_index:
+            raise ValueError
+        i = self._song_index[song]
+        begin, end = self._offsets[i], min(self._offsets[i + 1], self._offsets[i] + n)
+        return [(self.songs[j], float(score))
+                for j, score in zip(self._neighbours[begin:end].tolist(), self._scores[begin:end].tolist())]
+
+    def more_like(self, songs: Iterable, n: int = 10) -> list[tuple[Any, float]]:
+        """Return up to n (song, score) pairs of the songs most like the given songs together, best first.
+
+        The score of a song is the sum of its scores as a neighbour of each given song. The given
+        songs themselves are never returned, and songs not in this index are ignored. Songs with
+        the same score are ordered by when they were added to the graph.
+
+        Preconditions:
+            - n >= 1
+        """
+        given = {self._song_index[song] for song in songs if song in self._song_index}
+        totals = {}
+        for i in given:
+            for j, score in zip(self._neighbours[self._offsets[i]:self._offsets[i + 1]].tolist(),
+                                self._scores[self._offsets[i]:self._offsets[i + 1]].tolist()):
+                if j not in given:
+                    totals[j] = totals.get(j, 0.0) + score
+        best = sorted(totals.items(), key=lambda pair: (-pair[1], pair[0]))[:n]
+        return [(self.songs[j], score) for j, score in best]
+
+    def _top_neighbours(self, song: int, columns: np.ndarray, counts: np.ndarray,
+                        listeners: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Return the positions and scores of the top_n neighbours of the given song, best first.
+
+        counts[k] is the number of users who listen to both song and the song at position columns[k],
+        and listeners[i] is the number of users who listen to the song at position i.
+        """
+        keep = columns != song
+        columns, counts = columns[keep], counts[keep]
+
+        if self.normalization == 'cosine':
+            values = counts / np.sqrt(listeners[song] * listeners[columns])
+        elif self.normalization == 'jaccard':
+            values = counts / (listeners[song] + listeners[columns] - counts)
+        else:
+            values = counts
+
+        if len(columns) > self.top_n:
+            candidates = np.argpartition(-values, self.top_n - 1)[:self.top_n]
+            # Include every song tied with the last one kept, so ties are broken by song order below.
+            cutoff = values[candidates].min()
+            candidates = np.flatnonzero(values >= cutoff)
+            columns, values = columns[candidates], values[candidates]
+        order = np.lexsort((columns, -values))[:self.top_n]
+        return columns[order].astype(np.int64), values[order].astype(np.float64)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['numpy', 'scipy', 'graph_functions'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,531 @@
+"""CSC111 Project 2: Compact Graph
+
+A memory-compact storage mode for the user-song graph, for listen logs that are too large
+to keep as one _Vertex object per user and song.
+"""
+from __future__ import annotations
+import csv
+import sys
+from array import array
+from typing import Any, MutableMapping, Optional
+
+import networkx as nx
+import numpy as np
+
+from graph_functions import GENRE_NAMES, Graph, SongFeatures, duration_code, genre_code, intern_genre, select_top_k
+from similarity_engine import SimilarityEngine
+
+# The code stored in CompactGraph._kinds for each vertex kind, and the kind of each code.
+KIND_CODES = {'user': 0, 'song': 1}
+KIND_NAMES = ('user', 'song')
+
+
+class CompactGraph:
+    """A user-song graph stored as dense integer ids, CSR adjacency arrays and metadata columns.
+
+    It has the same public methods as Graph. Vertex keys are mapped to dense integer ids in the order
+    they are added. The neighbours of the vertex with id i are self._targets[self._offsets[i]:self._offsets[i + 1]],
+    sorted by id. The items of users and songs are kept in one column per field, indexed by the vertex's row
+    in the table of its kind, and are only rebuilt as lists when they are asked for.
+
+    New vertices and edges are buffered, and merged into the arrays the next time the graph is read.
+    A merge sorts only the buffered edges and inserts them into the sorted arrays, so it takes
+    O(E + B log B) time for B buffered edges, but it still copies the arrays once. This storage mode
+    suits graphs that are built in bulk and then mostly read: add all the edges before the first query
+    rather than alternating single additions with reads.
+
+    Preconditions (for every vertex added):
+        - users have an item formatted as ["username", "name", "age", "province"], with the username as key
+        - songs have an item formatted as ["song_id", "song_name", "artist", "duration (in ms)", "genre"],
+          with the song id as key
+
+    Representation Invariants:
+        - len(self._keys) == len(self._ids)
+        - all(self._ids[self._keys[i]] == i for i in range(len(self._keys)))
+        - len(self._user_names) == len(self._user_ages) == len(self._user_provinces)
+        - len(self._song_titles) == len(self._song_artists)
+    """
+    # Private Instance Attributes:
+    #     - _ids:
+    #         Maps each vertex key to its dense integer id. A dict, unless the graph was opened from a snapshot.
+    #     - _keys:
+    #         The key of each vertex id.
+    #     - _kinds:
+    #         The kind code of each vertex id (see KIND_CODES).
+    #     - _rows:
+    #         The row of each vertex id in the metadata columns of its kind.
+    #     - _offsets, _targets:
+    #         The CSR adjacency of the graph.
+    #     - _user_names, _user_ages, _user_provinces:
+    #         The metadata columns of the users.
+    #     - _song_titles, _song_artists:
+    #         The name and artist columns of the songs.
+    #     - _song_durations, _song_buckets, _song_genres:
+    #         The parsed feature columns of the songs (see SongFeatures).
+    #     - _new_kinds, _new_rows, _new_features:
+    #         The kind codes, rows and song features of the vertices added since the last merge.
+    #     - _new_sources, _new_targets:
+    #         The endpoint ids of the edges added since the last merge.
+    #     - _generation:
+    #         The number of changes made to this graph so far (see get_generation).
+    _ids: MutableMapping[Any, int]
+    _keys: list
+    _kinds: np.ndarray
+    _rows: np.ndarray
+    _offsets: np.ndarray
+    _targets: np.ndarray
+    _user_names: list[str]
+    _user_ages: list[str]
+    _user_provinces: list[str]
+    _song_titles: list[str]
+    _song_artists: list[str]
+    _song_durations: np.ndarray
+    _song_buckets: np.ndarray
+    _song_genres: np.ndarray
+    _new_kinds: list[int]
+    _new_rows: list[int]
+    _new_features: list[SongFeatures]
+    _new_sources: array
+    _new_targets: array
+    _generation: int
+
+    def __init__(self) -> None:
+        """Initialize an empty compact graph (no vertices or edges)."""
+        self._ids = {}
+        self._keys = []
+        self._kinds = np.zeros(0, dtype=np.int8)
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._targets = np.zeros(0, dtype=np.int32)
+        self._user_names = []
+        self._user_ages = []
+        self._user_provinces = []
+        self._song_titles = []
+        self._song_artists = []
+        self._song_durations = np.zeros(0, dtype=np.int32)
+        self._song_buckets = np.zeros(0, dtype=np.int8)
+        self._song_genres = np.zeros(0, dtype=np.int16)
+        self._new_kinds = []
+        self._new_rows = []
+        self._new_features = []
+        self._new_sources = array('i')
+        self._new_targets = array('i')
+        self._generation = 0
+
+    @staticmethod
+    def from_graph(graph: Graph) -> CompactGraph:
+        """Return a compact copy of the given graph, whose edges must all be between a user and a song."""
+        compact = CompactGraph()
+        users = set(graph.get_ordered_vertices('user'))
+        for key in graph.get_ordered_vertices():
+            compact.add_vertex(key, graph.get_item(key), 'user' if key in users else 'song')
+        for user in users:
+            for song in graph.get_neighbours(user):
+                compact.add_edge(user, song)
+        return compact
+
+    @staticmethod
+    def from_columns(columns: dict[str, Any]) -> CompactGraph:
+        """Return a compact graph with the given columns, as returned by get_columns.
+
+        The arrays are used as they are, so read-only (e.g. memory-mapped) arrays are never copied
+        unless the graph is later mutated. The string columns only need to support len, indexing,
+        iteration and append. If columns has a 'key_index' (a mapping from each key to its id, such as
+        a snapshot.KeyIndex), it is used instead of building a dict of every key.
+        Genre codes are translated to the codes of this process.
+        """
+        compact = CompactGraph()
+        compact._keys = columns['keys']
+        if 'key_index' in columns:
+            compact._ids = columns['key_index']
+        else:
+            compact._ids = dict(zip(compact._keys, range(len(compact._keys))))
+        for name in ('kinds', 'rows', 'offsets', 'targets', 'user_names', 'user_ages', 'user_provinces',
+                     'song_titles', 'song_artists', 'song_durations', 'song_buckets'):
+            setattr(compact, '_' + name, columns[name])
+
+        local_codes = np.array([intern_genre(genre) for genre in columns['genre_names']], dtype=np.int16)
+        compact._song_genres = local_codes[columns['song_genres']]
+        return compact
+
+    def get_columns(self) -> dict[str, Any]:
+        """Return the ids, adjacency arrays and metadata columns of this graph, keyed by name.
+
+        Genre codes are only meaningful within one process, so the genre names are returned with them.
+        """
+        self._flush()
+        columns = {name: getattr(self, '_' + name)
+                   for name in ('keys', 'kinds', 'rows', 'offsets', 'targets', 'user_names', 'user_ages',
+                                'user_provinces', 'song_titles', 'song_artists', 'song_durations', 'song_buckets',
+                                'song_genres')}
+        columns['genre_names'] = list(GENRE_NAMES)
+        return columns
+
+    def add_vertex(self, key: Any, item: Any, kind: str) -> None:
+        """Add a vertex with the given key, item and kind to this graph.
+
+        The new vertex is not adjacent to any other vertices.
+        Do nothing if the given item is already in this graph.
+
+        Preconditions:
+            - kind in {'user', 'song'}
+        """
+        if key in self._ids:
+            return
+
+        self._ids[key] = len(self._keys)
+        self._keys.append(key)
+        self._new_kinds.append(KIND_CODES[kind])
+        if kind == 'user':
+            self._new_rows.append(len(self._user_names))
+            self._user_names.append(item[1])
+            self._user_ages.append(sys.intern(item[2]))
+            self._user_provinces.append(sys.intern(item[3]))
+        else:
+            self._new_rows.append(len(self._song_titles))
+            self._song_titles.append(item[1])
+            self._song_artists.append(item[2])
+            self._new_features.append(SongFeatures.from_item(item))
+        self._generation += 1
+
+    def add_edge(self, key1: Any, key2: Any) -> None:
+        """Add an edge between the two vertices with the given items in this graph.
+
+        Raise a ValueError if key1 or key2 do not appear as vertices in this graph.
+
+        Preconditions:
+            - key1 != key2
+        """
+        if key1 in self._ids and key2 in self._ids:
+            self._new_sources.append(self._ids[key1])
+            self._new_targets.append(self._ids[key2])
+            self._generation += 1
+        else:
+            raise ValueError
+
+    def add_edges(self, key: Any, keys: list) -> None:
+        """Add an edge between the vertex with the given key and each vertex with a key in keys.
+
+        The ids are appended to the pending edges all at once, rather than one add_edge call per edge.
+
+        Raise a ValueError if key or any key in keys does not appear as a vertex in this graph.
+
+        Preconditions:
+            - key not in keys
+        """
+        if key not in self._ids or any(other not in self._ids for other in keys):
+            raise ValueError
+        self._new_sources.extend(array('i', [self._ids[key]]) * len(keys))
+        self._new_targets.extend([self._ids[other] for other in keys])
+        self._generation += 1
+
+    def adjacent(self, key1: Any, key2: Any) -> bool:
+        """Return whether key1 and key2 are adjacent vertices in this graph.
+
+        Return False if key1 or key2 do not appear as vertices in this graph.
+        """
+        if key1 in self._ids and key2 in self._ids:
+            neighbours = self._neighbour_ids(self._ids[key1])
+            position = np.searchsorted(neighbours, self._ids[key2])
+            return bool(position < len(neighbours) and neighbours[position] == self._ids[key2])
+        else:
+            return False
+
+    def get_generation(self) -> int:
+        """Return a counter that changes whenever a vertex or an edge is added to this graph."""
+        return self._generation
+
+    def has_vertex(self, key: Any, kind: str = '') -> bool:
+        """Return whether key is a vertex of this graph.
+
+        If kind != '', only return True if the vertex is of the given kind.
+
+        Preconditions:
+            - kind in {'', 'user', 'song'}
+        """
+        if key not in self._ids:
+            return False
+        self._flush()
+        return kind == '' or self._kinds[self._ids[key]] == KIND_CODES[kind]
+
+    def num_users(self) -> int:
+        """Return the number of user vertices in this graph, in constant time."""
+        return len(self._user_names)
+
+    def num_songs(self) -> int:
+        """Return the number of song vertices in this graph, in constant time."""
+        return len(self._song_titles)
+
+    def get_neighbours(self, key: Any) -> set:
+        """Return a set of the neighbours of the given item.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        if key in self._ids:
+            return {self._keys[i] for i in self._neighbour_ids(self._ids[key])}
+        else:
+            raise ValueError
+
+    def get_all_vertices(self, kind: str = '') -> set:
+        """Return a set of all vertex items in this graph.
+
+        If kind != '', only return the items of the given vertex kind.
+
+        Preconditions:
+            - kind in {'', 'user', 'song'}
+        """
+        return set(self.get_ordered_vertices(kind))
+
+    def get_ordered_vertices(self, kind: str = '') -> list:
+        """Return a list of all vertex keys in this graph, in the order they were added.
+
+        If kind != '', only return the keys of the given vertex kind.
+
+        Preconditions:
+            - kind in {'', 'user', 'song'}
+        """
+        if kind == '':
+            return list(self._keys)
+        self._flush()
+        return [self._keys[i] for i in np.flatnonzero(self._kinds == KIND_CODES[kind])]
+
+    def get_item(self, key: Any) -> list:
+        """Return the item stored in the vertex with the given key.
+
+        Raise a ValueError if key does not appear as a vertex in this graph.
+        """
+        if key in self._ids:
+            return self._item(self._ids[key])
+        else:
+            raise ValueError
+
+    def get_song_features(self, key: Any) -> SongFeatures:
+        """Return the parsed features of the song with the given key.
+
+        Raise a ValueError if key does not appear as a song vertex in this graph.
+        """
+        self._flush()
+        if key in self._ids and self._kinds[self._ids[key]] == KIND_CODES['song']:
+            row = self._rows[self._ids[key]]
+            return SongFeatures(int(self._song_durations[row]), int(self._song_buckets[row]),
+                                int(self._song_genres[row]))
+        else:
+            raise ValueError
+
+    def to_networkx(self, max_vertices: int = 5000) -> nx.Graph:
+        """Convert this graph into a networkx Graph.
+
+        max_vertices specifies the maximum number of vertices that can appear in the graph.
+        The vertices are visited in the same way as Graph.to_networkx.
+        """
+        self._flush()
+        graph_nx = nx.Graph()
+        for i, key in enumerate(self._keys):
+            graph_nx.add_node(key, kind=KIND_NAMES[self._kinds[i]])
+
+            for j in self._neighbour_ids(i):
+                neighbour = self._keys[j]
+                if graph_nx.number_of_nodes() < max_vertices:
+                    graph_nx.add_node(neighbour, kind=KIND_NAMES[self._kinds[j]])
+
+                if neighbour in graph_nx.nodes:
+                    graph_nx.add_edge(key, neighbour)
+
+            if graph_nx.number_of_nodes() >= max_vertices:
+                break
+
+        return graph_nx
+
+    def get_similarity_score(self, item1: Any, item2: Any, genre: str, duration: str) -> float:
+        """Return the similarity score between the two given items in this graph.
+
+        The score is the same as the one computed by _Vertex.similarity_score.
+
+        Raise a ValueError if item1 or item2 do not appear as vertices in this graph.
+        """
+        if (item1 not in self._ids) or (item2 not in self._ids):
+            raise ValueError
+
+        common = np.intersect1d(self._neighbour_ids(self._ids[item1]), self._neighbour_ids(self._ids[item2]),
+                                assume_unique=True)
+        return int(self._song_weights(common, genre, duration).sum())
+
+    def compatible_user_rec_songs(self, user: str, genre: str, duration: str,
+                                  engine: Optional[SimilarityEngine] = None) -> list[list]:
+        """Return the best match of the given user, formatted as in Graph.compatible_user_rec_songs.
+
+        Raise a ValueError if no other user has a positive similarity score to the given user.
+        engine must be None or built from this graph.
+
+        Preconditions:
+            - self.has_vertex(user, 'user')
+        """
+        matches = self.top_k_matches(user, genre, duration, 1, engine)
+        if not matches:
+            raise ValueError
+        return matches[0]
+
+    def top_k_matches(self, user: str, genre: str, duration: str, k: int,
+                      engine: Optional[SimilarityEngine] = None) -> list[list[list]]:
+        """Return the k users most similar to the given user, best match first.
+
+        The matches are formatted and ordered as in Graph.top_k_matches.
+        engine must be None or built from this graph.
+
+        Preconditions:
+            - self.has_vertex(user, 'user')
+            - k >= 1
+        """
+        self._flush()
+        user_id = self._ids[user]
+        if engine is not None:
+            candidates = engine.positive_scores(self.get_neighbours(user), genre, duration, exclude=user)
+        else:
+            ids, scores = self._candidate_scores(user_id, genre, duration)
+            candidates = ((self._keys[i], int(score), int(i)) for i, score in zip(ids, scores))
+
+        return [[self._item(self._ids[key]), self._song_lists(user_id, self._ids[key]), [score]]
+                for key, score in select_top_k(candidates, k)]
+
+    def _candidate_scores(self, user_id: int, genre: str, duration: str) -> tuple[np.ndarray, np.ndarray]:
+        """Return the ids and similarity scores of the other users who share at least one song with the given user.
+
+        As in Graph._candidate_scores, only the listeners of the given user's songs are visited.
+        """
+        songs = self._neighbour_ids(user_id)
+        starts = self._offsets[songs]
+        ends = self._offsets[songs + 1]
+        if len(songs) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        listeners = np.concatenate([self._targets[start:end] for start, end in zip(starts, ends)])
+        weights = np.repeat(self._song_weights(songs, genre, duration), ends - starts)
+        keep = (listeners != user_id) & (self._kinds[listeners] == KIND_CODES['user'])
+
+        ids, inverse = np.unique(listeners[keep], return_inverse=True)
+        scores = np.bincount(inverse, weights=weights[keep], minlength=len(ids)).astype(np.int64)
+        return ids, scores
+
+    def _song_weights(self, song_ids: np.ndarray, genre: str, duration: str) -> np.ndarray:
+        """Return the match weight of each of the given songs, as in _Vertex.match_weight."""
+        rows = self._rows[song_ids]
+        return (3 + 2 * (self._song_genres[rows] == genre_code(genre.lower()))
+                + (self._song_buckets[rows] == duration_code(duration))).astype(np.int64)
+
+    def _song_lists(self, user_id: int, match_id: int) -> list[list]:
+        """Return the names of the songs that both users listen to, and of the songs only the match listens to."""
+        songs_user_listen = {self._song_titles[self._rows[s]] for s in self._neighbour_ids(user_id)}
+        both_songs_you_listen = []
+        recommended_songs = []
+
+        for song in self._neighbour_ids(match_id):
+            title = self._song_titles[self._rows[song]]
+            if title in songs_user_listen:
+                both_songs_you_listen.append(title)
+            else:
+                recommended_songs.append(title)
+
+        return [both_songs_you_listen, recommended_songs]
+
+    def _item(self, vertex_id: int) -> list:
+        """Return the item of the vertex with the given id, rebuilt from the metadata columns."""
+        self._flush()
+        key = self._keys[vertex_id]
+        row = self._rows[vertex_id]
+        if self._kinds[vertex_id] == KIND_CODES['user']:
+            return [key, self._user_names[row], self._user_ages[row], self._user_provinces[row]]
+        else:
+            return [key, self._song_titles[row], self._song_artists[row], str(self._song_durations[row]),
+                    GENRE_NAMES[self._song_genres[row]]]
+
+    def _neighbour_ids(self, vertex_id: int) -> np.ndarray:
+        """Return the sorted ids of the neighbours of the vertex with the given id."""
+        self._flush()
+        return self._targets[self._offsets[vertex_id]:self._offsets[vertex_id + 1]]
+
+    def _flush(self) -> None:
+        """Merge the buffered vertices and edges into the arrays of this graph.
+
+        Only the buffered edges are sorted; they are then inserted into the already sorted targets.
+        Duplicate edges are merged, so adding the same edge twice has no effect.
+        """
+        if self._new_kinds:
+            features = self._new_features
+            self._kinds = np.concatenate([self._kinds, np.array(self._new_kinds, dtype=np.int8)])
+            self._rows = np.concatenate([self._rows, np.array(self._new_rows, dtype=np.int32)])
+            self._song_durations = np.concatenate(
+                [self._song_durations, np.array([f.duration_ms for f in features], dtype=np.int32)])
+            self._song_buckets = np.concatenate(
+                [self._song_buckets, np.array([f.bucket for f in features], dtype=np.int8)])
+            self._song_genres = np.concatenate(
+                [self._song_genres, np.array([f.genre for f in features], dtype=np.int16)])
+            self._new_kinds = []
+            self._new_rows = []
+            self._new_features = []
+
+        n = len(self._keys)
+        if len(self._offsets) < n + 1:
+            padding = np.full(n + 1 - len(self._offsets), self._offsets[-1], dtype=np.int64)
+            self._offsets = np.concatenate([self._offsets, padding])
+
+        if len(self._new_sources) > 0:
+            new_sources = np.frombuffer(self._new_sources, dtype=np.int32)
+            new_targets = np.frombuffer(self._new_targets, dtype=np.int32)
+            sources = np.concatenate([new_sources, new_targets]).astype(np.int64)
+            targets = np.concatenate([new_targets, new_sources]).astype(np.int64)
+            # Sorting the encoded pairs sorts them by source and then target, and exposes duplicates.
+            pairs = np.unique(sources * n + targets)
+
+            # The existing edges, encoded the same way, are already sorted, so one binary search per
+            # new edge finds both whether it exists and where it goes.
+            old_sources = np.repeat(np.arange(n, dtype=np.int64), np.diff(self._offsets))
+            old_pairs = old_sources * n + self._targets
+            positions = np.searchsorted(old_pairs, pairs)
+            found = positions < len(old_pairs)
+            found[found] = old_pairs[positions[found]] == pairs[found]
+            pairs, positions = pairs[~found], positions[~found]
+
+            self._targets = np.insert(self._targets, positions, (pairs % n).astype(np.int32))
+            added = np.bincount(pairs // n, minlength=n)
+            self._offsets = self._offsets + np.concatenate([[0], np.cumsum(added)])
+            self._new_sources = array('i')
+            self._new_targets = array('i')
+
+
+def load_compact_review_graph(users: str, songs: str) -> CompactGraph:
+    """Return a compact user-song graph corresponding to the given datasets.
+
+    The graph has the same vertices and edges as load_review_graph(users, songs), but no _Vertex
+    objects are ever created, so much larger listen logs fit in memory. users and songs must be in the
+    formats expected by load_review_graph, and each song id in users must be a song id in songs.
+    """
+    gr = CompactGraph()
+    all_songs = {}
+    with open(songs, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        for row in reader:
+            all_songs[row[0]] = row
+
+    with open(users, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        for row in reader:
+            gr.add_vertex(row[0], row[:4], "user")
+            gr.add_vertex(row[4], all_songs[row[4]], "song")
+            gr.add_edge(row[0], row[4])
+    return gr
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'disable': ['E1136', 'R0902'],
+        'extra-imports': ['csv', 'sys', 'array', 'networkx', 'numpy', 'graph_functions', 'similarity_engine'],
+        'allowed-io': ['load_compact_review_graph'],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,99 @@
+"""CSC111 Project 2: Test Fixtures
+
+Shared fixtures of the pytest regression tests (test_*.py), and a reference matcher that follows the
+baseline load_review_graph and Graph.compatible_user_rec_songs line by line: every other user is
+scored from scratch, and ties go to the user that appears first in the user file. The optimized code
+paths are compared against it.
+
+Usage:
+    python -m pytest -q
+"""
+from __future__ import annotations
+import csv
+import os
+from typing import Any, Optional
+
+import pytest
+
+from graph_functions import Graph, load_review_graph
+
+# The bundled datasets the regression tests run on.
+HERE = os.path.dirname(os.path.abspath(__file__))
+USERS = os.path.join(HERE, 'all_user_data_200_songs.csv')
+SONGS = os.path.join(HERE, 'songs_by_popularity.csv')
+
+# The (genre, duration) preferences every match is compared under.
+PROFILES = [('pop', 'medium'), ('hip-hop', 'short'), ('rock', 'long'), ('no-such-genre', 'medium')]
+
+
+class ReferenceMatcher:
+    """The baseline matcher: the users, songs and listens of the source files, scored without any index.
+
+    Instance Attributes:
+        - users: maps each username to its item, in the order the users first appear in the user file
+        - songs: maps each song id to its row of the song file
+        - listens: maps each username to the set of song ids they listen to
+    """
+    users: dict[str, list[str]]
+    songs: dict[str, list[str]]
+    listens: dict[str, set[str]]
+
+    def __init__(self, users: str, songs: str) -> None:
+        """Read the given source files."""
+        with open(songs, 'r', encoding='utf-8') as file:
+            self.songs = {row[0]: row for row in csv.reader(file)}
+        self.users = {}
+        self.listens = {}
+        with open(users, 'r', encoding='utf-8') as file:
+            for row in csv.reader(file):
+                self.users.setdefault(row[0], row[:4])
+                self.listens.setdefault(row[0], set()).add(row[4])
+
+    def score(self, songs: set[str], other: str, genre: str, duration: str) -> int:
+        """Return the baseline similarity score of other against a query with the given songs."""
+        total = 0
+        for song in songs & self.listens[other]:
+            length = int(self.songs[song][3])
+            total += 3
+            total += 2 * (genre.lower() == self.songs[song][4])
+            total += ((length < 120000 and duration.lower() == 'short')
+                      or (120000 <= length <= 480000 and duration.lower() == 'medium')
+                      or (length > 480000 and duration.lower() == 'long'))
+        return total
+
+    def ranking(self, songs: set[str], genre: str, duration: str, exclude: Optional[str] = None) -> list[tuple]:
+        """Return the (user, score) pairs of every user with a positive score, best first, ties in file order."""
+        scored = [(user, self.score(songs, user, genre, duration)) for user in self.users if user != exclude]
+        return sorted([pair for pair in scored if pair[1] > 0], key=lambda pair: -pair[1])
+
+    def match(self, user: str, genre: str, duration: str) -> Optional[list[Any]]:
+        """Return compatible_user_rec_songs(user, genre, duration) of the baseline, with both song lists
+        sorted (the baseline lists them in set order), or None if it would raise."""
+        ranking = self.ranking(self.listens[user], genre, duration, exclude=user)
+        if not ranking:
+            return None
+        best, score = ranking[0]
+        return [self.users[best], self.song_lists(self.listens[user], best), [score]]
+
+    def song_lists(self, songs: set[str], other: str) -> list[list[str]]:
+        """Return the sorted names of the songs of other that are in songs, and of those that are not."""
+        names = {self.songs[song][1] for song in songs}
+        theirs = [self.songs[song][1] for song in self.listens[other]]
+        return [sorted(name for name in theirs if name in names), sorted(name for name in theirs if name not in names)]
+
+
+def normalized(match: list[Any]) -> list[Any]:
+    """Return the given compatible_user_rec_songs result with both song lists sorted."""
+    return [match[0], [sorted(match[1][0]), sorted(match[1][1])], match[2]]
+
+
+@pytest.fixture(scope='session')
+def reference() -> ReferenceMatcher:
+    """The baseline matcher of the bundled datasets."""
+    return ReferenceMatcher(USERS, SONGS)
+
+
+@pytest.fixture(scope='session')
+def graph() -> Graph:
+    """The graph of the bundled datasets. Tests must not mutate it."""
+    return load_review_graph(USERS, SONGS)
@@ -1,31 +1,108 @@
-"""CSC111 Data"""
+"""CSC111 Data
+
+Builds songs_by_popularity.csv, the N most popular distinct songs, from the Spotify track dump
+pre_processed_all_songs.csv.
+
+The dump is read in chunks, with only the columns that are needed and explicit dtypes. Each track
+name is kept at its first occurrence only, and only the current top N rows are kept between chunks,
+so memory is bounded by the chunk size, N, and one 64-bit hash per distinct track name, however
+large the dump is.
+
+Usage:
+    python data.py
+    python data.py --input tracks.csv --output songs_by_popularity.csv --top 500 --chunksize 200000
+    python data.py --check  (runs the doctests and python_ta instead)
+"""
+import argparse
+import sys
+from typing import Optional
+
 import pandas as pd
 
-df = pd.read_csv('pre_processed_all_songs.csv')
+# The columns read from the dump, and their dtypes.
+COLUMNS = {
+    'track_name': 'string',
+    'artists': 'string',
+    'popularity': 'float32',
+    'duration_ms': 'Int64',
+    'track_genre': 'category'
+}
+
+# The columns written to the output file, after the rank.
+OUTPUT_COLUMNS = ['track_name', 'artists', 'duration_ms', 'track_genre']
+
+
+def top_songs(source: str, n: int = 200, chunksize: int = 100000) -> pd.DataFrame:
+    """Return the n most popular distinct songs of the track dump at source, most popular first.
+
+    Songs are distinct by track name, and each track name is represented by its first row in the dump.
+    Rows with no track name are skipped. Songs with the same popularity are ordered by where they first
+    appear in the dump. The returned frame has the columns of COLUMNS and a default index.
+
+    Preconditions:
+        - n >= 1 and chunksize >= 1
+        - source is a CSV file with a header row that contains every column of COLUMNS
+    """
+    seen = set()
+    best = None
+    position = 0
+    for chunk in pd.read_csv(source, usecols=list(COLUMNS), dtype=COLUMNS, chunksize=chunksize):
+        chunk['order'] = range(position, position + len(chunk))
+        position += len(chunk)
+
+        chunk = chunk[chunk['track_name'].notna()].drop_duplicates('track_name')
+        hashes = pd.util.hash_pandas_object(chunk['track_name'], index=False).tolist()
+        new = [h not in seen for h in hashes]
+        seen.update(hashes)
+        chunk = chunk[new].nlargest(n, 'popularity', keep='first')
+
+        best = chunk if best is None else pd.concat([best, chunk], ignore_index=True)
+        best = best.sort_values(['popularity', 'order'], ascending=[False, True], na_position='last').head(n)
+
+    if best is None:
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in COLUMNS.items()})
+    return best.drop(columns='order').reset_index(drop=True)
+
+
+def preprocess(source: str = 'pre_processed_all_songs.csv', output: str = 'songs_by_popularity.csv', n: int = 200,
+               chunksize: int = 100000) -> None:
+    """Write the n most popular distinct songs of the track dump at source to output, in the format of
+    songs_by_popularity.csv: no header, and rows of rank (from 1), track name, artists, duration (in ms)
+    and genre.
 
-# Remove duplicates (keep the first occurrence)
-df = df.drop_duplicates()
+    Preconditions:
+        - n >= 1 and chunksize >= 1
+        - source is a CSV file with a header row that contains every column of COLUMNS
+    """
+    songs = top_songs(source, n, chunksize)[OUTPUT_COLUMNS]
+    songs.index += 1  # Start the index from 1
+    songs.to_csv(output, index_label='Rank', header=False)
 
-# Group by 'track_name' and keep the first occurrence (highest popularity for each track)
-df_sorted = df.groupby('track_name', sort=False).first().reset_index()
 
-# Sort by 'popularity' in descending order and keep the top 200
-df_sorted = df_sorted.sort_values(by='popularity', ascending=False).head(200)
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the preprocessing with the given command line arguments."""
+    parser = argparse.ArgumentParser(description='Build the song file from the Spotify track dump.')
+    parser.add_argument('--input', default='pre_processed_all_songs.csv', help='CSV file of all tracks')
+    parser.add_argument('--output', default='songs_by_popularity.csv', help='CSV file of the most popular songs')
+    parser.add_argument('--top', type=int, default=200, help='number of songs to keep')
+    parser.add_argument('--chunksize', type=int, default=100000, help='number of rows read at once')
+    args = parser.parse_args(argv)
+    preprocess(args.input, args.output, args.top, args.chunksize)
 
-# Drop unnecessary columns from the sorted dataframe
-df_sorted = df_sorted.drop(
-    columns=['track_id', 'album_name', 'explicit', 'danceability', 'popularity', 'energy', 'time_signature', 'tempo',
-             'valence', 'liveness', 'instrumentalness', 'acousticness', 'speechiness', 'mode', 'key', 'loudness'],
-    errors='ignore'  # Ignore if any column is missing
-)
 
-# Reset the index and make it start from 1
-df_sorted.reset_index(drop=True, inplace=True)
-df_sorted.index += 1  # Start the index from 1
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        import doctest
 
-if 'Unnamed: 0' in df.columns:
-    df_sorted = df_sorted.drop('Unnamed: 0', axis=1)
+        doctest.testmod()
 
+        import python_ta
 
-# Save the sorted CSV to a new file
-df_sorted.to_csv('songs_by_popularity.csv', index_label='Rank', header=False)
+        python_ta.check_all(config={
+            'max-line-length': 120,
+            'extra-imports': ['argparse', 'sys', 'pandas'],
+            'allowed-io': [],
+            'max-nested-blocks': 4
+        })
+    else:
+        main()
@@ -0,0 +1,121 @@
+"""CSC111 Project 2: Graph Cache
+
+Keeps the user-song graph in memory between GUI actions, so the CSV files are only parsed again
+when they change on disk.
+"""
+import os
+import threading
+from typing import Optional
+
+from graph_functions import Graph, GraphOverlay, load_review_graph
+from similarity_engine import SimilarityEngine
+
+
+class GraphCache:
+    """A user-song graph that is loaded once and reused until its source files change.
+
+    The cache compares the modification time and size of both source files on every access,
+    and reloads the graph if either of them changed. It can be used from several threads:
+    only one of them loads the graph or builds the engine, and the others wait for it.
+
+    Instance Attributes:
+        - users: the path to the CSV file of user listens
+        - songs: the path to the CSV file of songs
+
+    Representation Invariants:
+        - (self._graph is None) == (self._signature is None)
+        - self._graph is not None or self._engine is None
+    """
+    users: str
+    songs: str
+    # Private Instance Attributes:
+    #     - _graph:
+    #         The cached graph, or None if it has not been loaded yet.
+    #     - _signature:
+    #         The (mtime, size) pairs of the source files at the time _graph was loaded.
+    #     - _engine:
+    #         The similarity engine built from _graph, or None if it has not been built yet.
+    #     - _lock:
+    #         Held while the graph or the engine is loaded, built or dropped.
+    _graph: Optional[Graph]
+    _signature: Optional[tuple]
+    _engine: Optional[SimilarityEngine]
+    _lock: threading.RLock
+
+    def __init__(self, users: str, songs: str) -> None:
+        """Initialize a cache for the graph built from the given files. Nothing is loaded yet."""
+        self.users = users
+        self.songs = songs
+        self._graph = None
+        self._signature = None
+        self._engine = None
+        self._lock = threading.RLock()
+
+    def get(self) -> Graph:
+        """Return the cached graph, loading it first if it is missing or its source files changed.
+
+        The returned graph is shared between callers, so it must not be mutated.
+        Use overlay() to add vertices or edges for a single query.
+        """
+        with self._lock:
+            signature = self._file_signature()
+            if self._graph is None or signature != self._signature:
+                self._graph = load_review_graph(self.users, self.songs)
+                self._signature = signature
+                self._engine = None
+            return self._graph
+
+    def engine(self) -> SimilarityEngine:
+        """Return the similarity engine of the cached graph, building it first if needed."""
+        with self._lock:
+            graph = self.get()
+            if self._engine is None:
+                self._engine = SimilarityEngine(graph)
+            return self._engine
+
+    def snapshot(self) -> tuple[Graph, SimilarityEngine]:
+        """Return the cached graph and its similarity engine, loaded or built first if needed.
+
+        Both are taken under one lock, so the engine always belongs to the returned graph even if the
+        source files change meanwhile. Use this when one request needs both.
+        """
+        with self._lock:
+            return self.get(), self.engine()
+
+    def warm(self) -> None:
+        """Load the graph and build its engine now, so the next query does not have to wait for them."""
+        self.engine()
+
+    def overlay(self) -> GraphOverlay:
+        """Return a new overlay on top of the cached graph, for adding a query user without changing the cache."""
+        return GraphOverlay(self.get())
+
+    def invalidate(self) -> None:
+        """Drop the cached graph, so the next access reloads it from the source files."""
+        with self._lock:
+            self._graph = None
+            self._signature = None
+            self._engine = None
+
+    def _file_signature(self) -> tuple:
+        """Return the (mtime, size) pair of each source file."""
+        signature = []
+        for path in (self.users, self.songs):
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['os', 'threading', 'graph_functions', 'similarity_engine'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
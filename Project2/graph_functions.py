@@ -1,16 +1,157 @@
 """CSC111 Project 2"""
 from __future__ import annotations
 import csv
-from typing import Any
+import heapq
+import time
+from collections import ChainMap
+from typing import Any, Iterable, NamedTuple, Optional, TYPE_CHECKING
 
 import networkx as nx  # Used for visualizing graphs (by convention, referred to as "nx")
 
+from instrumentation import PROFILER
+
+if TYPE_CHECKING:
+    from similarity_engine import SimilarityEngine
+
+# Duration bucket codes, used to compare a song's duration with a user's preferred duration.
+DURATION_BUCKETS = {'short': 0, 'medium': 1, 'long': 2}
+
+# Integer codes of the song genres, assigned the first time each genre is seen.
+# GENRE_NAMES[c] is the genre with code c.
+GENRE_CODES = {}
+GENRE_NAMES = []
+
+
+def duration_bucket(duration_ms: int) -> int:
+    """Return the duration bucket code of a song with the given duration (in ms).
+
+    >>> duration_bucket(119999) == DURATION_BUCKETS['short']
+    True
+    >>> duration_bucket(480000) == DURATION_BUCKETS['medium']
+    True
+    >>> duration_bucket(480001) == DURATION_BUCKETS['long']
+    True
+    """
+    if duration_ms < 120000:
+        return DURATION_BUCKETS['short']
+    elif duration_ms <= 480000:
+        return DURATION_BUCKETS['medium']
+    else:
+        return DURATION_BUCKETS['long']
+
+
+def genre_code(genre: str) -> int:
+    """Return the integer code of the given genre, or -1 if no song of that genre has been seen.
+
+    Since -1 is never the code of a song, it can be compared with song codes like any other code.
+    """
+    return GENRE_CODES.get(genre, -1)
+
+
+def intern_genre(genre: str) -> int:
+    """Return the integer code of the given genre, giving it the next unused code if it has not been seen yet."""
+    if genre not in GENRE_CODES:
+        GENRE_CODES[genre] = len(GENRE_NAMES)
+        GENRE_NAMES.append(genre)
+    return GENRE_CODES[genre]
+
+
+def duration_code(duration: str) -> int:
+    """Return the bucket code of the given preferred duration ('short', 'medium' or 'long', in any case),
+    or -1 if it is not one of them.
+
+    >>> duration_code('Medium') == DURATION_BUCKETS['medium']
+    True
+    >>> duration_code('')
+    -1
+    """
+    return DURATION_BUCKETS.get(duration.lower(), -1)
+
+
+class SongFeatures(NamedTuple):
+    """The typed features of a song, parsed once from its item when its vertex is created.
+
+    Instance Attributes:
+        - duration_ms: the duration of the song in ms
+        - bucket: the duration bucket code of the song (see DURATION_BUCKETS)
+        - genre: the genre code of the song (see GENRE_CODES)
+    """
+    duration_ms: int
+    bucket: int
+    genre: int
+
+    @staticmethod
+    def from_item(item: list) -> SongFeatures:
+        """Return the features of a song with the given item, interning its genre if needed.
+
+        item must be formatted as ["song_id", "song_name", "artist", "duration (in ms)", "genre"].
+        """
+        duration_ms = int(item[3])
+        return SongFeatures(duration_ms, duration_bucket(duration_ms), intern_genre(item[4]))
+
+
+def song_weight(features: SongFeatures, genre_wanted: int, duration_wanted: int) -> int:
+    """Return how much a song with the given features adds to the similarity score of two users who both
+    listen to it: 3 for the common song, plus 2 if its genre code is genre_wanted and 1 if its duration
+    bucket code is duration_wanted.
+
+    >>> song_weight(SongFeatures(100000, DURATION_BUCKETS['short'], 7), 7, DURATION_BUCKETS['long'])
+    5
+    """
+    weight = 3
+    if features.genre == genre_wanted:
+        weight += 2
+    if features.bucket == duration_wanted:
+        weight += 1
+    return weight
+
+
+class Neighbourhood(NamedTuple):
+    """The size of a neighbourhood recommendation (see Graph.neighbourhood_rec_songs).
+
+    Instance Attributes:
+        - users: the number of most similar users who vote for songs
+        - songs: the maximum number of songs recommended
+
+    Representation Invariants:
+        - self.users >= 1
+        - self.songs >= 1
+    """
+    users: int = 10
+    songs: int = 10
+
+
+def select_top_k(candidates: Iterable[tuple[Any, int, int]], k: int) -> list[tuple[Any, int]]:
+    """Return the k best (key, score) pairs of the given (key, score, order) candidates, best first.
+
+    A higher score is better, and candidates with the same score are ordered by their order, which
+    must be distinct. Only a heap of at most k candidates is kept while the candidates are read.
+
+    Preconditions:
+        - k >= 1
+
+    >>> select_top_k([('a', 3, 0), ('b', 5, 1), ('c', 5, 2), ('d', 1, 3)], 2)
+    [('b', 5), ('c', 5)]
+    """
+    # A min-heap of (score, -order, key), so heap[0] is the worst of the best k so far.
+    heap = []
+    for key, score, order in candidates:
+        entry = (score, -order, key)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    heap.sort(reverse=True)
+    return [(item, best) for best, _, item in heap]
+
 
 class _Vertex:
     """A vertex in a song-user graph, used to represent a user or a song.
 
     Each vertex item is either a username or song id. Both are represented as strings,
     even though we've kept the type annotation as Any to be consistent.
+    Vertices use __slots__ instead of a __dict__, since a graph can hold millions of them.
 
     Instance Attributes:
         - key: A key used for extracting the related vertex object.
@@ -21,31 +162,43 @@ class _Vertex:
                 ["song_id", "song_name", "artist" "duration (in ms)", "genre"]
         - kind: The type of this vertex: 'user' or 'song'.
         - neighbours: The vertices that are adjacent to this vertex.
+        - order: The position at which this vertex was added to its graph.
+                 Used to break ties between users with the same similarity score.
+        - features: The parsed features of a song vertex, or None for a user vertex.
 
     Representation Invariants:
         - self not in self.neighbours
         - all(self in u.neighbours for u in self.neighbours)
         - self.kind in {'user', 'song'}
         - all(isinstance(x, str) for x in self.item)
+        - self.order >= 0
+        - (self.kind == 'song') == (self.features is not None)
     """
+    __slots__: tuple[str, ...] = ('key', 'item', 'kind', 'neighbours', 'order', 'features')
 
     key: Any
     item: Any
     kind: str
     neighbours: set[_Vertex]
+    order: int
+    features: Optional[SongFeatures]
 
-    def __init__(self, key: Any, item: Any, kind: str) -> None:
-        """Initialize a new vertex with the given key, item and kind.
+    def __init__(self, key: Any, item: Any, kind: str, order: int = 0) -> None:
+        """Initialize a new vertex with the given key, item, kind and order.
 
         This vertex is initialized with no neighbours.
+        The features of a song vertex are parsed from its item here, so scoring never has to parse them again.
 
         Preconditions:
             - kind in {'user', 'song'}
+            - order >= 0
         """
         self.key = key
         self.item = item
         self.kind = kind
         self.neighbours = set()
+        self.order = order
+        self.features = SongFeatures.from_item(item) if kind == 'song' else None
 
     def degree(self) -> int:
         """Return the degree of this vertex."""
@@ -69,41 +222,85 @@ class _Vertex:
             - self != other
 
         """
+        profiling = PROFILER.enabled
+        start = time.perf_counter() if profiling else 0.0
+        genre_wanted = genre_code(genre.lower())
+        duration_wanted = duration_code(duration)
+
         number_of_common_songs = 0
         number_of_common_genres = 0
         number_of_common_duration = 0
 
-        for v1 in self.neighbours:
-            for v2 in other.neighbours:
-                if v1 == v2:
-                    number_of_common_songs += 1
-                    if genre.lower() == v2.item[4]:
-                        number_of_common_genres += 1
-
-                    if int(v2.item[3]) < 120000 and duration.lower() == "short":
-                        number_of_common_duration += 1
+        for song in self.neighbours & other.neighbours:
+            number_of_common_songs += 1
+            if song.features.genre == genre_wanted:
+                number_of_common_genres += 1
+            if song.features.bucket == duration_wanted:
+                number_of_common_duration += 1
+
+        if profiling:
+            PROFILER.count('similarity_score.pairs_scored')
+            PROFILER.count('similarity_score.common_songs', number_of_common_songs)
+            PROFILER.record('similarity_score', time.perf_counter() - start)
+        return number_of_common_songs * 3 + number_of_common_genres * 2 + number_of_common_duration * 1
 
-                    elif int(v2.item[3]) <= 480000 and int(v2.item[3]) >= 120000 and duration.lower() == "medium":
-                        number_of_common_duration += 1
+    def match_weight(self, genre_wanted: int, duration_wanted: int) -> int:
+        """Return how much this song adds to the similarity score of two users who both listen to it.
 
-                    elif int(v2.item[3]) > 480000 and duration.lower() == "long":
-                        number_of_common_duration += 1
+        As in similarity_score, a common song is worth 3, plus 2 if its genre code is genre_wanted
+        and 1 if its duration bucket code is duration_wanted.
 
-        return number_of_common_songs * 3 + number_of_common_genres * 2 + number_of_common_duration * 1
+        Preconditions:
+            - self.kind == 'song'
+        """
+        return song_weight(self.features, genre_wanted, duration_wanted)
 
 
 class Graph:
     """A graph used to represent a user-song network.
+
+    Derived indexes built from a graph (such as a SimilarityEngine) can subscribe to it, and are then
+    told about every vertex and edge that is added or removed, so they never have to be rebuilt.
+    A subscriber must have the methods vertex_added(key, item, kind), edge_added(key1, key2)
+    and edge_removed(key1, key2), which are called after the graph has changed.
     """
     # Private Instance Attributes:
     #     - _vertices:
     #         A collection of the vertices contained in this graph.
     #         Maps item to _Vertex object.
+    #     - _kind_index:
+    #         Maps each vertex kind to the keys of the vertices of that kind, in the order they were added.
+    #         (The keys are stored as the keys of a dict, used as an ordered set.)
+    #     - _subscribers:
+    #         The derived indexes to notify when this graph changes.
+    #     - _generation:
+    #         The number of changes made to this graph so far (see get_generation).
     _vertices: dict[Any, _Vertex]
+    _kind_index: dict[str, dict[Any, None]]
+    _subscribers: list
+    _generation: int
 
     def __init__(self) -> None:
         """Initialize an empty graph (no vertices or edges)."""
         self._vertices = {}
+        self._kind_index = {'user': {}, 'song': {}}
+        self._subscribers = []
+        self._generation = 0
+
+    def subscribe(self, index: Any) -> None:
+        """Notify the given derived index of every later change to this graph.
+
+        index must have been built from the current state of this graph.
+        """
+        self._subscribers.append(index)
+
+    def unsubscribe(self, index: Any) -> None:
+        """Stop notifying the given derived index of changes to this graph.
+
+        Do nothing if index is not subscribed to this graph.
+        """
+        if index in self._subscribers:
+            self._subscribers.remove(index)
 
     def add_vertex(self, key: Any, item: Any, kind: str) -> None:
         """Add a vertex with the given key, item and kind to this graph.
@@ -115,7 +312,11 @@ class Graph:
             - kind in {'user', 'song'}
         """
         if key not in self._vertices:
-            self._vertices[key] = _Vertex(key, item, kind)
+            self._vertices[key] = _Vertex(key, item, kind, self._next_order())
+            self._kind_index[kind][key] = None
+            self._generation += 1
+            for index in self._subscribers:
+                index.vertex_added(key, item, kind)
 
     def add_edge(self, key1: Any, key2: Any) -> None:
         """Add an edge between the two vertices with the given items in this graph.
@@ -128,9 +329,44 @@ class Graph:
         if key1 in self._vertices and key2 in self._vertices:
             v1 = self._vertices[key1]
             v2 = self._vertices[key2]
+            is_new = v2 not in v1.neighbours
 
             v1.neighbours.add(v2)
             v2.neighbours.add(v1)
+            if is_new:
+                self._generation += 1
+                for index in self._subscribers:
+                    index.edge_added(key1, key2)
+        else:
+            raise ValueError
+
+    def add_edges(self, key: Any, keys: list) -> None:
+        """Add an edge between the vertex with the given key and each vertex with a key in keys.
+
+        Raise a ValueError if key or any key in keys does not appear as a vertex in this graph.
+
+        Preconditions:
+            - key not in keys
+        """
+        for other in keys:
+            self.add_edge(key, other)
+
+    def remove_edge(self, key1: Any, key2: Any) -> None:
+        """Remove the edge between the two vertices with the given items in this graph.
+
+        Raise a ValueError if key1 and key2 are not adjacent vertices in this graph.
+        """
+        if key1 in self._vertices and key2 in self._vertices:
+            v1 = self._vertices[key1]
+            v2 = self._vertices[key2]
+            if v2 not in v1.neighbours:
+                raise ValueError
+
+            v1.neighbours.remove(v2)
+            v2.neighbours.remove(v1)
+            self._generation += 1
+            for index in self._subscribers:
+                index.edge_removed(key1, key2)
         else:
             raise ValueError
 
@@ -138,13 +374,38 @@ class Graph:
         """Return whether key1 and key2 are adjacent vertices in this graph.
 
         Return False if key1 or key2 do not appear as vertices in this graph.
+        This takes constant time: the neighbours of key1 are a set, probed with the vertex of key2.
         """
         if key1 in self._vertices and key2 in self._vertices:
-            v1 = self._vertices[key1]
-            return any(v2.key == key2 for v2 in v1.neighbours)
+            return self._vertices[key2] in self._vertices[key1].neighbours
         else:
             return False
 
+    def get_generation(self) -> int:
+        """Return a counter that changes whenever a vertex or an edge is added to or removed from this graph.
+
+        A result computed from this graph is still valid as long as the generation has not changed.
+        """
+        return self._generation
+
+    def has_vertex(self, key: Any, kind: str = '') -> bool:
+        """Return whether key is a vertex of this graph.
+
+        If kind != '', only return True if the vertex is of the given kind.
+
+        Preconditions:
+            - kind in {'', 'user', 'song'}
+        """
+        return key in self._vertices and kind in ('', self._vertices[key].kind)
+
+    def num_users(self) -> int:
+        """Return the number of user vertices in this graph, in constant time."""
+        return len(self._kind_index['user'])
+
+    def num_songs(self) -> int:
+        """Return the number of song vertices in this graph, in constant time."""
+        return len(self._kind_index['song'])
+
     def get_neighbours(self, key: Any) -> set:
         """Return a set of the neighbours of the given item.
 
@@ -164,13 +425,46 @@ class Graph:
         If kind != '', only return the items of the given vertex kind.
 
         Preconditions:
-            - kind in {'', 'user', 'book'}
+            - kind in {'', 'user', 'song'}
         """
         if kind != '':
-            return {v.key for v in self._vertices.values() if v.kind == kind}
+            return set(self._kind_index[kind])
         else:
             return set(self._vertices.keys())
 
+    def get_ordered_vertices(self, kind: str = '') -> list:
+        """Return a list of all vertex keys in this graph, in the order they were added.
+
+        If kind != '', only return the keys of the given vertex kind.
+
+        Preconditions:
+            - kind in {'', 'user', 'song'}
+        """
+        if kind != '':
+            return list(self._kind_index[kind])
+        else:
+            return list(self._vertices)
+
+    def get_item(self, key: Any) -> Any:
+        """Return the item stored in the vertex with the given key.
+
+        Raise a ValueError if key does not appear as a vertex in this graph.
+        """
+        if key in self._vertices:
+            return self._vertices[key].item
+        else:
+            raise ValueError
+
+    def get_song_features(self, key: Any) -> SongFeatures:
+        """Return the parsed features of the song with the given key.
+
+        Raise a ValueError if key does not appear as a song vertex in this graph.
+        """
+        if key in self._vertices and self._vertices[key].kind == 'song':
+            return self._vertices[key].features
+        else:
+            raise ValueError
+
     def to_networkx(self, max_vertices: int = 5000) -> nx.Graph:
         """Convert this graph into a networkx Graph.
 
@@ -179,6 +473,8 @@ class Graph:
 
         Note that this method is provided for you, and you shouldn't change it.
         """
+        profiling = PROFILER.enabled
+        start = time.perf_counter() if profiling else 0.0
         graph_nx = nx.Graph()
         for v in self._vertices.values():
             graph_nx.add_node(v.key, kind=v.kind)
@@ -193,6 +489,10 @@ class Graph:
             if graph_nx.number_of_nodes() >= max_vertices:
                 break
 
+        if profiling:
+            PROFILER.count('to_networkx.nodes', graph_nx.number_of_nodes())
+            PROFILER.count('to_networkx.edges', graph_nx.number_of_edges())
+            PROFILER.record('to_networkx', time.perf_counter() - start)
         return graph_nx
 
     def get_similarity_score(self, item1: Any, item2: Any, genre: str, duration: str) -> float:
@@ -206,7 +506,8 @@ class Graph:
         else:
             return self._vertices[item1].similarity_score(self._vertices[item2], genre, duration)
 
-    def compatible_user_rec_songs(self, user: str, genre: str, duration: str) -> list[list]:
+    def compatible_user_rec_songs(self, user: str, genre: str, duration: str,
+                                  engine: Optional[SimilarityEngine] = None) -> list[list]:
         """
         Return the 1) recommended user's item based on similarity to the given user
         considering genre and duration and 2) The songs both users have in common and recommended songs.
@@ -215,47 +516,252 @@ class Graph:
         ["username", "name", "age", "province"]
         2) The songs both users have in common, and recommended songs.
 
+        Only the users who share at least one song with the given user are scored, since every other
+        user has a similarity score of 0. If engine is given (a SimilarityEngine, or any backend with the
+        same positive_scores method such as lsh_index.MinHashLSH), the scores are computed by it instead.
+        If several users share the highest score, the one added to this graph first is returned.
+
         The returned list should NOT contain:
             - any user with a similarity score of 0 to the input user
 
+        Raise a ValueError if no other user has a positive similarity score to the given user.
+
+        engine must be None or built from this graph (or from the base of this overlay).
+
         Preconditions:
             - user in self._vertices
             - self._vertices[user].kind == 'user'
         """
+        profiling = PROFILER.enabled
+        start = time.perf_counter() if profiling else 0.0
+        matches = self.top_k_matches(user, genre, duration, 1, engine)
+        if profiling:
+            PROFILER.count('compatible_user_rec_songs.calls')
+            PROFILER.count('compatible_user_rec_songs.no_match', not matches)
+            PROFILER.record('compatible_user_rec_songs', time.perf_counter() - start)
+        if not matches:
+            raise ValueError
+        return matches[0]
 
-        all_users = {}
-        scores = []
-
-        for u in self._vertices:
-            if self._vertices[u].kind == 'user' and u != user:
-                score = self.get_similarity_score(user, u, genre, duration)
-                if score > 0:
-                    scores.append(score)
-                    if score in all_users:
-                        all_users[score] = all_users[score] + [u]
-                    else:
-                        all_users[score] = [u]
-
-        scores.sort()
-        max_score = scores.pop()
-        # The user at the first index is returned
-        # if there are multiple users with the same compatibility score.
-        user_parameters = self._vertices[all_users[max_score][0]].item  # ["username", "name", "age", "province"]
+    def top_k_matches(self, user: str, genre: str, duration: str, k: int,
+                      engine: Optional[SimilarityEngine] = None) -> list[list[list]]:
+        """Return the k users most similar to the given user, best match first.
 
-        recommended_songs = []
-        both_songs_you_listen = []
-        songs_user_listen = []
+        Each match is formatted like the return value of compatible_user_rec_songs:
+        [["username", "name", "age", "province"], [songs in common, recommended songs], [score]].
+        Users with a similarity score of 0 are never returned, so fewer than k matches may be returned.
+        Users with the same score are ordered by when they were added to this graph.
+
+        The best matches are kept in a heap of at most k entries while the candidates are scored.
+        engine must be None or built from this graph (or from the base of this overlay).
+
+        Preconditions:
+            - user in self._vertices
+            - self._vertices[user].kind == 'user'
+            - k >= 1
+        """
+        profiling = PROFILER.enabled
+        start = time.perf_counter() if profiling else 0.0
+        if engine is not None:
+            candidates = engine.positive_scores(self.get_neighbours(user), genre, duration, exclude=user)
+        else:
+            scores = self._candidate_scores(user, genre, duration)
+            candidates = ((v.key, score, v.order) for v, score in scores.items())
+        if profiling:
+            candidates = PROFILER.counted(candidates, 'top_k_matches.candidates_scored')
+        best = select_top_k(candidates, k)
+
+        scored = time.perf_counter() if profiling else 0.0
+        matches = [[self._vertices[key].item, self._song_lists(user, key), [score]] for key, score in best]
+        if profiling:
+            PROFILER.record('top_k_matches.score', scored - start)
+            PROFILER.record('top_k_matches.song_lists', time.perf_counter() - scored)
+        return matches
+
+    def neighbourhood_rec_songs(self, user: str, genre: str, duration: str, size: Neighbourhood = Neighbourhood(),
+                                engine: Optional[SimilarityEngine] = None) -> list[str]:
+        """Return the names of up to size.songs songs recommended to the given user by their size.users most
+        similar users, best first.
+
+        Rather than copying the songs of the single best match, each of the size.users users with the highest
+        similarity scores (ties go to the user added to this graph first) votes for every song they
+        listen to and the given user does not, with their score as the weight of the vote. Songs are
+        ranked by their total weight, and songs with the same weight by when they were added to this graph.
+        The returned names are distinct, as in the recommended songs of compatible_user_rec_songs.
+
+        If engine is given, its neighbourhood_songs method computes the ranking instead.
+
+        Raise a ValueError if no other user has a positive similarity score to the given user.
+
+        engine must be None or built from this graph (or from the base of this overlay).
+
+        Preconditions:
+            - user in self._vertices
+            - self._vertices[user].kind == 'user'
+        """
+        if engine is not None:
+            ranked = engine.neighbourhood_songs(self.get_neighbours(user), genre, duration, size, exclude=user)
+            return [self._vertices[song_key].item[1] for song_key, _ in ranked]
+
+        scores = self._candidate_scores(user, genre, duration)
+        if not scores:
+            raise ValueError
+        heard = self._vertices[user].neighbours
+        voters = select_top_k(((v.key, weight, v.order) for v, weight in scores.items()), size.users)
+        totals = {}
+        for key, score in voters:
+            for song in self._vertices[key].neighbours - heard:
+                totals[song] = totals.get(song, 0) + score
+
+        ranked = sorted(totals, key=lambda s: (-totals[s], s.order))[:size.songs]
+        return [s.item[1] for s in ranked]
 
-        for s1 in self._vertices[user].neighbours:
-            songs_user_listen = songs_user_listen + [s1.item[1]]
+    def _song_lists(self, user: Any, match: Any) -> list[list]:
+        """Return the names of the songs that both users listen to, and of the songs only match listens to.
 
-        for s2 in self._vertices[user_parameters[0]].neighbours:
+        Preconditions:
+            - user in self._vertices and match in self._vertices
+        """
+        songs_user_listen = {s1.item[1] for s1 in self._vertices[user].neighbours}
+        both_songs_you_listen = []
+        recommended_songs = []
+
+        for s2 in self._vertices[match].neighbours:
             if s2.item[1] in songs_user_listen:
-                both_songs_you_listen = both_songs_you_listen + [s2.item[1]]
+                both_songs_you_listen.append(s2.item[1])
             else:
-                recommended_songs = recommended_songs + [s2.item[1]]
+                recommended_songs.append(s2.item[1])
+
+        return [both_songs_you_listen, recommended_songs]
 
-        return [user_parameters, [both_songs_you_listen, recommended_songs], [max_score]]
+    def _candidate_scores(self, user: Any, genre: str, duration: str) -> dict[_Vertex, int]:
+        """Return the similarity score of every other user who shares at least one song with the given user.
+
+        Only the listeners of the given user's songs are visited. Each shared song adds its
+        match_weight to the score of every listener, which gives the same total as similarity_score.
+
+        Preconditions:
+            - user in self._vertices
+            - self._vertices[user].kind == 'user'
+        """
+        genre_wanted = genre_code(genre.lower())
+        duration_wanted = duration_code(duration)
+
+        vertex = self._vertices[user]
+        scores = {}
+        for song in vertex.neighbours:
+            weight = song.match_weight(genre_wanted, duration_wanted)
+            for listener in song.neighbours:  # Every neighbour of a song is a user
+                if listener.key != user:
+                    scores[listener] = scores.get(listener, 0) + weight
+
+        if PROFILER.enabled:
+            PROFILER.count('top_k_matches.users_scanned', len(scores))
+            PROFILER.count('top_k_matches.common_songs',
+                           sum(len(s.neighbours) - (vertex in s.neighbours) for s in vertex.neighbours))
+        return scores
+
+    def _next_order(self) -> int:
+        """Return the order of the next vertex added to this graph."""
+        return len(self._vertices)
+
+
+class GraphOverlay(Graph):
+    """A per-query view of a base graph that can gain vertices and edges without changing the base graph.
+
+    New vertices are stored in the overlay only. When an edge touches a user vertex of the base graph,
+    that user is copied into the overlay first, so the base user keeps its original neighbours.
+    Song vertices of the base graph are never copied or changed, so an edge between an overlay user and
+    a base song is only visible from the overlay user's side.
+
+    Preconditions:
+        - the base graph is not mutated while this overlay is in use
+    """
+    # Private Instance Attributes:
+    #     - _base:
+    #         The graph this overlay is built on top of. It is never mutated by the overlay.
+    #     - _local:
+    #         The vertices owned by this overlay. Maps key to _Vertex object.
+    _base: Graph
+    _local: dict[Any, _Vertex]
+
+    def __init__(self, base: Graph) -> None:
+        """Initialize an overlay on top of the given base graph, with no vertices or edges of its own."""
+        super().__init__()
+        self._base = base
+        self._local = {}
+        self._vertices = ChainMap(self._local, base._vertices)
+        self._kind_index = {kind: ChainMap({}, keys) for kind, keys in base._kind_index.items()}
+
+    def add_edge(self, key1: Any, key2: Any) -> None:
+        """Add an edge between the two vertices with the given keys, without mutating the base graph.
+
+        Raise a ValueError if key1 or key2 do not appear as vertices in this graph.
+
+        Preconditions:
+            - key1 != key2
+        """
+        if key1 in self._vertices and key2 in self._vertices:
+            v1 = self._writable_vertex(key1)
+            v2 = self._writable_vertex(key2)
+
+            if key1 in self._local:
+                v1.neighbours.add(v2)
+            if key2 in self._local:
+                v2.neighbours.add(v1)
+            self._generation += 1
+        else:
+            raise ValueError
+
+    def remove_edge(self, key1: Any, key2: Any) -> None:
+        """Remove the edge between the two vertices with the given keys, without mutating the base graph.
+
+        Raise a ValueError if key1 and key2 are not adjacent vertices in this graph.
+        """
+        if key1 not in self._vertices or key2 not in self._vertices:
+            raise ValueError
+
+        v1 = self._writable_vertex(key1)
+        v2 = self._writable_vertex(key2)
+        if v2 not in v1.neighbours and v1 not in v2.neighbours:
+            raise ValueError
+        if key1 in self._local:
+            v1.neighbours.discard(v2)
+        if key2 in self._local:
+            v2.neighbours.discard(v1)
+        self._generation += 1
+
+    def num_users(self) -> int:
+        """Return the number of user vertices in this overlay (including those of the base graph), in constant time."""
+        return len(self._kind_index['user'].maps[0]) + self._base.num_users()
+
+    def num_songs(self) -> int:
+        """Return the number of song vertices in this overlay (including those of the base graph), in constant time."""
+        return len(self._kind_index['song'].maps[0]) + self._base.num_songs()
+
+    def _next_order(self) -> int:
+        """Return the order of the next vertex added to this overlay, after every vertex of the base graph."""
+        return len(self._base._vertices) + len(self._local)
+
+    def _writable_vertex(self, key: Any) -> _Vertex:
+        """Return the vertex with the given key, copying it into this overlay first if it is a base user.
+
+        Base song vertices are returned as they are, and must not be mutated by the caller.
+
+        Preconditions:
+            - key in self._vertices
+        """
+        if key in self._local:
+            return self._local[key]
+
+        v = self._base._vertices[key]
+        if v.kind != 'user':
+            return v
+
+        copy = _Vertex(v.key, v.item, v.kind, v.order)
+        copy.neighbours = set(v.neighbours)
+        self._local[key] = copy
+        return copy
 
 
 def load_review_graph(users: str, songs: str) -> Graph:
@@ -270,6 +776,7 @@ def load_review_graph(users: str, songs: str) -> Graph:
      use the book_names_file to find the book title associated with each book id).
 
     Use the "kind" _Vertex attribute to differentiate between the two vertex types.
+    The features of each song (see SongFeatures) are parsed once, when its vertex is created.
 
     Preconditions:
         - reviews_file is the path to a CSV file corresponding to the book review data
@@ -280,6 +787,8 @@ def load_review_graph(users: str, songs: str) -> Graph:
 
     """
 
+    profiling = PROFILER.enabled
+    start = time.perf_counter() if profiling else 0.0
     gr = Graph()
     all_songs = {}
     with open(songs, 'r', encoding='utf-8') as file:
@@ -287,12 +796,23 @@ def load_review_graph(users: str, songs: str) -> Graph:
         for row in reader:
             all_songs[row[0]] = row
 
+    songs_read = time.perf_counter() if profiling else 0.0
+    rows = 0
     with open(users, 'r', encoding='utf-8') as file:
         reader = csv.reader(file)
         for row in reader:
+            rows += 1
             gr.add_vertex(row[0], row[:4], "user")
             gr.add_vertex(row[4], all_songs[row[4]], "song")
             gr.add_edge(row[0], row[4])
+
+    if profiling:
+        end = time.perf_counter()
+        PROFILER.count('load_review_graph.songs', len(all_songs))
+        PROFILER.count('load_review_graph.rows', rows)
+        PROFILER.record('load_review_graph.read_songs', songs_read - start)
+        PROFILER.record('load_review_graph.read_users', end - songs_read)
+        PROFILER.record('load_review_graph', end - start)
     return gr
 
 
@@ -314,7 +834,7 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'max-line-length': 120,
         'disable': ['E1136'],
-        'extra-imports': ['csv', 'networkx'],
+        'extra-imports': ['csv', 'heapq', 'time', 'collections', 'networkx', 'instrumentation', 'similarity_engine'],
         'allowed-io': ['load_review_graph'],
         'max-nested-blocks': 4
     })
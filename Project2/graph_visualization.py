@@ -1,10 +1,15 @@
 """
 Visualize Graph
 """
+from typing import Any, Optional, Union
+
 import networkx as nx
-from plotly.graph_objs import Scatter, Figure
+import numpy as np
+from plotly.graph_objs import Scatter, Scattergl, Figure
 
+import clustering
 import graph_functions
+from layout_cache import cached_layout
 
 
 # Colours to use when visualizing different clusters.
@@ -20,11 +25,17 @@ VERTEX_BORDER_COLOUR = 'rgb(50, 50, 50)'
 SONG_COLOUR = 'rgb(89, 205, 105)'
 USER_COLOUR = 'rgb(105, 89, 205)'
 
+# The number of edges above which the figure is drawn with WebGL (Scattergl) instead of SVG (Scatter).
+# SVG draws every segment as a DOM element, and becomes unusable after a few thousand of them.
+WEBGL_THRESHOLD = 2000
+
 
 def visualize_graph(graph: graph_functions.Graph,
                     layout: str = 'spring_layout',
                     max_vertices: int = 5000,
-                    output_file: str = '') -> None:
+                    output_file: str = '',
+                    webgl: Optional[bool] = None,
+                    cache_dir: Optional[str] = None) -> None:
     """Use plotly and networkx to visualize the given graph.
 
     Optional arguments:
@@ -32,50 +43,13 @@ def visualize_graph(graph: graph_functions.Graph,
         - max_vertices: the maximum number of vertices that can appear in the graph
         - output_file: a filename to save the plotly image to (rather than displaying
             in your web browser)
+        - webgl: whether to draw with WebGL. By default, WebGL is used if the graph has more than
+            WEBGL_THRESHOLD edges.
+        - cache_dir: a directory to cache the layout in (see layout_cache.cached_layout), so that
+            drawing the same graph again is fast and gives the same picture. By default, the layout
+            is computed from scratch every time.
     """
-    graph_nx = graph.to_networkx(max_vertices)
-
-    pos = getattr(nx, layout)(graph_nx)
-
-    x_values = [pos[k][0] for k in graph_nx.nodes]
-    y_values = [pos[k][1] for k in graph_nx.nodes]
-    labels = list(graph_nx.nodes)
-    kinds = [graph_nx.nodes[k]['kind'] for k in graph_nx.nodes]
-
-    colours = [SONG_COLOUR if kind == 'song' else USER_COLOUR for kind in kinds]
-
-    x_edges = []
-    y_edges = []
-    for edge in graph_nx.edges:
-        x_edges += [pos[edge[0]][0], pos[edge[1]][0], None]
-        y_edges += [pos[edge[0]][1], pos[edge[1]][1], None]
-
-    trace3 = Scatter(x=x_edges,
-                     y=y_edges,
-                     mode='lines',
-                     name='edges',
-                     line=dict(color=LINE_COLOUR, width=1),
-                     hoverinfo='none',
-                     )
-    trace4 = Scatter(x=x_values,
-                     y=y_values,
-                     mode='markers',
-                     name='nodes',
-                     marker=dict(symbol='circle-dot',
-                                 size=5,
-                                 color=colours,
-                                 line=dict(color=VERTEX_BORDER_COLOUR, width=0.5)
-                                 ),
-                     text=labels,
-                     hovertemplate='%{text}',
-                     hoverlabel={'namelength': 0}
-                     )
-
-    data1 = [trace3, trace4]
-    fig = Figure(data=data1)
-    fig.update_layout({'showlegend': False})
-    fig.update_xaxes(showgrid=False, zeroline=False, visible=False)
-    fig.update_yaxes(showgrid=False, zeroline=False, visible=False)
+    fig = graph_figure(graph, layout, max_vertices, webgl, cache_dir)
 
     if output_file == '':
         fig.show()
@@ -83,74 +57,137 @@ def visualize_graph(graph: graph_functions.Graph,
         fig.write_image(output_file)
 
 
-def visualize_graph_clusters(graph: graph_functions.Graph, clusters: list[set],
+def graph_figure(graph: graph_functions.Graph,
+                 layout: str = 'spring_layout',
+                 max_vertices: int = 5000,
+                 webgl: Optional[bool] = None,
+                 cache_dir: Optional[str] = None) -> Figure:
+    """Return the plotly figure that visualize_graph shows for the given graph, without showing it.
+
+    Same optional arguments as visualize_graph (see that function for details).
+    """
+    graph_nx = graph.to_networkx(max_vertices)
+
+    pos = _layout(graph_nx, layout, cache_dir, 'graph')
+
+    colours = [SONG_COLOUR if kind == 'song' else USER_COLOUR for _, kind in graph_nx.nodes(data='kind')]
+    return _figure(graph_nx, pos, colours, webgl)
+
+
+def visualize_graph_clusters(graph: graph_functions.Graph, clusters: Union[dict[Any, int], list[set]],
                              layout: str = 'spring_layout',
                              max_vertices: int = 5000,
-                             output_file: str = '') -> None:
+                             output_file: str = '',
+                             webgl: Optional[bool] = None,
+                             cache_dir: Optional[str] = None) -> None:
     """Visualize the given graph, using different colours to illustrate the different clusters.
 
+    clusters is either a map from vertex key to cluster id (as returned by clustering.label_propagation),
+    or a list of sets of vertex keys, where the i-th set is the cluster with id i.
+
     Hides all edges that go from one cluster to another. (This helps the graph layout algorithm
     positions vertices in the same cluster close together.)
 
     Same optional arguments as visualize_graph (see that function for details).
     """
+    fig = clusters_figure(graph, clusters, layout, max_vertices, webgl, cache_dir)
+
+    if output_file == '':
+        fig.show()
+    else:
+        fig.write_image(output_file)
+
+
+def clusters_figure(graph: graph_functions.Graph, clusters: Union[dict[Any, int], list[set]],
+                    layout: str = 'spring_layout',
+                    max_vertices: int = 5000,
+                    webgl: Optional[bool] = None,
+                    cache_dir: Optional[str] = None) -> Figure:
+    """Return the plotly figure that visualize_graph_clusters shows for the given graph, without showing it.
+
+    Same arguments as visualize_graph_clusters (see that function for details).
+    Vertices that are in no cluster are drawn in SONG_COLOUR.
+    """
+    cluster_of = clusters if isinstance(clusters, dict) else clustering.membership(clusters)
+
     graph_nx = graph.to_networkx(max_vertices)
-    all_edges = list(graph_nx.edges)
-    for edge in all_edges:
-        # Check if edge is within the same cluster
-        if any((edge[0] in cluster) != (edge[1] in cluster) for cluster in clusters):
-            graph_nx.remove_edge(edge[0], edge[1])
+    # Keep only the edges within one cluster (or between two vertices that are in no cluster).
+    graph_nx.remove_edges_from([(u, v) for u, v in graph_nx.edges if cluster_of.get(u) != cluster_of.get(v)])
 
-    pos = getattr(nx, layout)(graph_nx)
+    pos = _layout(graph_nx, layout, cache_dir, 'clusters')
 
-    x_values = [pos[k][0] for k in graph_nx.nodes]
-    y_values = [pos[k][1] for k in graph_nx.nodes]
-    labels = list(graph_nx.nodes)
+    colors = [SONG_COLOUR if k not in cluster_of else COLOUR_SCHEME[cluster_of[k] % len(COLOUR_SCHEME)]
+              for k in graph_nx.nodes]
+    return _figure(graph_nx, pos, colors, webgl)
+
+
+def edge_coordinates(graph_nx: nx.Graph, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the x and y coordinates of the line segments of the edges of graph_nx.
+
+    positions[i] is the (x, y) position of the i-th node of graph_nx. Each edge becomes three entries:
+    the coordinates of its two ends, then NaN, which plotly draws as a gap between segments.
+
+    >>> g = nx.Graph([('a', 'b')])
+    >>> x_edges, y_edges = edge_coordinates(g, np.array([[0.0, 1.0], [2.0, 3.0]]))
+    >>> x_edges.tolist()[:2], y_edges.tolist()[:2]
+    ([0.0, 2.0], [1.0, 3.0])
+    """
+    index = {node: i for i, node in enumerate(graph_nx.nodes)}
+    ends = np.fromiter((index[end] for edge in graph_nx.edges for end in edge), dtype=np.int64,
+                       count=2 * graph_nx.number_of_edges()).reshape(-1, 2)
 
-    colors = []
-    for k in graph_nx.nodes:
-        for i, c in enumerate(clusters):
-            if k in c:
-                colors.append(COLOUR_SCHEME[i % len(COLOUR_SCHEME)])
-                break
-        else:
-            colors.append(SONG_COLOUR)
-
-    x_edges = []
-    y_edges = []
-    for edge in graph_nx.edges:
-        x_edges += [pos[edge[0]][0], pos[edge[1]][0], None]
-        y_edges += [pos[edge[0]][1], pos[edge[1]][1], None]
-
-    trace3 = Scatter(x=x_edges,
-                     y=y_edges,
-                     mode='lines',
-                     name='edges',
-                     line=dict(color=LINE_COLOUR, width=1),
-                     hoverinfo='none'
-                     )
-    trace4 = Scatter(x=x_values,
-                     y=y_values,
-                     mode='markers',
-                     name='nodes',
-                     marker=dict(symbol='circle-dot',
-                                 size=5,
-                                 color=colors,
-                                 line=dict(color=VERTEX_BORDER_COLOUR, width=0.5)
-                                 ),
-                     text=labels,
-                     hovertemplate='%{text}',
-                     hoverlabel={'namelength': 0}
-                     )
+    segments = np.full((len(ends), 3, 2), np.nan)
+    segments[:, 0] = positions[ends[:, 0]]
+    segments[:, 1] = positions[ends[:, 1]]
+    return segments[:, :, 0].ravel(), segments[:, :, 1].ravel()
+
+
+def _layout(graph_nx: nx.Graph, layout: str, cache_dir: Optional[str], name: str) -> dict[Any, Any]:
+    """Return the positions of the nodes of graph_nx in the given layout, cached in cache_dir if it is not None."""
+    if cache_dir is None:
+        return getattr(nx, layout)(graph_nx)
+    return cached_layout(graph_nx, layout, cache_dir, name)
+
+
+def _figure(graph_nx: nx.Graph, pos: dict[Any, Any], colours: list[str], webgl: Optional[bool]) -> Figure:
+    """Return the figure of the nodes of graph_nx, at the positions pos and with the given colours,
+    and of its edges.
+
+    If webgl is None, WebGL is used if graph_nx has more than WEBGL_THRESHOLD edges.
+    """
+    if webgl is None:
+        webgl = graph_nx.number_of_edges() > WEBGL_THRESHOLD
+    trace = Scattergl if webgl else Scatter
+
+    labels = list(graph_nx.nodes)
+    positions = np.array([pos[k] for k in labels], dtype=float).reshape(-1, 2)
+    x_edges, y_edges = edge_coordinates(graph_nx, positions)
+
+    trace3 = trace(x=x_edges,
+                   y=y_edges,
+                   mode='lines',
+                   name='edges',
+                   line=dict(color=LINE_COLOUR, width=1),
+                   hoverinfo='none'
+                   )
+    trace4 = trace(x=positions[:, 0],
+                   y=positions[:, 1],
+                   mode='markers',
+                   name='nodes',
+                   # WebGL has no 'circle-dot' marker, but its 'circle' also has a border.
+                   marker=dict(symbol='circle' if webgl else 'circle-dot',
+                               size=5,
+                               color=colours,
+                               line=dict(color=VERTEX_BORDER_COLOUR, width=0.5)
+                               ),
+                   text=labels,
+                   hovertemplate='%{text}',
+                   hoverlabel={'namelength': 0}
+                   )
 
     data1 = [trace3, trace4]
     fig = Figure(data=data1)
     fig.update_layout({'showlegend': False})
     fig.update_xaxes(showgrid=False, zeroline=False, visible=False)
     fig.update_yaxes(showgrid=False, zeroline=False, visible=False)
-    fig.show()
-
-    if output_file == '':
-        fig.show()
-    else:
-        fig.write_image(output_file)
+    return fig
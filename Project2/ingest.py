@@ -0,0 +1,236 @@
+"""CSC111 Project 2: Parallel Ingestion
+
+Loads very large listen logs into a user-song graph. The user file is split into byte ranges
+that are parsed by a pool of processes, and the partial adjacency of each range is merged into
+the graph in file order as soon as it is ready. Only a bounded window of ranges is handed to the
+pool at a time, so parsed ranges never pile up faster than they are merged.
+"""
+from __future__ import annotations
+import csv
+import multiprocessing
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from compact_graph import CompactGraph
+
+# The default number of bytes of the user file parsed by one task.
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# The number of ranges submitted to the pool per worker process before the first of them is merged.
+PENDING_PER_PROCESS = 2
+
+# The song ids of the song file, set in each worker process by _init_worker.
+_known_songs = frozenset()
+
+
+class IngestStats:
+    """Progress and totals of an ingestion run.
+
+    Instance Attributes:
+        - rows: the number of listen rows read so far
+        - listens: the number of rows that were added to the graph as edges
+        - unknown_songs: the number of rows skipped because their song id is not in the song file
+        - malformed: the number of rows skipped because they have fewer than 5 fields
+        - bytes_read: the number of bytes of the user file parsed so far
+        - total_bytes: the size of the user file
+        - seconds: the time elapsed since the run started
+
+    Representation Invariants:
+        - self.rows == self.listens + self.unknown_songs + self.malformed
+        - 0 <= self.bytes_read <= self.total_bytes
+    """
+    rows: int
+    listens: int
+    unknown_songs: int
+    malformed: int
+    bytes_read: int
+    total_bytes: int
+    seconds: float
+
+    def __init__(self, total_bytes: int) -> None:
+        """Initialize the statistics of a run over a user file of the given size."""
+        self.rows = 0
+        self.listens = 0
+        self.unknown_songs = 0
+        self.malformed = 0
+        self.bytes_read = 0
+        self.total_bytes = total_bytes
+        self.seconds = 0.0
+
+    def rows_per_second(self) -> float:
+        """Return the number of rows read per second so far."""
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        """Return a one-line progress report of this run."""
+        percent = 100 * self.bytes_read / self.total_bytes if self.total_bytes > 0 else 100.0
+        return (f'{percent:.1f}% | {self.rows} rows ({self.rows_per_second():.0f} rows/s) | '
+                f'{self.unknown_songs} unknown songs | {self.malformed} malformed')
+
+
+def ingest_review_graph(users: str, songs: str, graph: Optional[Any] = None, processes: Optional[int] = None,
+                        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                        progress: Optional[Callable[[IngestStats], None]] = None) -> tuple[Any, IngestStats]:
+    """Return the user-song graph of the given datasets, and the statistics of loading it.
+
+    The graph has the same vertices and edges as load_review_graph(users, songs), and its users are
+    added in the same order. Rows whose song id is not in the song file are skipped and counted
+    instead of raising a KeyError.
+
+    Optional arguments:
+        - graph: the empty graph to add the vertices and edges to (a new CompactGraph by default)
+        - processes: the number of worker processes (os.cpu_count() by default; 1 parses in this process)
+        - chunk_bytes: the approximate number of bytes of the user file parsed by one task.
+          At most PENDING_PER_PROCESS chunks per process are parsed or waiting to be merged at once.
+        - progress: a function called with the current statistics after each chunk is merged
+
+    Preconditions:
+        - users and songs are in the formats expected by load_review_graph
+        - every record of users fits on one line
+        - chunk_bytes > 0
+    """
+    start = time.perf_counter()
+    if graph is None:
+        graph = CompactGraph()
+
+    all_songs = {}
+    with open(songs, 'r', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            all_songs[row[0]] = row
+
+    stats = IngestStats(os.path.getsize(users))
+    tasks = [(users, begin, end) for begin, end in line_ranges(users, chunk_bytes)]
+
+    if processes == 1:
+        _init_worker(frozenset(all_songs))
+        _merge_all(graph, map(_parse_range, tasks), all_songs, stats, start, progress)
+    else:
+        processes = processes or os.cpu_count() or 1
+        with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(frozenset(all_songs),)) as pool:
+            parts = _bounded_imap(pool, tasks, PENDING_PER_PROCESS * processes)
+            _merge_all(graph, parts, all_songs, stats, start, progress)
+
+    stats.seconds = time.perf_counter() - start
+    return graph, stats
+
+
+def line_ranges(path: str, chunk_bytes: int) -> list[tuple[int, int]]:
+    """Return the (begin, end) byte ranges that split the file at path into chunks of whole lines.
+
+    Each range is about chunk_bytes long, and together the ranges cover the file exactly once.
+
+    Preconditions:
+        - chunk_bytes > 0
+    """
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as file:
+        while boundaries[-1] + chunk_bytes < size:
+            file.seek(boundaries[-1] + chunk_bytes)
+            file.readline()
+            boundaries.append(min(file.tell(), size))
+    if boundaries[-1] < size or size == 0:
+        boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def _bounded_imap(pool: multiprocessing.pool.Pool, tasks: list[tuple[str, int, int]],
+                  window: int) -> Iterator[tuple]:
+    """Yield _parse_range(task) for each task, in order, with at most window tasks submitted to pool
+    and not yet yielded at any time.
+
+    Preconditions:
+        - window >= 1
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(_parse_range, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def _merge_all(graph: Any, parts: Iterable[tuple], all_songs: dict[str, list], stats: IngestStats, start: float,
+               progress: Optional[Callable[[IngestStats], None]]) -> None:
+    """Merge the given partial adjacencies (see _parse_range) into graph, in order, updating stats.
+
+    Each song vertex is added once, the first time a range lists it, and the edges of each user of
+    a range are added with one add_edges call.
+    """
+    added_songs = set()
+    for users, songs, user_songs, listens, unknown, malformed, size in parts:
+        for item in users:
+            graph.add_vertex(item[0], item, 'user')
+        for song in songs:
+            if song not in added_songs:
+                added_songs.add(song)
+                graph.add_vertex(song, all_songs[song], 'song')
+        for user, listened in user_songs.items():
+            graph.add_edges(user, listened)
+
+        stats.listens += listens
+        stats.unknown_songs += unknown
+        stats.malformed += malformed
+        stats.rows += listens + unknown + malformed
+        stats.bytes_read += size
+        stats.seconds = time.perf_counter() - start
+        if progress is not None:
+            progress(stats)
+
+
+def _init_worker(known_songs: frozenset) -> None:
+    """Store the song ids of the song file for the _parse_range calls of this process."""
+    global _known_songs
+    _known_songs = known_songs
+
+
+def _parse_range(task: tuple[str, int, int]) -> tuple[list[list[str]], list[str], dict[str, list[str]],
+                                                      int, int, int, int]:
+    """Parse the rows in the byte range [begin, end) of the user file, given as (path, begin, end).
+
+    Return (the items of the users in the range, in order of first appearance,
+    the distinct known song ids of the range, in order of first appearance,
+    a map from each user of the range to the known song ids of their rows (repeats included),
+    the number of rows with a known song, the number of rows with an unknown song,
+    the number of malformed rows, the number of bytes parsed).
+    """
+    path, begin, end = task
+    with open(path, 'rb') as file:
+        file.seek(begin)
+        lines = file.read(end - begin).decode('utf-8').splitlines()
+
+    users = {}
+    songs = {}
+    user_songs = {}
+    listens = 0
+    unknown = 0
+    malformed = 0
+    for row in csv.reader(lines):
+        if len(row) < 5:
+            malformed += len(row) > 0
+        elif row[4] not in _known_songs:
+            unknown += 1
+        else:
+            users.setdefault(row[0], row[:4])
+            songs.setdefault(row[4], None)
+            user_songs.setdefault(row[0], []).append(row[4])
+            listens += 1
+    return list(users.values()), list(songs), user_songs, listens, unknown, malformed, end - begin
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['csv', 'multiprocessing', 'os', 'time', 'collections', 'compact_graph'],
+        'allowed-io': ['ingest_review_graph', 'line_ranges', '_parse_range'],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,218 @@
+"""CSC111 Project 2: Instrumentation
+
+Optional timers, counters and latency histograms for the hot paths of the recommender, such as
+load_review_graph and Graph.compatible_user_rec_songs.
+
+Instrumentation is off by default. The instrumented functions check PROFILER.enabled once per call and
+skip all recording when it is False, so the cost of leaving it off is one attribute lookup per call.
+It can be turned on with PROFILER.enable(), or for a whole run by setting the environment variable
+HARMONIFY_PROFILE=1.
+
+    >>> PROFILER.reset()
+    >>> PROFILER.enable()
+    >>> PROFILER.record('example', 0.002)
+    >>> PROFILER.count('example.calls')
+    >>> stats = PROFILER.stats()
+    >>> stats['counters']['example.calls'], stats['timers']['example']['count']
+    (1, 1)
+    >>> PROFILER.disable()
+"""
+from __future__ import annotations
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+
+# The upper bounds (in seconds) of the latency histogram buckets: 1 microsecond, doubling up to about 67 seconds.
+# A duration longer than the last bound is counted in one more overflow bucket.
+BUCKET_BOUNDS = tuple(1e-6 * 2 ** i for i in range(27))
+
+
+class LatencyHistogram:
+    """A histogram of durations, with buckets whose upper bounds are BUCKET_BOUNDS.
+
+    Instance Attributes:
+        - count: the number of durations recorded
+        - total: the sum of the durations recorded, in seconds
+        - minimum: the shortest duration recorded (inf if there are none)
+        - maximum: the longest duration recorded (0.0 if there are none)
+        - buckets: buckets[i] is the number of durations in (BUCKET_BOUNDS[i - 1], BUCKET_BOUNDS[i]],
+          and buckets[-1] is the number longer than BUCKET_BOUNDS[-1]
+
+    Representation Invariants:
+        - len(self.buckets) == len(BUCKET_BOUNDS) + 1
+        - sum(self.buckets) == self.count
+    """
+    count: int
+    total: float
+    minimum: float
+    maximum: float
+    buckets: list[int]
+
+    def __init__(self) -> None:
+        """Initialize an empty histogram."""
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, seconds: float) -> None:
+        """Record one duration of the given number of seconds."""
+        self.count += 1
+        self.total += seconds
+        self.minimum = min(self.minimum, seconds)
+        self.maximum = max(self.maximum, seconds)
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+    def percentile(self, p: float) -> float:
+        """Return an upper bound of the p-th percentile of the recorded durations, or 0.0 if there are none.
+
+        The bound is the upper bound of the bucket the percentile falls in, capped by the longest duration.
+
+        Preconditions:
+            - 0 <= p <= 100
+
+        >>> histogram = LatencyHistogram()
+        >>> for seconds in (0.0015, 0.0015, 0.0015, 0.5):
+        ...     histogram.add(seconds)
+        >>> histogram.percentile(50) == 1e-6 * 2 ** 11
+        True
+        >>> histogram.percentile(100)
+        0.5
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(1, round(p / 100 * self.count))
+        seen = 0
+        for i, number in enumerate(self.buckets):
+            seen += number
+            if seen >= rank:
+                return min(BUCKET_BOUNDS[i], self.maximum) if i < len(BUCKET_BOUNDS) else self.maximum
+        return self.maximum
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return a JSON-serializable summary of this histogram."""
+        return {'count': self.count, 'total_seconds': self.total,
+                'mean_seconds': self.total / self.count if self.count else 0.0,
+                'min_seconds': self.minimum if self.count else 0.0, 'max_seconds': self.maximum,
+                'p50_seconds': self.percentile(50), 'p90_seconds': self.percentile(90),
+                'p99_seconds': self.percentile(99), 'bucket_bounds_seconds': list(BUCKET_BOUNDS),
+                'buckets': list(self.buckets)}
+
+
+class Profiler:
+    """A thread-safe collection of named counters and stage timers.
+
+    Stage names are dotted, with the instrumented function first, e.g. 'load_review_graph.read_users'.
+
+    Instance Attributes:
+        - enabled: whether the instrumented functions record anything
+    """
+    enabled: bool
+    # Private Instance Attributes:
+    #     - _counters:
+    #         Maps each counter name to its value.
+    #     - _timers:
+    #         Maps each timer name to the histogram of its recorded durations.
+    #     - _lock:
+    #         Held while a counter or timer is updated or read.
+    _counters: dict[str, int]
+    _timers: dict[str, LatencyHistogram]
+    _lock: threading.Lock
+
+    def __init__(self, enabled: bool = False) -> None:
+        """Initialize a profiler with no counters or timers."""
+        self.enabled = enabled
+        self._counters = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        """Start recording."""
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop recording. What has been recorded so far is kept."""
+        self.enabled = False
+
+    def reset(self) -> None:
+        """Discard every counter and timer recorded so far."""
+        with self._lock:
+            self._counters = {}
+            self._timers = {}
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add amount to the counter with the given name."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record one duration of the given number of seconds in the timer with the given name."""
+        with self._lock:
+            if name not in self._timers:
+                self._timers[name] = LatencyHistogram()
+            self._timers[name].add(seconds)
+
+    def counted(self, items: Iterable, name: str) -> Iterator:
+        """Yield every item of items, then add the number of items to the counter with the given name."""
+        number = 0
+        for item in items:
+            number += 1
+            yield item
+        self.count(name, number)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Time the body of a with statement in the timer with the given name, if this profiler is enabled."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    @contextmanager
+    def profiling(self) -> Iterator[Profiler]:
+        """Enable this profiler for the body of a with statement, and restore its previous state after."""
+        previous = self.enabled
+        self.enabled = True
+        try:
+            yield self
+        finally:
+            self.enabled = previous
+
+    def stats(self) -> dict[str, Any]:
+        """Return a JSON-serializable copy of every counter and timer recorded so far."""
+        with self._lock:
+            return {'counters': dict(sorted(self._counters.items())),
+                    'timers': {name: self._timers[name].to_dict() for name in sorted(self._timers)}}
+
+    def dump(self, path: str) -> None:
+        """Write the stats of this profiler to a JSON file at path."""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.stats(), file, indent=2)
+
+
+# The profiler used by the instrumented functions.
+PROFILER = Profiler(enabled=os.environ.get('HARMONIFY_PROFILE', '') not in ('', '0'))
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['bisect', 'json', 'os', 'threading', 'time', 'contextlib'],
+        'allowed-io': ['Profiler.dump'],
+        'max-nested-blocks': 4
+    })
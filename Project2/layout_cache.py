@@ -0,0 +1,179 @@
+"""CSC111 Project 2: Layout Cache
+
+Caches the node positions of graph layouts on disk, so that visualizing the same graph again is
+nearly instant and draws the same picture.
+
+Each cache file holds the latest layout computed with one set of layout parameters, together with a
+fingerprint of the graph it was computed for. If the graph is unchanged, the cached positions are
+returned as they are. If it only gained a few nodes (at most WARM_START_FRACTION of its nodes are new,
+and no cached node or edge between cached nodes was removed or added), the cached nodes keep their
+positions and only the new nodes are placed, each next to its neighbours. Any other change, including
+rewired edges between the same nodes, reruns the layout, starting from the cached positions if the
+layout accepts a starting position, which converges faster and keeps the picture similar.
+"""
+import hashlib
+import inspect
+import json
+import os
+from typing import Any, Optional
+
+import networkx as nx
+import numpy as np
+
+# The default directory of the layout cache files.
+LAYOUT_CACHE_DIR = '.layout_cache'
+
+# The largest fraction of new nodes that are placed next to their neighbours instead of rerunning the layout.
+WARM_START_FRACTION = 0.1
+
+# The version of the cache file format. Files of another version are ignored.
+LAYOUT_CACHE_VERSION = 1
+
+
+def graph_fingerprint(graph_nx: nx.Graph) -> str:
+    """Return a hex digest that only depends on the nodes and edges of the given graph, in any order.
+
+    >>> path = nx.Graph([('a', 'b'), ('b', 'c')])
+    >>> graph_fingerprint(path) == graph_fingerprint(nx.Graph([('c', 'b'), ('b', 'a')]))
+    True
+    >>> graph_fingerprint(nx.Graph([('a', 'b')])) == graph_fingerprint(nx.Graph([('a', 'c')]))
+    False
+    """
+    digest = hashlib.sha256()
+    for node in sorted(str(node) for node in graph_nx.nodes):
+        digest.update(node.encode('utf-8') + b'\0')
+    digest.update(b'\1')
+    for edge in sorted('\0'.join(sorted((str(u), str(v)))) for u, v in graph_nx.edges):
+        digest.update(edge.encode('utf-8') + b'\1')
+    return digest.hexdigest()
+
+
+def cached_layout(graph_nx: nx.Graph, layout: str = 'spring_layout', cache_dir: str = LAYOUT_CACHE_DIR,
+                  name: str = '', seed: int = 0, **kwargs: Any) -> dict[Any, np.ndarray]:
+    """Return the positions of the nodes of graph_nx in the given networkx layout, using the cache in cache_dir.
+
+    name tells apart the layouts of different kinds of graphs drawn with the same parameters (such as
+    a graph and its clusters), so they do not replace each other's cache file. seed and kwargs are passed
+    to the layout function (seed only if it accepts one), so a fresh layout is the same on every run.
+
+    Preconditions:
+        - layout is the name of a networkx layout function
+    """
+    path = os.path.join(cache_dir, _parameters_key(layout, name, seed, kwargs) + '.json')
+    fingerprint = graph_fingerprint(graph_nx)
+    cached = _read_positions(path)
+
+    if cached is not None and cached['fingerprint'] == fingerprint:
+        return {node: np.array(cached['positions'][str(node)]) for node in graph_nx.nodes}
+
+    previous = {} if cached is None else cached['positions']
+    known = {node: np.array(previous[str(node)]) for node in graph_nx.nodes if str(node) in previous}
+    new_nodes = graph_nx.number_of_nodes() - len(known)
+    # The cached nodes can only keep their positions if the cached graph is exactly the part of graph_nx
+    # between them: no cached node was removed, and no edge between cached nodes changed.
+    only_added = known and graph_fingerprint(graph_nx.subgraph(known)) == cached['fingerprint']
+    if only_added and new_nodes <= WARM_START_FRACTION * graph_nx.number_of_nodes():
+        pos = place_new_nodes(graph_nx, known, seed)
+    else:
+        pos = _run_layout(graph_nx, layout, seed, known, kwargs)
+
+    _write_positions(path, fingerprint, pos)
+    return pos
+
+
+def place_new_nodes(graph_nx: nx.Graph, known: dict[Any, np.ndarray], seed: int = 0) -> dict[Any, np.ndarray]:
+    """Return the positions of every node of graph_nx, keeping the known positions and placing the other nodes.
+
+    A new node is placed at the mean position of its placed neighbours, plus a small random offset so
+    that nodes with the same neighbours do not overlap. New nodes with no placed neighbour (even after
+    the other new nodes are placed) are placed at random within the known positions.
+
+    >>> g = nx.Graph([('a', 'b'), ('b', 'c'), ('c', 'd')])
+    >>> pos = place_new_nodes(g, {'a': np.array([0.0, 0.0]), 'c': np.array([1.0, 0.0])})
+    >>> bool(abs(pos['b'][0] - 0.5) < 0.1 and abs(pos['d'][0] - 1.0) < 0.1)
+    True
+    """
+    rng = np.random.default_rng(seed)
+    pos = dict(known)
+    points = np.array(list(known.values())) if known else np.zeros((1, 2))
+    low, high = points.min(axis=0), points.max(axis=0)
+    jitter = 0.02 * max(float((high - low).max()), 1.0)
+
+    remaining = [node for node in graph_nx.nodes if node not in pos]
+    while remaining:
+        unplaced = []
+        for node in remaining:
+            neighbours = [pos[u] for u in graph_nx.neighbors(node) if u in pos]
+            if neighbours:
+                pos[node] = np.mean(neighbours, axis=0) + rng.uniform(-jitter, jitter, 2)
+            else:
+                unplaced.append(node)
+        if len(unplaced) == len(remaining):
+            for node in unplaced:
+                pos[node] = rng.uniform(low, high)
+            unplaced = []
+        remaining = unplaced
+    return {node: pos[node] for node in graph_nx.nodes}
+
+
+def _run_layout(graph_nx: nx.Graph, layout: str, seed: int, known: dict[Any, np.ndarray],
+                kwargs: dict[str, Any]) -> dict[Any, np.ndarray]:
+    """Return the positions of the nodes of graph_nx in the given layout, starting from the known positions
+    (with the other nodes placed next to their neighbours) if the layout accepts a starting position."""
+    function = getattr(nx, layout)
+    parameters = inspect.signature(function).parameters
+    arguments = dict(kwargs)
+    if 'seed' in parameters:
+        arguments['seed'] = seed
+    if known and 'pos' in parameters:
+        arguments['pos'] = place_new_nodes(graph_nx, known, seed)
+    return {node: np.asarray(position) for node, position in function(graph_nx, **arguments).items()}
+
+
+def _parameters_key(layout: str, name: str, seed: int, kwargs: dict[str, Any]) -> str:
+    """Return the file name (without extension) of the cache file of the given layout parameters."""
+    parameters = json.dumps([layout, name, seed, sorted(kwargs.items())], default=str)
+    return f'{layout}-{hashlib.sha256(parameters.encode("utf-8")).hexdigest()[:16]}'
+
+
+def _read_positions(path: str) -> Optional[dict[str, Any]]:
+    """Return the contents of the cache file at path, or None if it is missing, unreadable or of another version."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return cached if cached.get('version') == LAYOUT_CACHE_VERSION else None
+
+
+def _write_positions(path: str, fingerprint: str, pos: dict[Any, np.ndarray]) -> None:
+    """Write the given positions of the graph with the given fingerprint to the cache file at path.
+
+    The file is written next to path first and then moved into place, so a reader never sees a partly
+    written file. A cache that cannot be written is skipped, since it only makes later layouts faster.
+    """
+    contents = {'version': LAYOUT_CACHE_VERSION, 'fingerprint': fingerprint,
+                'positions': {str(node): [float(x) for x in position] for node, position in pos.items()}}
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(contents, file)
+        os.replace(temporary, path)
+    except OSError:
+        pass
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['hashlib', 'inspect', 'json', 'os', 'networkx', 'numpy'],
+        'allowed-io': ['_read_positions', '_write_positions'],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,155 @@
+"""CSC111 Project 2: Service Load Test
+
+Sends random match queries to a running recommendation service (see service.py) over many concurrent
+keep-alive connections, and reports the throughput and latency percentiles as JSON.
+
+Each query is a random list of song ids with a random genre and duration, as a person who is not in
+the graph would send. Song ids are drawn from '1' to the number of songs reported by /health, the ids
+of songs_by_popularity.csv. This module only talks HTTP, so it imports nothing from the recommender.
+
+Usage:
+    python load_test.py --port 8111 --concurrency 32 --requests 5000
+    python load_test.py --check  (runs the doctests and python_ta instead)
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from typing import Any, Optional
+
+# The genres of the random queries: the most common genres of songs_by_popularity.csv.
+GENRES = ('dance', 'latino', 'pop', 'hip-hop', 'latin', 'k-pop', 'indie-pop', 'alt-rock', 'piano', 'rock',
+          'edm', 'country')
+
+# The durations of the random queries: every duration bucket of graph_functions.DURATION_BUCKETS.
+DURATIONS = ('short', 'medium', 'long')
+
+
+async def run_load_test(host: str = '127.0.0.1', port: int = 8111, concurrency: int = 16, requests: int = 1000,
+                        songs_per_query: int = 10, k: int = 1, seed: int = 0) -> dict[str, Any]:
+    """Send the given number of random /match queries to the service at host:port over concurrency
+    connections, and return the results: the throughput, the latency percentiles (in ms), and the
+    number of requests of each status.
+
+    Preconditions:
+        - concurrency >= 1 and requests >= 1 and songs_per_query >= 1 and k >= 1
+        - a service is listening at host:port
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    _, info = await _request(reader, writer, 'GET', '/health', None)
+    writer.close()
+    num_songs = info['songs']
+
+    queries = random_queries(random.Random(seed), num_songs, requests, songs_per_query, k)
+    latencies = []
+    statuses = {}
+    matched = 0
+
+    async def client(share: list[dict[str, Any]]) -> None:
+        """Send the given queries one after another over one connection."""
+        nonlocal matched
+        client_reader, client_writer = await asyncio.open_connection(host, port)
+        try:
+            for query in share:
+                start = time.perf_counter()
+                status, response = await _request(client_reader, client_writer, 'POST', '/match', query)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+                matched += status == 200 and len(response['matches']) > 0
+        finally:
+            client_writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(queries[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if requests > 1 else latencies * 99
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed,
+        'latency_ms': {'p50': percentiles[49] * 1000, 'p90': percentiles[89] * 1000,
+                       'p99': percentiles[98] * 1000, 'max': max(latencies) * 1000},
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': requests - statuses.get(200, 0),
+        'matched': matched
+    }
+
+
+def random_queries(rng: random.Random, num_songs: int, count: int, songs_per_query: int,
+                   k: int) -> list[dict[str, Any]]:
+    """Return count random /match query bodies for a graph with songs '1' to str(num_songs).
+
+    >>> queries = random_queries(random.Random(0), 200, 3, 5, 1)
+    >>> len(queries), len(queries[0]['songs']), queries[0]['duration'] in DURATIONS
+    (3, 5, True)
+
+    Preconditions:
+        - num_songs >= 1 and count >= 1 and songs_per_query >= 1 and k >= 1
+    """
+    size = min(songs_per_query, num_songs)
+    return [{'songs': [str(song) for song in rng.sample(range(1, num_songs + 1), size)],
+             'genre': rng.choice(GENRES), 'duration': rng.choice(DURATIONS), 'k': k}
+            for _ in range(count)]
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str,
+                   body: Optional[dict[str, Any]]) -> tuple[int, dict[str, Any]]:
+    """Send one keep-alive HTTP request with the given JSON body, and return the status and JSON body
+    of the response."""
+    encoded = b'' if body is None else json.dumps(body).encode('utf-8')
+    head = (f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(encoded)}\r\n\r\n')
+    writer.write(head.encode('latin-1') + encoded)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the load test with the given command line arguments."""
+    parser = argparse.ArgumentParser(description='Load test a running recommendation service.')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the service')
+    parser.add_argument('--port', type=int, default=8111, help='port of the service')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of concurrent connections')
+    parser.add_argument('--requests', type=int, default=1000, help='total number of queries')
+    parser.add_argument('--songs-per-query', type=int, default=10, help='number of songs in each query')
+    parser.add_argument('--k', type=int, default=1, help='number of matches asked for')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random queries')
+    args = parser.parse_args(argv)
+    results = asyncio.run(run_load_test(args.host, args.port, args.concurrency, args.requests,
+                                        args.songs_per_query, args.k, args.seed))
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        import doctest
+
+        doctest.testmod()
+
+        import python_ta
+
+        python_ta.check_all(config={
+            'max-line-length': 120,
+            'extra-imports': ['argparse', 'asyncio', 'json', 'random', 'statistics', 'sys', 'time'],
+            'allowed-io': ['main'],
+            'max-nested-blocks': 4
+        })
+    else:
+        main()
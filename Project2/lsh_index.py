@@ -0,0 +1,261 @@
+"""CSC111 Project 2: Approximate Matching Index
+
+An optional MinHash/LSH index over the song sets of the users of a graph. A query only looks at
+the users that share an LSH bucket with it, instead of scoring every user, and those candidates
+are then re-ranked with their exact similarity scores.
+
+The index is approximate: a match that never shares a bucket with the query is missed, and the
+similarity score (which also weighs genre and duration) can rank highly a user whose song set has a
+low Jaccard similarity with the query. The defaults use bands of one row, which make almost every
+user who shares a song with the query a candidate. On all_user_data_200_songs.csv they reach a
+recall@5 of 1.00 against the exact top 5 (see measure_recall), while 128 permutations in 64 bands
+of two rows reach only 0.64. Bands of more rows give fewer candidates and faster queries, at a lower
+recall; measure it on the target graph before lowering it. On small graphs like the bundled one, the
+exact co-listener scan of Graph.top_k_matches is faster than any setting of this index, so the index
+is only worth building for graphs whose popular songs have very many listeners.
+"""
+from __future__ import annotations
+import random
+import time
+import zlib
+from typing import Any, Iterable, Iterator, Optional
+
+import numpy as np
+
+from graph_functions import Graph, duration_code, genre_code, song_weight
+
+# The prime modulus of the MinHash permutations. It is larger than every 32-bit song hash.
+PRIME = 4294967311
+
+
+class MinHashLSH:
+    """A MinHash/LSH index of the users of a graph, by the set of songs each user listens to.
+
+    Each user gets a signature of num_perm MinHash values, split into bands of rows_per_band values.
+    Two users are candidates for each other if all values of at least one band are equal. This happens
+    with probability 1 - (1 - J ** rows_per_band) ** bands for two users with Jaccard similarity J,
+    so more bands (of fewer rows) give a higher recall and more candidates per query, and a larger
+    num_perm gives a more selective index that takes longer to build.
+
+    The index can be passed as the engine of Graph.top_k_matches and Graph.compatible_user_rec_songs,
+    and can be kept up to date by subscribing it to its graph (see Graph.subscribe).
+    Its candidates are scored exactly, so every returned score is the true similarity score,
+    but a match that never shares a bucket with the query is missed, so the results are only the
+    exact ones when the recall is 1 (see the module docstring).
+
+    Instance Attributes:
+        - users: the user keys, in the order they were added to the graph
+        - num_perm: the number of MinHash values in each signature
+        - bands: the number of LSH bands
+        - rows_per_band: the number of MinHash values in each band
+        - build_seconds: how long building the index took
+
+    Representation Invariants:
+        - self.num_perm == self.bands * self.rows_per_band
+        - self._signatures.shape[0] + len(self._new_signatures) == len(self.users)
+        - len(self._buckets) == self.bands
+    """
+    users: list
+    num_perm: int
+    bands: int
+    rows_per_band: int
+    build_seconds: float
+    # Private Instance Attributes:
+    #     - _graph:
+    #         The graph this index was built from, used to score the candidates exactly.
+    #     - _coefficients:
+    #         The (a, b) coefficients of the num_perm hash permutations x -> (a * x + b) mod PRIME.
+    #     - _rows:
+    #         Maps each user key to its row (its position in users).
+    #     - _signatures:
+    #         The MinHash signature of each user that was in the graph when this index was built.
+    #         A user with no songs has a signature of all PRIME, and is not in any bucket.
+    #     - _new_signatures:
+    #         Maps the row of each user added to the graph since then to their signature.
+    #     - _buckets:
+    #         For each band, maps the bytes of a band of a signature to the rows of the users with that band.
+    _graph: Graph
+    _coefficients: np.ndarray
+    _rows: dict[Any, int]
+    _signatures: np.ndarray
+    _new_signatures: dict[int, np.ndarray]
+    _buckets: list[dict[bytes, set[int]]]
+
+    def __init__(self, graph: Graph, num_perm: int = 128, bands: int = 128, seed: int = 0) -> None:
+        """Initialize an index of the users of the given graph.
+
+        Users who listen to no songs are not indexed, since they can never be a match.
+
+        Preconditions:
+            - num_perm >= 1 and bands >= 1
+            - num_perm % bands == 0
+        """
+        start = time.perf_counter()
+        self._graph = graph
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.users = graph.get_ordered_vertices('user')
+        self._rows = {user: row for row, user in enumerate(self.users)}
+        self._new_signatures = {}
+
+        rng = random.Random(seed)
+        # a < 2 ** 31 keeps a * x + b below 2 ** 64 for every 32-bit song hash x.
+        self._coefficients = np.array([[rng.randrange(1, 2 ** 31), rng.randrange(0, 2 ** 32)]
+                                       for _ in range(num_perm)], dtype=np.uint64)
+
+        song_sets = [graph.get_neighbours(user) for user in self.users]
+        degrees = np.array([len(songs) for songs in song_sets], dtype=np.int64)
+        hashes = np.array([_song_hash(song) for songs in song_sets for song in songs], dtype=np.uint64)
+        starts = np.concatenate([[0], np.cumsum(degrees)[:-1]]).astype(np.int64)
+        listening = np.flatnonzero(degrees > 0)
+
+        self._signatures = np.full((len(self.users), num_perm), PRIME, dtype=np.uint64)
+        for j, (a, b) in enumerate(self._coefficients):
+            values = (a * hashes + b) % np.uint64(PRIME)
+            if len(listening) > 0:
+                self._signatures[listening, j] = np.minimum.reduceat(values, starts[listening])
+
+        self._buckets = [{} for _ in range(bands)]
+        for listener in listening:
+            for band, key in enumerate(self._band_keys(self._signatures[listener])):
+                self._buckets[band].setdefault(key, set()).add(int(listener))
+        self.build_seconds = time.perf_counter() - start
+
+    def vertex_added(self, key: Any, _item: Any, kind: str) -> None:
+        """Add the new user with the given key to this index. New songs need no change."""
+        if kind == 'user':
+            self._rows[key] = len(self.users)
+            self._new_signatures[len(self.users)] = np.full(self.num_perm, PRIME, dtype=np.uint64)
+            self.users.append(key)
+
+    def edge_added(self, key1: Any, key2: Any) -> None:
+        """Update the signature of the user who now listens to the song (the keys may be in either order).
+
+        A MinHash value is the minimum over the user's songs, so adding a song only lowers it.
+        """
+        user, song = (key1, key2) if key1 in self._rows else (key2, key1)
+        row = self._rows[user]
+        old = self._signature_of(row)
+        self._set_signature(row, np.minimum(old, self.signature([song])))
+
+    def edge_removed(self, key1: Any, key2: Any) -> None:
+        """Recompute the signature of the user who no longer listens to the song (the keys may be in either order)."""
+        user = key1 if key1 in self._rows else key2
+        songs = self._graph.get_neighbours(user)
+        signature = self.signature(songs) if songs else np.full(self.num_perm, PRIME, dtype=np.uint64)
+        self._set_signature(self._rows[user], signature)
+
+    def signature(self, songs: Iterable) -> np.ndarray:
+        """Return the MinHash signature of the given set of songs.
+
+        Preconditions:
+            - songs is not empty
+        """
+        hashes = np.array([_song_hash(song) for song in songs], dtype=np.uint64)
+        a = self._coefficients[:, 0:1]
+        b = self._coefficients[:, 1:2]
+        return ((a * hashes[np.newaxis, :] + b) % np.uint64(PRIME)).min(axis=1)
+
+    def candidates(self, songs: Iterable) -> list[int]:
+        """Return the sorted rows (positions in self.users) of the users that share a bucket with the given songs."""
+        songs = list(songs)
+        if not songs:
+            return []
+        rows = set()
+        for band, key in enumerate(self._band_keys(self.signature(songs))):
+            rows.update(self._buckets[band].get(key, ()))
+        return sorted(rows)
+
+    def positive_scores(self, songs: Iterable, genre: str, duration: str,
+                        exclude: Any = None) -> Iterator[tuple[Any, int, int]]:
+        """Yield (user, score, row) for every candidate user with a positive exact score against a query
+        with the given songs. row is the user's position in self.users.
+
+        The user given by exclude (usually the querying user) is skipped.
+        """
+        songs = set(songs)
+        genre_wanted = genre_code(genre.lower())
+        duration_wanted = duration_code(duration)
+        for row in self.candidates(songs):
+            user = self.users[row]
+            if user == exclude:
+                continue
+            common = songs & self._graph.get_neighbours(user)
+            score = sum(song_weight(self._graph.get_song_features(s), genre_wanted, duration_wanted) for s in common)
+            if score > 0:
+                yield user, score, row
+
+    def _signature_of(self, row: int) -> np.ndarray:
+        """Return the current signature of the user in the given row."""
+        if row in self._new_signatures:
+            return self._new_signatures[row]
+        return self._signatures[row]
+
+    def _set_signature(self, row: int, signature: np.ndarray) -> None:
+        """Replace the signature of the user in the given row, moving the user to the buckets of the new one."""
+        old = self._signature_of(row).copy()
+        if row in self._new_signatures:
+            self._new_signatures[row] = signature
+        else:
+            self._signatures[row] = signature
+
+        old_keys = self._band_keys(old) if old[0] < PRIME else [None] * self.bands
+        new_keys = self._band_keys(signature) if signature[0] < PRIME else [None] * self.bands
+        for band, (old_key, new_key) in enumerate(zip(old_keys, new_keys)):
+            if old_key != new_key:
+                if old_key is not None:
+                    self._buckets[band][old_key].discard(row)
+                if new_key is not None:
+                    self._buckets[band].setdefault(new_key, set()).add(row)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        """Return the bucket key of each band of the given signature."""
+        r = self.rows_per_band
+        return [signature[band * r:(band + 1) * r].tobytes() for band in range(self.bands)]
+
+
+def measure_recall(graph: Graph, index: MinHashLSH, k: int = 10, sample: int = 100, genre: str = 'pop',
+                   duration: str = 'medium', seed: Optional[int] = 0) -> float:
+    """Return the mean recall@k of the given index against the exact matches, over a sample of users.
+
+    For each sampled user, recall@k is the fraction of the users in the exact top k
+    (Graph.top_k_matches without an engine) that are also in the top k found through the index.
+    Users with no exact match are not counted.
+
+    Preconditions:
+        - k >= 1 and sample >= 1
+    """
+    users = graph.get_ordered_vertices('user')
+    sampled = random.Random(seed).sample(users, min(sample, len(users)))
+    recalls = []
+    for user in sampled:
+        exact = {match[0][0] for match in graph.top_k_matches(user, genre, duration, k)}
+        if exact:
+            approximate = {match[0][0] for match in graph.top_k_matches(user, genre, duration, k, engine=index)}
+            recalls.append(len(exact & approximate) / len(exact))
+    return sum(recalls) / len(recalls) if recalls else 1.0
+
+
+def _song_hash(song: Any) -> int:
+    """Return a 32-bit hash of the given song key that is the same in every process.
+
+    >>> _song_hash('1') == _song_hash('1')
+    True
+    """
+    return zlib.crc32(str(song).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['random', 'time', 'zlib', 'numpy', 'graph_functions'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
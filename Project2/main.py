@@ -6,6 +6,12 @@ from tkinter import messagebox
 from graph_functions import _Vertex
 from graph_visualization import *
 from graph_functions import *
+from graph_cache import GraphCache
+from similarity_engine import SimilarityEngine
+from match_cache import MatchCache, query_key
+from background import BackgroundRunner
+from clustering import louvain
+from layout_cache import LAYOUT_CACHE_DIR
 import platform
 
 
@@ -28,9 +34,26 @@ def button1_clicked() -> None:
 
 def button2_clicked() -> None:
     """
-    After pressing the visualize graph button, this function visualizes the graph using networkx
+    After pressing the visualize graph button, this function visualizes the graph using networkx.
+    The layout is computed in the background, and the figure is shown when it is ready.
     """
-    visualize_graph(load_review_graph('all_user_data_200_songs.csv', 'songs_by_popularity.csv'))
+    runner.submit('visualize', lambda _cancelled: graph_figure(graph_cache.get(), cache_dir=LAYOUT_CACHE_DIR),
+                  lambda fig: fig.show(), show_failure)
+
+
+def communities_clicked() -> None:
+    """
+    After choosing taste communities in the menu, this function visualizes the communities of listeners
+    found by the Louvain method. Both are computed in the background.
+    """
+    def work(cancelled):
+        graph = graph_cache.get()
+        communities = louvain(graph)
+        if cancelled.is_set():  # Skip the layout, nobody will see it
+            return None
+        return clusters_figure(graph, communities, cache_dir=LAYOUT_CACHE_DIR)
+
+    runner.submit('communities', work, lambda fig: fig.show(), show_failure)
 
 
 def move_entries(k=0) -> None:
@@ -56,19 +79,41 @@ def match_values() -> None:
         given_entries[j] = entries[j].get()
 
 
-def compute_algorithm() -> None:
+def compute_algorithm(entries_given: list[str], preferred_duration: str) -> list[list]:
+    """
+    Computes all background work and returns the values of the matched person.
+    This runs on a worker thread, so it must not touch any widget.
+    The same songs, genre and duration give the same match, so it is only computed once.
+    The graph and its engine are taken together, so a reload meanwhile cannot mix two graphs.
     """
-    Computes all background work and places all values of matched person
+    graph, engine = graph_cache.snapshot()
+    if graph.has_vertex(entries_given[0]):  # An existing user's own songs count too
+        return match_user(graph, engine, entries_given, preferred_duration)
+    key = query_key(entries_given[1:6], entries_given[6], preferred_duration)
+    return match_cache.get_or_compute(graph, key,
+                                      lambda: match_user(graph, engine, entries_given, preferred_duration))
+
+
+def match_user(graph: Graph, engine: SimilarityEngine, entries_given: list[str],
+               preferred_duration: str) -> list[list]:
     """
-    g = load_review_graph('all_user_data_200_songs.csv', 'songs_by_popularity.csv')
-    new_user = _Vertex(given_entries[0], [given_entries[0]], 'user')
+    Adds the given user to a copy of the graph and returns the values of their match,
+    scored with the given engine of the graph
+    """
+    g = GraphOverlay(graph)
+    new_user = _Vertex(entries_given[0], [entries_given[0]], 'user')
     g.add_vertex(new_user.key, new_user.item, new_user.kind)
 
-    for n in given_entries[1:6]:
+    for n in entries_given[1:6]:
         g.add_edge(new_user.key, str(n))
 
-    output = g.compatible_user_rec_songs(new_user.key, given_entries[6], duration[0])
+    return g.compatible_user_rec_songs(new_user.key, entries_given[6], preferred_duration, engine=engine)
+
 
+def show_match(output: list[list]) -> None:
+    """
+    Places all values of matched person
+    """
     new_labels[0].config(text=output[0][0])  # Username
     new_labels[1].config(text=output[0][1])  # Name
     new_labels[2].config(text=output[0][2])  # Age
@@ -86,6 +131,39 @@ def compute_algorithm() -> None:
     new_labels[6].place(x=450, y=160)
 
 
+def show_failure(error: BaseException) -> None:
+    """
+    Shows why a background job failed
+    """
+    if isinstance(error, ValueError):
+        messagebox.showerror("No Match", "No user shares a song with you yet!")
+    else:
+        messagebox.showerror("Error", f"Something went wrong: {error}")
+
+
+def set_busy(busy: bool) -> None:
+    """
+    Shows or hides the busy indicator while background jobs are running
+    """
+    status_label.config(text="Working... (Esc to cancel)" if busy else "")
+    gui.config(cursor="watch" if busy else "")
+
+
+def cancel_jobs(_event=None) -> None:
+    """
+    Cancels every running background job
+    """
+    runner.cancel_all()
+
+
+def close_window() -> None:
+    """
+    Stops the background jobs and closes the window
+    """
+    runner.shutdown()
+    gui.destroy()
+
+
 def button3_clicked() -> None:
     """
     Combines two functions to work when button gets clicked
@@ -106,9 +184,10 @@ def button3_clicked() -> None:
         messagebox.showerror("Invalid Song ID", "Song ID must be between 1 and 200, inclusive!")
     elif duration[0] == "":
         messagebox.showerror("Empty Duration", "Select a duration!")
-    else:
+    elif not runner.is_running('match'):
         move_entries(0)
-        compute_algorithm()
+        runner.submit('match', lambda _cancelled: compute_algorithm(list(given_entries), duration[0]), show_match,
+                      show_failure)
 
 
 def create_menu() -> None:
@@ -117,7 +196,9 @@ def create_menu() -> None:
     gui.config(menu=my_menu)
 
     my_options = tk.Menu(my_menu, tearoff=0)
-    my_options.add_command(label="Quit", command=gui.quit)
+    my_options.add_command(label="Quit", command=close_window)
+    my_options.add_command(label="Cancel", command=cancel_jobs)
+    my_options.add_command(label="Taste Communities", command=communities_clicked)
     my_options.add_command(label="Switch Color", command=lambda: reverse_color(reverse_counter))
 
     my_menu.add_cascade(label="Options", menu=my_options)
@@ -202,6 +283,14 @@ gui.geometry("800x600")
 gui.resizable(False, False)
 gui.configure(background='gray85')
 
+graph_cache = GraphCache('all_user_data_200_songs.csv', 'songs_by_popularity.csv')
+match_cache = MatchCache()
+status_label = tk.Label(gui, text="")
+status_label.place(x=20, y=570)
+runner = BackgroundRunner(gui, on_busy=set_busy)
+runner.submit('warm', lambda _cancelled: graph_cache.warm(), lambda _: None, show_failure)
+gui.protocol("WM_DELETE_WINDOW", close_window)
+gui.bind("<Escape>", cancel_jobs)
 reverse_counter = [0]
 mybool = [True]
 entries = []
@@ -0,0 +1,191 @@
+"""CSC111 Project 2: Match Cache
+
+Remembers the results of recent match queries, so a query that was answered before is answered again
+without touching the graph. The same few song sets come back again and again (the GUI resubmits the
+same five songs, and the popular songs are in most queries), so most queries are hits.
+
+A query is identified by its song ids, genre and duration only: the order of the songs, their repeats
+and the case of the genre and duration do not change the result, so they do not change the key either.
+Every cached result belongs to one state of one graph, identified by the graph and its generation
+(see Graph.get_generation). When the graph changes, the whole cache is dropped.
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+from instrumentation import PROFILER
+
+# The default maximum number of cached results.
+MAX_ENTRIES = 1024
+
+
+def query_key(songs: Iterable, genre: str, duration: str) -> tuple[frozenset, str, str]:
+    """Return the canonical cache key of a query with the given song ids, genre and duration.
+
+    >>> query_key(['5', '1', '5'], 'Pop', 'MEDIUM') == query_key(['1', '5'], 'pop', 'medium')
+    True
+    """
+    return frozenset(songs), genre.lower(), duration.lower()
+
+
+class MatchCache:
+    """A bounded cache of match results, evicting the least recently used result when it is full.
+
+    Results can also expire a fixed number of seconds after they were computed. A query that raised
+    a ValueError (no match) is cached too, and raises the same error again when it is looked up.
+    Cached results are shared by every caller that looks them up, so they must not be mutated.
+    The cache can be used from several threads; two threads that miss on the same key at once may
+    both compute it.
+
+    Instance Attributes:
+        - max_entries: the maximum number of cached results
+        - ttl: the number of seconds a result stays valid, or None if results never expire
+        - hits: the number of lookups answered from the cache
+        - misses: the number of lookups that had to be computed
+        - evictions: the number of results dropped to make room for a newer one
+        - expirations: the number of results dropped because they were older than ttl
+        - invalidations: the number of times the cache was dropped because the graph changed
+
+    Representation Invariants:
+        - self.max_entries >= 1
+        - self.ttl is None or self.ttl > 0
+        - len(self._entries) <= self.max_entries
+    """
+    max_entries: int
+    ttl: Optional[float]
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    invalidations: int
+    # Private Instance Attributes:
+    #     - _entries:
+    #         Maps each key to the time its result was computed and the result (or the ValueError it raised),
+    #         least recently used first.
+    #     - _graph, _generation:
+    #         The graph and its generation the cached results were computed from, or None if there are none.
+    #     - _clock:
+    #         Returns the current time in seconds.
+    #     - _lock:
+    #         Held while the entries or the counters are read or changed.
+    _entries: OrderedDict[Hashable, tuple[float, Any]]
+    _graph: Optional[Any]
+    _generation: Optional[int]
+    _clock: Callable[[], float]
+    _lock: threading.Lock
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """Initialize an empty cache.
+
+        Preconditions:
+            - max_entries >= 1
+            - ttl is None or ttl > 0
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+        self._entries = OrderedDict()
+        self._graph = self._generation = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, graph: Any, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached result of the given key for the current state of graph, or compute() if there
+        is none, caching it.
+
+        If compute raises a ValueError, it is cached and raised. Any other exception is raised without
+        being cached.
+
+        Preconditions:
+            - compute() only depends on key and on the current state of graph
+        """
+        generation = graph.get_generation()
+        with self._lock:
+            if graph is not self._graph or generation != self._generation:
+                if self._entries:
+                    self.invalidations += 1
+                    self._entries.clear()
+                self._graph, self._generation = graph, generation
+            entry = self._lookup(key)
+
+        if entry is not None:
+            if PROFILER.enabled:
+                PROFILER.count('match_cache.hits')
+            result = entry[1]
+        else:
+            if PROFILER.enabled:
+                PROFILER.count('match_cache.misses')
+            try:
+                result = compute()
+            except ValueError as error:
+                result = error
+            self._store(graph, generation, key, result)
+
+        if isinstance(result, ValueError):
+            raise ValueError(*result.args)
+        return result
+
+    def clear(self) -> None:
+        """Drop every cached result. The counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._graph = self._generation = None
+
+    def stats(self) -> dict[str, Any]:
+        """Return the counters of this cache, its size and its hit rate, as a JSON-serializable dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations, 'invalidations': self.invalidations,
+                    'hit_rate': self.hits / lookups if lookups > 0 else 0.0}
+
+    def _lookup(self, key: Hashable) -> Optional[tuple[float, Any]]:
+        """Return the live entry of the given key and mark it as the most recently used, or return None
+        (counting a miss) if there is none.
+
+        Preconditions:
+            - self._lock is held
+        """
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and self._clock() - entry[0] > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, graph: Any, generation: int, key: Hashable, result: Any) -> None:
+        """Cache the given result of key, computed from the given generation of graph, evicting the least
+        recently used results if the cache is full. Do nothing if the graph changed while result was computed."""
+        with self._lock:
+            if graph is not self._graph or generation != self._generation:
+                return
+            self._entries[key] = (self._clock(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['threading', 'time', 'collections', 'instrumentation'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
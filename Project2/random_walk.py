@@ -0,0 +1,229 @@
+"""CSC111 Project 2: Random Walk Recommendations
+
+Recommends songs with personalized PageRank (a random walk with restart) over the user-song graph.
+The walk starts from the songs of the query and repeatedly steps from a song to one of its listeners
+and from that user to one of their songs, jumping back to the query songs with a fixed probability
+after every such step. The songs where the walk spends the most time are recommended. Unlike a single
+best matching user, this uses every user who shares a song with the query, and the songs two, three
+or more steps away.
+
+The walk is computed by power iteration on sparse matrices, for many queries at once: each query is
+one column of a dense matrix, so one sparse product advances all of them by one step.
+
+This module is a library only: the GUI, the service and the batch job still recommend the songs of
+the best match. Build a RandomWalkEngine from a graph and call recommend (for the same song names as
+Graph.compatible_user_rec_songs) or rank_many (for many queries at once).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from scipy import sparse
+
+from graph_functions import Graph
+
+# The default number of queries walked together in one block of columns.
+BLOCK_SIZE = 16
+
+
+class RandomWalkEngine:
+    """A personalized PageRank recommender for the songs of a user-song graph.
+
+    A query is a set of songs. The walk restarts at one of them, chosen uniformly, with probability
+    restart after every song -> user -> song step, and the score of a song is the probability that
+    the walk is at it. Iteration stops when the total change of the scores of a query is below
+    tolerance, or after max_iterations steps.
+
+    The engine is a snapshot of the graph it was built from. Build a new one when the graph changes.
+
+    In this graph, ann listens to songs 1 and 2, bob to 2 and 3, and cat to 3 and 4. A walk from
+    song 1 reaches song 2 through ann, song 3 through bob and song 4 through cat, so the farther a
+    song is from song 1, the lower its score:
+
+    >>> graph = Graph()
+    >>> for song, title in [('1', 'One'), ('2', 'Two'), ('3', 'Three'), ('4', 'Four')]:
+    ...     graph.add_vertex(song, [song, title, 'Artist', '200000', 'pop'], 'song')
+    >>> for user, songs in [('ann', '12'), ('bob', '23'), ('cat', '34')]:
+    ...     graph.add_vertex(user, [user, user.title(), '20', 'Ontario'], 'user')
+    ...     for song in songs:
+    ...         graph.add_edge(user, song)
+    >>> engine = RandomWalkEngine(graph)
+    >>> [(song, round(score, 3)) for song, score in engine.rank({'1'})]
+    [('2', 0.358), ('3', 0.182), ('4', 0.067)]
+    >>> engine.recommend({'1'}, 2)
+    ['Two', 'Three']
+    >>> [[song for song, _ in ranking] for ranking in engine.rank_many([{'1'}, {'4'}], 1, workers=2)]
+    [['2'], ['3']]
+
+    Instance Attributes:
+        - songs: the song keys, in the order they were added to the graph
+        - restart: the probability of jumping back to the query songs after each step
+        - tolerance: the total change of the scores of a query below which its walk has converged
+        - max_iterations: the maximum number of steps of a walk
+
+    Representation Invariants:
+        - 0 < self.restart < 1
+        - self.tolerance > 0
+        - self.max_iterations >= 1
+        - len(self._song_names) == len(self.songs)
+        - self._song_to_user.shape[1] == self._user_to_song.shape[0] == len(self.songs)
+    """
+    songs: list
+    restart: float
+    tolerance: float
+    max_iterations: int
+    # Private Instance Attributes:
+    #     - _song_index:
+    #         Maps each song key to its position in songs.
+    #     - _song_names:
+    #         The name of each song in songs.
+    #     - _song_to_user:
+    #         The users x songs CSR matrix of one step from a song to a listener, scaled by 1 - restart:
+    #         entry (u, s) is (1 - restart) / (number of listeners of s) if u listens to s.
+    #     - _user_to_song:
+    #         The songs x users CSR matrix of one step from a user to one of their songs:
+    #         entry (s, u) is 1 / (number of songs of u) if u listens to s.
+    _song_index: dict[Any, int]
+    _song_names: list[str]
+    _song_to_user: sparse.csr_matrix
+    _user_to_song: sparse.csr_matrix
+
+    def __init__(self, graph: Graph, restart: float = 0.15, tolerance: float = 1e-6,
+                 max_iterations: int = 100) -> None:
+        """Initialize an engine for the current users, songs and listens of the given graph.
+
+        Preconditions:
+            - 0 < restart < 1
+            - tolerance > 0
+            - max_iterations >= 1
+        """
+        self.songs = graph.get_ordered_vertices('song')
+        self.restart = restart
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self._song_index = {song: i for i, song in enumerate(self.songs)}
+        self._song_names = [graph.get_item(song)[1] for song in self.songs]
+
+        users = graph.get_ordered_vertices('user')
+        indptr = [0]
+        indices = []
+        for user in users:
+            indices.extend(self._song_index[song] for song in graph.get_neighbours(user))
+            indptr.append(len(indices))
+        listens = sparse.csr_matrix((np.ones(len(indices), dtype=np.float64), indices, indptr),
+                                    shape=(len(users), len(self.songs)))
+
+        # A song with no listeners (or a user with no songs) ends the walk, so its scale is 0, not 1 / 0.
+        song_degrees = np.asarray(listens.sum(axis=0)).ravel()
+        user_degrees = np.asarray(listens.sum(axis=1)).ravel()
+        song_scale = np.divide(1 - restart, song_degrees, out=np.zeros_like(song_degrees), where=song_degrees > 0)
+        user_scale = np.divide(1.0, user_degrees, out=np.zeros_like(user_degrees), where=user_degrees > 0)
+        self._song_to_user = (listens @ sparse.diags(song_scale)).tocsr()
+        self._user_to_song = (listens.T @ sparse.diags(user_scale)).tocsr()
+
+    def scores(self, queries: list[Iterable]) -> np.ndarray:
+        """Return the score of every song in self.songs for each of the given queries (sets of song keys).
+
+        Column j of the returned len(self.songs) x len(queries) array holds the scores of queries[j].
+        Songs that are not in this engine are ignored. A query with no song in this engine scores
+        every song 0.
+        """
+        restarts = np.zeros((len(self.songs), len(queries)), dtype=np.float64)
+        for j, query in enumerate(queries):
+            columns = [self._song_index[song] for song in set(query) if song in self._song_index]
+            if columns:
+                restarts[columns, j] = self.restart / len(columns)
+        return self._walk(restarts)
+
+    def rank(self, songs: Iterable, n: int = 10) -> list[tuple[Any, float]]:
+        """Return up to n (song, score) pairs of the best songs for a query with the given songs, best first.
+
+        The query songs themselves and songs the walk never reaches are not returned. Songs with the
+        same score are ordered by when they were added to the graph.
+
+        Preconditions:
+            - n >= 1
+        """
+        return self.rank_many([songs], n)[0]
+
+    def rank_many(self, queries: list[Iterable], n: int = 10, workers: Optional[int] = None,
+                  block_size: int = BLOCK_SIZE) -> list[list[tuple[Any, float]]]:
+        """Return rank(query, n) for each of the given queries, in the same order.
+
+        The queries are walked in blocks of block_size columns. If workers is given, the blocks are
+        walked by that many threads at once (the sparse products release the GIL); otherwise they are
+        walked one after another.
+
+        Preconditions:
+            - n >= 1
+            - workers is None or workers >= 1
+            - block_size >= 1
+        """
+        queries = [set(query) for query in queries]
+        blocks = [queries[start:start + block_size] for start in range(0, len(queries), block_size)]
+        if workers is None or len(blocks) <= 1:
+            ranked = [self._rank_block(block, n) for block in blocks]
+        else:
+            with ThreadPoolExecutor(workers, thread_name_prefix='harmonify-walk') as executor:
+                ranked = list(executor.map(lambda block: self._rank_block(block, n), blocks))
+        return [ranking for block in ranked for ranking in block]
+
+    def recommend(self, songs: Iterable, n: int = 10) -> list[str]:
+        """Return the names of the n best songs for a query with the given songs, best first.
+
+        This is the format of the recommended songs of Graph.compatible_user_rec_songs.
+
+        Preconditions:
+            - n >= 1
+        """
+        return [self._song_names[self._song_index[song]] for song, _ in self.rank(songs, n)]
+
+    def _rank_block(self, queries: list[set], n: int) -> list[list[tuple[Any, float]]]:
+        """Return rank(query, n) for each of the given queries, walking all of them together."""
+        scores = self.scores(queries)
+        ranked = []
+        for j, query in enumerate(queries):
+            column = scores[:, j].copy()
+            column[[self._song_index[song] for song in query if song in self._song_index]] = 0.0
+            candidates = np.flatnonzero(column > 0)
+            if len(candidates) > n:
+                # Keep every song tied with the n-th best, so ties are broken by song order below.
+                cutoff = np.partition(column[candidates], len(candidates) - n)[len(candidates) - n]
+                candidates = candidates[column[candidates] >= cutoff]
+            best = candidates[np.lexsort((candidates, -column[candidates]))][:n]
+            ranked.append([(self.songs[i], float(column[i])) for i in best.tolist()])
+        return ranked
+
+    def _walk(self, restarts: np.ndarray) -> np.ndarray:
+        """Return the stationary scores of the walks with the given restart columns.
+
+        Each column of restarts is restart times the restart distribution of one query. A column
+        stops being updated once it has converged, so later steps only multiply the remaining ones.
+        """
+        result = np.zeros_like(restarts)
+        active = np.arange(restarts.shape[1])
+        current = restarts / self.restart
+        for _ in range(self.max_iterations):
+            if len(active) == 0:
+                break
+            new = self._user_to_song @ (self._song_to_user @ current) + restarts[:, active]
+            converged = np.abs(new - current).sum(axis=0) < self.tolerance
+            result[:, active[converged]] = new[:, converged]
+            active, current = active[~converged], new[:, ~converged]
+        result[:, active] = current
+        return result
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['concurrent.futures', 'numpy', 'scipy', 'graph_functions'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
@@ -0,0 +1,334 @@
+"""CSC111 Project 2: Recommendation Service
+
+A small local HTTP/JSON service that answers match queries without the GUI. An asyncio front end
+accepts many concurrent connections, and the scoring runs in a pool of worker processes (or threads),
+each of which loads the graph once and keeps it in memory.
+
+Endpoints:
+    - GET /health: {"status": "ok", "users": ..., "songs": ..., "match_cache": {...}}, where match_cache
+      holds the counters of the cache of one worker (see match_cache.MatchCache.stats)
+    - POST /match with a JSON object with the fields:
+        - "user": the username of a user of the graph, or
+          "songs": a list of song ids, for a query by someone who is not in the graph
+        - "genre": the favourite genre
+        - "duration": the preferred duration ('short', 'medium' or 'long')
+        - "k" (optional, 1 by default): the number of matches to return
+      It returns {"matches": [...]}, best first, where each match is an object with the fields
+      "user" (["username", "name", "age", "province"]), "score", "common_songs" and "recommended_songs",
+      like the return value of Graph.compatible_user_rec_songs. A query with no positive match returns
+      no matches. A malformed query gets a 400 response with an "error" field. The results of song list
+      queries are cached by each worker, so a repeated query does not touch the graph.
+
+Usage:
+    python service.py --port 8111 --workers 4
+    curl -X POST localhost:8111/match -d '{"songs": ["1", "5", "17"], "genre": "pop", "duration": "medium"}'
+    python service.py --check  (runs the doctests and python_ta instead)
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Optional
+
+from graph_cache import GraphCache
+from graph_functions import DURATION_BUCKETS, Graph, GraphOverlay
+from match_cache import MatchCache, query_key
+from similarity_engine import SimilarityEngine
+
+# The key of the temporary user of a query by song list. It is not a valid username, so it never
+# collides with a user of the graph.
+QUERY_USER = '\0query'
+
+# The largest request body accepted, in bytes.
+MAX_BODY_BYTES = 1 << 20
+
+# The reason phrases of the status codes the service sends.
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+# The graph of a worker and the cache of its song list queries, created by _init_worker.
+_graph_cache = None
+_match_cache = None
+
+
+class QueryError(Exception):
+    """Raised when a match query is malformed or refers to a user or song that is not in the graph."""
+
+
+def match(query: dict[str, Any]) -> dict[str, Any]:
+    """Return the response body of the given /match query, using the graph of this worker.
+
+    Raise a QueryError if the query is malformed.
+
+    Preconditions:
+        - _init_worker has been called in this process
+    """
+    genre = query.get('genre')
+    duration = query.get('duration')
+    k = query.get('k', 1)
+    if not isinstance(genre, str) or not isinstance(duration, str) or duration.lower() not in DURATION_BUCKETS:
+        raise QueryError("'genre' must be a string and 'duration' one of 'short', 'medium' or 'long'")
+    if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+        raise QueryError("'k' must be a positive integer")
+
+    # One request is validated and scored against the same graph, even if the files are reloaded meanwhile.
+    graph, engine = _graph_cache.snapshot()
+    if 'user' in query:
+        user = query['user']
+        if not isinstance(user, str) or not graph.has_vertex(user, 'user'):
+            raise QueryError(f'unknown user: {user!r}')
+        matches = graph.top_k_matches(user, genre, duration, k, engine=engine)
+    elif isinstance(query.get('songs'), list) and query['songs']:
+        songs = [str(song) for song in query['songs']]
+        unknown = [song for song in songs if not graph.has_vertex(song, 'song')]
+        if unknown:
+            raise QueryError(f'unknown songs: {unknown}')
+        key = query_key(songs, genre, duration) + (k,)
+        matches = _match_cache.get_or_compute(graph, key,
+                                              lambda: _query_matches(graph, engine, songs, genre, duration, k))
+    else:
+        raise QueryError("a query needs a 'user' or a non-empty list of 'songs'")
+
+    return {'matches': [{'user': item, 'score': score, 'common_songs': common, 'recommended_songs': recommended}
+                        for item, (common, recommended), [score] in matches]}
+
+
+def health() -> dict[str, Any]:
+    """Return the response body of a /health request, using the graph of this worker.
+
+    Preconditions:
+        - _init_worker has been called in this process
+    """
+    graph = _graph_cache.get()
+    return {'status': 'ok', 'users': graph.num_users(), 'songs': graph.num_songs(),
+            'match_cache': _match_cache.stats()}
+
+
+class RecommendationService:
+    """An asyncio HTTP server that answers match queries in a pool of workers.
+
+    Instance Attributes:
+        - users: the path to the CSV file of user listens
+        - songs: the path to the CSV file of songs
+        - workers: the number of workers
+        - use_processes: whether the workers are processes (each with its own copy of the graph)
+          rather than threads of this process (sharing one graph, but also the GIL)
+    """
+    users: str
+    songs: str
+    workers: int
+    use_processes: bool
+    # Private Instance Attributes:
+    #     - _executor:
+    #         The pool of workers, or None if the service has not started.
+    #     - _server:
+    #         The asyncio server, or None if the service has not started.
+    _executor: Optional[Executor]
+    _server: Optional[asyncio.AbstractServer]
+
+    def __init__(self, users: str, songs: str, workers: Optional[int] = None, use_processes: bool = True) -> None:
+        """Initialize a service for the graph of the given files, with the given number of workers
+        (os.cpu_count() by default). Nothing is loaded or started yet.
+
+        Preconditions:
+            - workers is None or workers >= 1
+        """
+        self.users = users
+        self.songs = songs
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self._executor = None
+        self._server = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8111) -> int:
+        """Start the workers, wait until every one of them has loaded the graph, and start listening.
+
+        Return the port the service listens on (useful if port is 0, to pick a free port).
+        """
+        loop = asyncio.get_running_loop()
+        if self.use_processes:
+            self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                 initargs=(self.users, self.songs))
+            await asyncio.gather(*(loop.run_in_executor(self._executor, health) for _ in range(self.workers)))
+        else:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='harmonify-service')
+            await loop.run_in_executor(self._executor, _init_worker, self.users, self.songs)
+
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        """Serve requests until the task is cancelled.
+
+        Preconditions:
+            - start has been called
+        """
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        """Stop listening and shut the workers down."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._executor is not None:
+            # Wait for the workers to exit (off the event loop), so none is left behind at interpreter exit.
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests sent on one connection, until the client closes it or asks to."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = await _read_headers(reader)
+                length = _content_length(headers)
+                if length is None:  # The end of the body is unknown, so the connection cannot be reused
+                    await _respond(writer, 400, {'error': 'invalid Content-Length'}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await _respond(writer, 413, {'error': 'request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length > 0 else b''
+
+                keep_alive = headers.get('connection', '').lower() != 'close' and b'HTTP/1.0' not in request_line
+                try:
+                    status, response = await self._route(request_line.decode('latin-1').split(), body)
+                except Exception as error:  # Any other failure is reported to the client, not dropped.
+                    status, response = 500, {'error': f'{type(error).__name__}: {error}'}
+                await _respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, request: list[str], body: bytes) -> tuple[int, dict[str, Any]]:
+        """Return the status and response body of the request with the given request line words and body."""
+        if len(request) < 2:
+            return 400, {'error': 'malformed request line'}
+        method, path = request[0], request[1].split('?')[0]
+        loop = asyncio.get_running_loop()
+
+        if path == '/health':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            return 200, await loop.run_in_executor(self._executor, health)
+        elif path == '/match':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            try:
+                query = json.loads(body or b'{}')
+            except ValueError:
+                return 400, {'error': 'the body is not valid JSON'}
+            if not isinstance(query, dict):
+                return 400, {'error': 'the body must be a JSON object'}
+            try:
+                return 200, await loop.run_in_executor(self._executor, match, query)
+            except QueryError as error:
+                return 400, {'error': str(error)}
+        return 404, {'error': f'no such endpoint: {path}'}
+
+
+async def _read_headers(reader: asyncio.StreamReader) -> dict[str, str]:
+    """Read HTTP headers up to the blank line that ends them, and return them with lowercase names."""
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            return headers
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+def _content_length(headers: dict[str, str]) -> Optional[int]:
+    """Return the body length given by the Content-Length header of the given headers (0 if there is none),
+    or None if it is not a non-negative integer.
+
+    >>> _content_length({'content-length': '12'}), _content_length({})
+    (12, 0)
+    >>> _content_length({'content-length': 'abc'}) is None, _content_length({'content-length': '-1'}) is None
+    (True, True)
+    """
+    value = headers.get('content-length', '0').strip() or '0'
+    return int(value) if value.isascii() and value.isdigit() else None
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, body: dict[str, Any], keep_alive: bool) -> None:
+    """Send an HTTP response with the given status and JSON body."""
+    encoded = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    head = (f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json; charset=utf-8\r\n'
+            f'Content-Length: {len(encoded)}\r\nConnection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    writer.write(head.encode('latin-1') + encoded)
+    await writer.drain()
+
+
+def _query_matches(graph: Graph, engine: SimilarityEngine, songs: list[str], genre: str, duration: str,
+                   k: int) -> list[list[list]]:
+    """Return the k best matches of a query user who listens to the given songs, added to an overlay of
+    graph, scored with engine (built from graph)."""
+    overlay = GraphOverlay(graph)
+    overlay.add_vertex(QUERY_USER, [QUERY_USER], 'user')
+    overlay.add_edges(QUERY_USER, songs)
+    return overlay.top_k_matches(QUERY_USER, genre, duration, k, engine=engine)
+
+
+def _init_worker(users: str, songs: str) -> None:
+    """Load the graph and build its engine, for the match and health calls of this worker."""
+    global _graph_cache, _match_cache
+    _graph_cache = GraphCache(users, songs)
+    _graph_cache.warm()
+    _match_cache = MatchCache()
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    """Run the service with the given command line arguments until it is interrupted."""
+    service = RecommendationService(args.users, args.songs, args.workers, not args.threads)
+    port = await service.start(args.host, args.port)
+    print(f'Serving on http://{args.host}:{port} with {service.workers} workers.')
+    try:
+        await service.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """Run the service with the given command line arguments."""
+    parser = argparse.ArgumentParser(description='Serve match queries over HTTP.')
+    parser.add_argument('--users', default='all_user_data_200_songs.csv', help='CSV file of user listens')
+    parser.add_argument('--songs', default='songs_by_popularity.csv', help='CSV file of songs')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8111, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=None, help='number of workers')
+    parser.add_argument('--threads', action='store_true', help='use worker threads instead of processes')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--check']:
+        import doctest
+
+        doctest.testmod()
+
+        import python_ta
+
+        python_ta.check_all(config={
+            'max-line-length': 120,
+            'extra-imports': ['argparse', 'asyncio', 'json', 'os', 'sys', 'concurrent.futures', 'graph_cache',
+                              'graph_functions', 'match_cache', 'similarity_engine'],
+            'allowed-io': ['_serve'],
+            'max-nested-blocks': 4
+        })
+    else:
+        main()
@@ -0,0 +1,331 @@
+"""CSC111 Project 2: Similarity Engine
+
+Scores one user against every user of a graph at once, using a sparse user-song matrix
+instead of comparing the neighbours of two users one pair at a time. Several (genre, duration)
+profiles can also be scored together in one pass over the matrix (see profile_scores).
+"""
+import itertools
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+from scipy import sparse
+
+from graph_functions import DURATION_BUCKETS, Graph, Neighbourhood, SongFeatures, duration_code, genre_code
+
+# The number of changed users after which the changes are merged into the sparse matrix.
+MERGE_THRESHOLD = 1024
+
+
+def profile_grid(genres: Iterable[str], durations: Iterable[str] = tuple(DURATION_BUCKETS)) -> list[tuple[str, str]]:
+    """Return every (genre, duration) profile of the given genres and durations, genre by genre.
+
+    >>> profile_grid(['pop', 'edm'], ['short', 'long'])
+    [('pop', 'short'), ('pop', 'long'), ('edm', 'short'), ('edm', 'long')]
+    """
+    return list(itertools.product(genres, durations))
+
+
+class SimilarityEngine:
+    """A sparse-matrix backend for similarity scores between users of a user-song graph.
+
+    For a query with song set S, favourite genre g and preferred duration d, the score of a user u is
+        3 * |S & songs(u)| + 2 * |S & songs(u) & songs of genre g| + 1 * |S & songs(u) & songs of duration d|,
+    which is the same formula as _Vertex.similarity_score. Giving each song in S the weight
+    3 + 2 * [genre matches] + 1 * [duration matches] turns this into one matrix-vector product.
+
+    The engine is a snapshot of the graph it was built from. To keep it up to date as the graph changes,
+    subscribe it to the graph (see Graph.subscribe): the songs of each changed or new user are then kept
+    in a small side table and scored directly, and are merged into the matrix once there are enough of them.
+
+    Instance Attributes:
+        - users: the user keys, in the order they were added to the graph (the matrix rows)
+        - songs: the song keys, in the order they were added to the graph (the matrix columns)
+
+    Representation Invariants:
+        - self._listens.shape[0] <= len(self.users) and self._listens.shape[1] <= len(self.songs)
+        - all(row in self._changed for row in range(self._listens.shape[0], len(self.users)))
+        - len(self._song_genres) == len(self._song_buckets) == len(self.songs)
+    """
+    users: list
+    songs: list
+    # Private Instance Attributes:
+    #     - _user_index:
+    #         Maps each user key to its row in _listens.
+    #     - _song_index:
+    #         Maps each song key to its column in _listens.
+    #     - _listens:
+    #         A CSR matrix with a 1 at (u, s) if user u listens to song s, as of the last merge.
+    #     - _changed:
+    #         Maps the row of each user whose songs changed since the last merge to the columns of all their songs.
+    #     - _song_genres:
+    #         The genre code of each song (see graph_functions.GENRE_CODES).
+    #     - _song_buckets:
+    #         The duration bucket code of each song (see graph_functions.DURATION_BUCKETS).
+    _user_index: dict[Any, int]
+    _song_index: dict[Any, int]
+    _listens: sparse.csr_matrix
+    _changed: dict[int, set[int]]
+    _song_genres: np.ndarray
+    _song_buckets: np.ndarray
+
+    def __init__(self, graph: Graph) -> None:
+        """Initialize an engine for the current users, songs and listens of the given graph."""
+        self.users = graph.get_ordered_vertices('user')
+        self.songs = graph.get_ordered_vertices('song')
+        self._user_index = {user: i for i, user in enumerate(self.users)}
+        self._song_index = {song: i for i, song in enumerate(self.songs)}
+
+        features = [graph.get_song_features(song) for song in self.songs]
+        self._song_genres = np.array([f.genre for f in features], dtype=np.int32)
+        self._song_buckets = np.array([f.bucket for f in features], dtype=np.int8)
+
+        indptr = [0]
+        indices = []
+        for user in self.users:
+            indices.extend(self._song_index[song] for song in graph.get_neighbours(user))
+            indptr.append(len(indices))
+        data = np.ones(len(indices), dtype=np.int64)
+        self._listens = sparse.csr_matrix((data, indices, indptr), shape=(len(self.users), len(self.songs)))
+        self._changed = {}
+
+    def vertex_added(self, key: Any, item: Any, kind: str) -> None:
+        """Add the new user or song with the given key and item to this engine."""
+        if kind == 'user':
+            self._user_index[key] = len(self.users)
+            self.users.append(key)
+            self._changed[self._user_index[key]] = set()
+        else:
+            features = SongFeatures.from_item(item)
+            self._song_index[key] = len(self.songs)
+            self.songs.append(key)
+            self._song_genres = np.append(self._song_genres, np.int32(features.genre))
+            self._song_buckets = np.append(self._song_buckets, np.int8(features.bucket))
+
+    def edge_added(self, key1: Any, key2: Any) -> None:
+        """Record that the user and the song with the given keys (in either order) are now adjacent."""
+        row, column = self._edge_position(key1, key2)
+        self._changed_columns(row).add(column)
+        self._merge_if_needed()
+
+    def edge_removed(self, key1: Any, key2: Any) -> None:
+        """Record that the user and the song with the given keys (in either order) are no longer adjacent."""
+        row, column = self._edge_position(key1, key2)
+        self._changed_columns(row).discard(column)
+        self._merge_if_needed()
+
+    def song_weights(self, songs: Iterable, genre: str, duration: str) -> np.ndarray:
+        """Return the per-song weight vector of a query with the given songs, genre and duration.
+
+        Songs that are not in this engine are ignored, since no user of the engine listens to them.
+        """
+        columns = np.array([self._song_index[s] for s in songs if s in self._song_index], dtype=np.int64)
+        weights = np.zeros(len(self.songs), dtype=np.int64)
+        if len(columns) == 0:
+            return weights
+
+        column_weights = np.full(len(columns), 3, dtype=np.int64)
+        column_weights += 2 * (self._song_genres[columns] == genre_code(genre.lower()))
+        column_weights += self._song_buckets[columns] == duration_code(duration)
+        weights[columns] = column_weights
+        return weights
+
+    def scores(self, songs: Iterable, genre: str, duration: str) -> np.ndarray:
+        """Return the similarity score of every user in self.users against a query with the given songs.
+
+        The i-th entry of the returned array is the score of self.users[i].
+        """
+        weights = self.song_weights(songs, genre, duration)
+        scores = np.zeros(len(self.users), dtype=np.int64)
+        scores[:self._listens.shape[0]] = self._listens @ weights[:self._listens.shape[1]]
+        for row, columns in self._changed.items():
+            scores[row] = weights[list(columns)].sum()
+        return scores
+
+    def profile_scores(self, songs: Iterable, profiles: list[tuple[str, str]]) -> np.ndarray:
+        """Return the similarity score of every user in self.users against a query with the given songs,
+        under each of the given (genre, duration) profiles.
+
+        Entry (i, j) of the returned len(self.users) x len(profiles) array is
+        self.scores(songs, *profiles[j])[i]. Rather than one product per profile, each user's
+        query songs are counted in one sparse product: all of them, those of each genre of the
+        profiles, and those of each duration bucket. The score of every profile is then
+        3 * all + 2 * (genre count) + 1 * (bucket count).
+        """
+        genres = [genre_code(genre.lower()) for genre, _ in profiles]
+        buckets = [duration_code(duration) for _, duration in profiles]
+        distinct_genres = sorted(set(genres))
+        genre_column = {code: 1 + i for i, code in enumerate(distinct_genres)}
+        bucket_start = 1 + len(distinct_genres)
+
+        # The count columns, and an always-zero last column for unknown genres and durations.
+        columns = np.array([self._song_index[s] for s in songs if s in self._song_index], dtype=np.int64)
+        features = np.zeros((len(self.songs), bucket_start + len(DURATION_BUCKETS) + 1), dtype=np.int64)
+        features[columns, 0] = 1
+        for code, column in genre_column.items():
+            features[columns, column] = self._song_genres[columns] == code
+        features[columns, bucket_start + self._song_buckets[columns]] = 1
+
+        counts = np.zeros((len(self.users), features.shape[1]), dtype=np.int64)
+        counts[:self._listens.shape[0]] = self._listens @ features[:self._listens.shape[1]]
+        for row, changed in self._changed.items():
+            counts[row] = features[list(changed)].sum(axis=0)
+
+        unknown = features.shape[1] - 1
+        genre_columns = [genre_column[code] if code >= 0 else unknown for code in genres]
+        bucket_columns = [bucket_start + code if code >= 0 else unknown for code in buckets]
+        return 3 * counts[:, [0]] + 2 * counts[:, genre_columns] + counts[:, bucket_columns]
+
+    def best_by_profile(self, user: Any, profiles: list[tuple[str, str]]) -> list[tuple[Any, int]]:
+        """Return the best match of the given user under each of the given (genre, duration) profiles,
+        as (matched user, score) pairs in the order of profiles, with one pass over the matrix.
+
+        A profile under which no other user has a positive score gets (None, 0). As in best_match,
+        ties go to the user added to the graph first.
+
+        Raise a ValueError if user is not a user of this engine.
+        """
+        if user not in self._user_index:
+            raise ValueError
+        row = self._user_index[user]
+        scores = self.profile_scores((self.songs[s] for s in self._row_columns(row)), profiles)
+        scores[row] = 0
+
+        matches = np.argmax(scores, axis=0)
+        best = scores[matches, np.arange(len(profiles))]
+        return [(self.users[match], score) if score > 0 else (None, 0)
+                for match, score in zip(matches.tolist(), best.tolist())]
+
+    def user_scores(self, user: Any, genre: str, duration: str) -> np.ndarray:
+        """Return the similarity score of every user in self.users against the given user.
+
+        Raise a ValueError if user is not a user of this engine.
+        """
+        if user not in self._user_index:
+            raise ValueError
+        return self.scores((self.songs[s] for s in self._row_columns(self._user_index[user])), genre, duration)
+
+    def positive_scores(self, songs: Iterable, genre: str, duration: str,
+                        exclude: Any = None) -> Iterator[tuple[Any, int, int]]:
+        """Yield (user, score, row) for every user with a positive score against a query with the given songs.
+
+        row is the user's position in self.users, which follows the order the users were added to the graph.
+        The user given by exclude (usually the querying user) is skipped.
+        """
+        scores = self.scores(songs, genre, duration)
+        for row in np.flatnonzero(scores > 0):
+            user = self.users[row]
+            if user != exclude:
+                yield user, int(scores[row]), int(row)
+
+    def best_match(self, songs: Iterable, genre: str, duration: str, exclude: Any = None) -> tuple[Any, int]:
+        """Return the user with the highest score against a query with the given songs, and that score.
+
+        The user given by exclude (usually the querying user) is never returned. If several users share
+        the highest score, the one added to the graph first is returned.
+
+        Raise a ValueError if no user has a positive score.
+        """
+        scores = self.scores(songs, genre, duration)
+        if exclude in self._user_index:
+            scores[self._user_index[exclude]] = 0
+
+        best = int(np.argmax(scores)) if len(scores) > 0 else 0
+        if len(scores) == 0 or scores[best] <= 0:
+            raise ValueError
+        return self.users[best], int(scores[best])
+
+    def neighbourhood_songs(self, songs: Iterable, genre: str, duration: str, size: Neighbourhood,
+                            exclude: Any = None) -> list[tuple[Any, int]]:
+        """Return up to size.songs (song, weight) pairs of the songs recommended to a query with the given
+        songs by its size.users most similar users, best first.
+
+        Each of the size.users users with the highest scores (ties go to the user added to the graph first)
+        adds their score to the weight of every song they listen to, in one bincount over the song columns.
+        The query songs are never returned, so every song appears once. Songs with the same weight are
+        ordered by when they were added to the graph. The user given by exclude (usually the querying
+        user) is never one of the voting users.
+
+        Raise a ValueError if no user has a positive score.
+        """
+        songs = set(songs)
+        scores = self.scores(songs, genre, duration)
+        if exclude in self._user_index:
+            scores[self._user_index[exclude]] = 0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) == 0:
+            raise ValueError
+        if len(candidates) > size.users:
+            # Keep every user tied with the k-th best, so ties are broken by row order below.
+            cutoff = np.partition(scores[candidates], len(candidates) - size.users)[len(candidates) - size.users]
+            candidates = candidates[scores[candidates] >= cutoff]
+        neighbours = candidates[np.lexsort((candidates, -scores[candidates]))][:size.users]
+
+        totals = self._vote_totals(neighbours.tolist(), scores)
+        totals[[self._song_index[song] for song in songs if song in self._song_index]] = 0
+        ranked = np.flatnonzero(totals > 0)
+        ranked = ranked[np.lexsort((ranked, -totals[ranked]))][:size.songs]
+        return [(self.songs[column], int(totals[column])) for column in ranked.tolist()]
+
+    def _vote_totals(self, voters: list[int], scores: np.ndarray) -> np.ndarray:
+        """Return the total score of the given user rows who listen to each song column."""
+        merged = np.array([voter for voter in voters if voter not in self._changed], dtype=np.int64)
+        rows = self._listens[merged]
+        columns = [rows.indices]
+        weights = [np.repeat(scores[merged], np.diff(rows.indptr))]
+        for row in voters:
+            if row in self._changed:
+                columns.append(np.fromiter(self._changed[row], dtype=np.int64, count=len(self._changed[row])))
+                weights.append(np.full(len(self._changed[row]), scores[row], dtype=np.int64))
+        return np.bincount(np.concatenate(columns), weights=np.concatenate(weights),
+                           minlength=len(self.songs)).astype(np.int64)
+
+    def _row_columns(self, row: int) -> Iterable[int]:
+        """Return the columns of the songs of the user in the given row."""
+        if row in self._changed:
+            return self._changed[row]
+        return self._listens.indices[self._listens.indptr[row]:self._listens.indptr[row + 1]]
+
+    def _changed_columns(self, row: int) -> set[int]:
+        """Return the set of song columns of the user in the given row, moving the user to _changed first."""
+        if row not in self._changed:
+            self._changed[row] = set(int(column) for column in self._row_columns(row))
+        return self._changed[row]
+
+    def _edge_position(self, key1: Any, key2: Any) -> tuple[int, int]:
+        """Return the (row, column) of the edge between the given user and song, given in either order."""
+        if key1 in self._user_index:
+            return self._user_index[key1], self._song_index[key2]
+        return self._user_index[key2], self._song_index[key1]
+
+    def _merge_if_needed(self) -> None:
+        """Merge the changed users into the sparse matrix if there are more than MERGE_THRESHOLD of them."""
+        if len(self._changed) <= MERGE_THRESHOLD:
+            return
+
+        listens = self._listens.tocoo()
+        keep = ~np.isin(listens.row, np.fromiter(self._changed, dtype=np.int64))
+        rows = [listens.row[keep]]
+        columns = [listens.col[keep]]
+        for row, changed in self._changed.items():
+            rows.append(np.full(len(changed), row, dtype=np.int64))
+            columns.append(np.fromiter(changed, dtype=np.int64, count=len(changed)))
+        rows = np.concatenate(rows)
+        columns = np.concatenate(columns)
+        self._listens = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns)),
+                                          shape=(len(self.users), len(self.songs)))
+        self._changed = {}
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['itertools', 'numpy', 'scipy', 'graph_functions'],
+        'allowed-io': [],
+        'max-nested-blocks': 4
+    })
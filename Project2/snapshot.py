@@ -0,0 +1,337 @@
+"""CSC111 Project 2: Graph Snapshots
+
+Saves a built user-song graph to a binary file that can be memory-mapped, so a later start can
+reopen the graph instead of parsing the CSV files again.
+
+A snapshot file is laid out as:
+    - the 8 bytes MAGIC
+    - the format version and the length of the metadata, as two little-endian 32-bit integers
+    - the metadata, as UTF-8 JSON: the checksum and (size, mtime) of the source files,
+      and the offset, dtype and length of every section
+    - the sections, each aligned to ALIGNMENT bytes. Array columns are stored as raw little-endian
+      arrays. Each string column is stored as its concatenated UTF-8 values and an array of the offset
+      where each value starts, so any value can be decoded on its own and may contain any character.
+      The key_order section holds the vertex ids sorted by key, so keys are found by binary search.
+
+Opening a snapshot maps the file and reads its metadata, and does no work per vertex: the strings of
+a vertex are only decoded when they are used, and a key lookup decodes O(log V) keys.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections.abc import Iterator, MutableMapping, Sequence
+from typing import Any, Optional, Union
+
+import numpy as np
+
+from compact_graph import CompactGraph, load_compact_review_graph
+
+MAGIC = b'HRMNSNAP'
+SNAPSHOT_VERSION = 2
+ALIGNMENT = 64
+
+# The columns of CompactGraph.get_columns that are stored as arrays, and their on-disk dtypes.
+ARRAY_COLUMNS = {
+    'kinds': '<i1',
+    'rows': '<i4',
+    'offsets': '<i8',
+    'targets': '<i4',
+    'song_durations': '<i4',
+    'song_buckets': '<i1',
+    'song_genres': '<i2'
+}
+
+# The columns of CompactGraph.get_columns that are stored as strings.
+STRING_COLUMNS = ('keys', 'user_names', 'user_ages', 'user_provinces', 'song_titles', 'song_artists',
+                  'genre_names')
+
+
+class StringColumn(Sequence):
+    """A read-only column of strings stored as UTF-8 bytes, whose values are decoded when they are read.
+
+    Value i is data[offsets[i]:offsets[i + 1]]. Values appended later are kept in a separate list,
+    so the (possibly memory-mapped) arrays are never written to.
+
+    >>> column = StringColumn(np.frombuffer(b'ab\\0cd', dtype=np.uint8), np.array([0, 2, 5]))
+    >>> column.append('e')
+    >>> list(column)
+    ['ab', '\\x00cd', 'e']
+    """
+    # Private Instance Attributes:
+    #     - _data:
+    #         The concatenated UTF-8 bytes of the stored values.
+    #     - _offsets:
+    #         The offset in _data where each stored value starts, followed by the length of _data.
+    #     - _appended:
+    #         The values appended after the column was created.
+    _data: np.ndarray
+    _offsets: np.ndarray
+    _appended: list[str]
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray) -> None:
+        """Initialize a column of the values stored in data at the given offsets.
+
+        Preconditions:
+            - len(offsets) >= 1 and offsets[0] == 0 and offsets[-1] == len(data)
+            - offsets is sorted
+        """
+        self._data = data
+        self._offsets = offsets
+        self._appended = []
+
+    def __len__(self) -> int:
+        """Return the number of values in this column."""
+        return len(self._offsets) - 1 + len(self._appended)
+
+    def __getitem__(self, index: Union[int, np.integer]) -> str:
+        """Return the value at the given index.
+
+        Preconditions:
+            - 0 <= index < len(self)
+        """
+        stored = len(self._offsets) - 1
+        if index >= stored:
+            return self._appended[index - stored]
+        return self._data[self._offsets[index]:self._offsets[index + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        """Yield the values of this column in order."""
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, value: str) -> None:
+        """Add the given value to the end of this column."""
+        self._appended.append(value)
+
+
+class KeyIndex(MutableMapping):
+    """Maps each key of a column of vertex keys to its position in the column, without building a dict.
+
+    Keys are found by binary search over the positions sorted by key. Keys added later are kept in a
+    dict, since they are not in the sorted positions.
+
+    >>> keys = StringColumn(np.frombuffer(b'song2user1', dtype=np.uint8), np.array([0, 5, 10]))
+    >>> index = KeyIndex(keys, np.array([0, 1]))
+    >>> index['user1'], 'song1' in index
+    (1, False)
+    >>> index['song1'] = 2
+    >>> index['song1'], len(index)
+    (2, 3)
+    """
+    # Private Instance Attributes:
+    #     - _keys:
+    #         The column of keys this index searches.
+    #     - _order:
+    #         The positions of the keys stored when the index was created, sorted by key.
+    #     - _added:
+    #         Maps each key added to this index later to its position.
+    _keys: Sequence[str]
+    _order: np.ndarray
+    _added: dict[str, int]
+
+    def __init__(self, keys: Sequence[str], order: np.ndarray) -> None:
+        """Initialize an index of the first len(order) keys of the given column.
+
+        Preconditions:
+            - sorted(order.tolist()) == list(range(len(order)))
+            - [keys[i] for i in order] is sorted and has no duplicates
+        """
+        self._keys = keys
+        self._order = order
+        self._added = {}
+
+    def __getitem__(self, key: Any) -> int:
+        """Return the position of the given key, or raise a KeyError if it is not in this index."""
+        if key in self._added:
+            return self._added[key]
+        if isinstance(key, str):
+            low, high = 0, len(self._order)
+            while low < high:
+                middle = (low + high) // 2
+                if self._keys[self._order[middle]] < key:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low < len(self._order) and self._keys[self._order[low]] == key:
+                return int(self._order[low])
+        raise KeyError(key)
+
+    def __contains__(self, key: Any) -> bool:
+        """Return whether the given key is in this index."""
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key: str, position: int) -> None:
+        """Add the given key at the given position.
+
+        Preconditions:
+            - key not in self
+        """
+        self._added[key] = position
+
+    def __delitem__(self, key: str) -> None:
+        """Raise a TypeError: vertices are never removed from a graph."""
+        raise TypeError('keys cannot be removed from a KeyIndex')
+
+    def __iter__(self) -> Iterator[str]:
+        """Yield the keys of this index, in sorted order and then in the order they were added."""
+        for position in self._order:
+            yield self._keys[position]
+        yield from self._added
+
+    def __len__(self) -> int:
+        """Return the number of keys in this index."""
+        return len(self._order) + len(self._added)
+
+
+def source_checksum(users: str, songs: str) -> str:
+    """Return the hex SHA-256 checksum of the contents of the two given source files."""
+    digest = hashlib.sha256()
+    for path in (users, songs):
+        with open(path, 'rb') as file:
+            for block in iter(lambda f=file: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def source_signature(users: str, songs: str) -> list[list[int]]:
+    """Return the [size, mtime] pair of each of the two given source files."""
+    return [[os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in (users, songs)]
+
+
+def save_snapshot(graph: CompactGraph, path: str, users: str, songs: str) -> None:
+    """Write the given graph, built from the given source files, to a snapshot file at path.
+
+    The file is written next to path first and then moved into place, so a reader never sees
+    a partly written snapshot.
+    """
+    _write_snapshot(graph, path, source_checksum(users, songs), source_signature(users, songs))
+
+
+def load_snapshot(path: str, users: str, songs: str) -> CompactGraph:
+    """Return the graph of the given source files, read from the snapshot at path.
+
+    If the snapshot is missing, has a different version or was built from different source files,
+    the graph is loaded from the source files instead and the snapshot is rewritten.
+    The source files are only hashed again if their size or modification time changed.
+
+    The arrays of the returned graph are memory-mapped from the snapshot file, so they are shared
+    between processes that open the same snapshot.
+    """
+    signature = source_signature(users, songs)
+    checksum = None
+    metadata = _read_metadata(path)
+    if metadata is not None and metadata['sources'] != signature:
+        checksum = source_checksum(users, songs)
+        if metadata['checksum'] != checksum:
+            metadata = None
+
+    if metadata is not None:
+        return _open_snapshot(path, metadata)
+
+    graph = load_compact_review_graph(users, songs)
+    _write_snapshot(graph, path, checksum or source_checksum(users, songs), signature)
+    return graph
+
+
+def _write_snapshot(graph: CompactGraph, path: str, checksum: str, signature: list[list[int]]) -> None:
+    """Write the given graph to a snapshot file at path, recording the given source checksum and signature."""
+    columns = graph.get_columns()
+    sections = {}
+    for name, dtype in ARRAY_COLUMNS.items():
+        sections[name] = np.ascontiguousarray(columns[name], dtype=dtype)
+    for name in STRING_COLUMNS:
+        encoded = [value.encode('utf-8') for value in columns[name]]
+        offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        sections[name] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        sections[name + '_offsets'] = offsets
+    keys = columns['keys']
+    sections['key_order'] = np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype='<i4')
+
+    # The section offsets depend on the metadata length, so the metadata is laid out twice:
+    # first with placeholder offsets to find its length, then with the real offsets.
+    layout = {name: [0, section.dtype.str, len(section)] for name, section in sections.items()}
+    metadata = {'checksum': checksum, 'sources': signature, 'sections': layout}
+    header_length = len(MAGIC) + 8 + len(json.dumps(metadata)) + 32 * len(sections)
+    offset = _aligned(header_length)
+    for name, section in sections.items():
+        layout[name][0] = offset
+        offset = _aligned(offset + section.nbytes)
+    encoded = json.dumps(metadata).encode('utf-8')
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(MAGIC)
+        file.write(struct.pack('<II', SNAPSHOT_VERSION, len(encoded)))
+        file.write(encoded)
+        for name, section in sections.items():
+            file.write(b'\0' * (layout[name][0] - file.tell()))
+            file.write(section.tobytes())
+        file.write(b'\0' * (offset - file.tell()))
+    os.replace(temporary, path)
+
+
+def _read_metadata(path: str) -> Optional[dict[str, Any]]:
+    """Return the metadata of the snapshot at path, or None if it is missing, unreadable or of another version."""
+    try:
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                return None
+            version, length = struct.unpack('<II', file.read(8))
+            if version != SNAPSHOT_VERSION:
+                return None
+            return json.loads(file.read(length).decode('utf-8'))
+    except (OSError, struct.error, ValueError):
+        return None
+
+
+def _open_snapshot(path: str, metadata: dict[str, Any]) -> CompactGraph:
+    """Return the graph stored in the snapshot at path, with its arrays memory-mapped from the file.
+
+    Only the few genre names are decoded here. The other string columns are decoded value by value
+    when they are read, and keys are looked up through the stored key order.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    sections = {}
+    for name, (offset, dtype, length) in metadata['sections'].items():
+        sections[name] = np.frombuffer(mapped, dtype=dtype, count=length, offset=offset)
+    columns = {name: sections[name] for name in ARRAY_COLUMNS}
+    for name in STRING_COLUMNS:
+        columns[name] = StringColumn(sections[name], sections[name + '_offsets'])
+    columns['genre_names'] = list(columns['genre_names'])
+    columns['key_index'] = KeyIndex(columns['keys'], sections['key_order'])
+    return CompactGraph.from_columns(columns)
+
+
+def _aligned(offset: int) -> int:
+    """Return the smallest multiple of ALIGNMENT that is at least offset.
+
+    >>> _aligned(0)
+    0
+    >>> _aligned(65)
+    128
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+if __name__ == '__main__':
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={
+        'max-line-length': 120,
+        'extra-imports': ['hashlib', 'json', 'mmap', 'os', 'struct', 'collections.abc', 'numpy', 'compact_graph'],
+        'allowed-io': ['source_checksum', '_write_snapshot', '_read_metadata', '_open_snapshot'],
+        'max-nested-blocks': 4
+    })
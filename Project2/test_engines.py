@@ -0,0 +1,148 @@
+"""CSC111 Project 2: Scoring Backend Regression Tests
+
+Checks that every scoring backend (the sparse SimilarityEngine, the MinHash LSH index and the
+CompactGraph) ranks users as the baseline does, including after the graph changes under a subscribed
+engine or index.
+"""
+from __future__ import annotations
+import random
+
+import pytest
+
+import similarity_engine
+from compact_graph import CompactGraph
+from conftest import PROFILES, SONGS, USERS, ReferenceMatcher, normalized
+from graph_functions import Graph, Neighbourhood, load_review_graph
+from lsh_index import MinHashLSH, measure_recall
+from similarity_engine import SimilarityEngine
+
+
+def ranked(graph: Graph, user: str, genre: str, duration: str, k: int, engine: object = None) -> list[tuple]:
+    """Return the (user, score) pairs of the top k matches of user in graph."""
+    return [(match[0][0], match[2][0]) for match in graph.top_k_matches(user, genre, duration, k, engine=engine)]
+
+
+def mutate(graph: Graph, reference: ReferenceMatcher, rng: random.Random, steps: int) -> None:
+    """Apply the same random additions and removals of users, songs and listens to graph and reference."""
+    users = list(reference.users)
+    songs = list(reference.songs)
+    for _ in range(steps):
+        step = len(users) + len(songs)
+        action = rng.random()
+        if action < 0.3:
+            user = f'new{step}'
+            graph.add_vertex(user, [user, 'New', '20', 'Yukon'], 'user')
+            reference.users[user] = [user, 'New', '20', 'Yukon']
+            reference.listens[user] = set()
+            users.append(user)
+            listened = rng.sample(songs, 5)
+            graph.add_edges(user, listened)
+            reference.listens[user].update(listened)
+        elif action < 0.4:
+            song = f's{step}'
+            item = [song, f'Song {step}', 'Artist', str(rng.choice([60000, 200000, 600000])), 'pop']
+            graph.add_vertex(song, item, 'song')
+            reference.songs[song] = item
+            songs.append(song)
+        elif action < 0.8:
+            user, song = rng.choice(users), rng.choice(songs)
+            graph.add_edge(user, song)
+            reference.listens[user].add(song)
+        else:
+            user = rng.choice(users)
+            if reference.listens[user]:
+                song = rng.choice(sorted(reference.listens[user]))
+                graph.remove_edge(user, song)
+                reference.listens[user].discard(song)
+
+
+def test_engine_matches_baseline(graph, reference) -> None:
+    """The sparse engine finds the same best matches, with the same scores, as the baseline."""
+    engine = SimilarityEngine(graph)
+    for user in list(reference.users)[::5]:
+        for genre, duration in PROFILES:
+            expected = reference.match(user, genre, duration)
+            assert normalized(graph.compatible_user_rec_songs(user, genre, duration, engine)) == expected
+            assert ranked(graph, user, genre, duration, 5, engine) == \
+                reference.ranking(reference.listens[user], genre, duration, exclude=user)[:5]
+
+
+@pytest.mark.parametrize('threshold', [similarity_engine.MERGE_THRESHOLD, 3])
+def test_subscribed_engine_follows_changes(monkeypatch, threshold) -> None:
+    """A subscribed engine scores as the baseline does after each batch of changes, with or without merges."""
+    monkeypatch.setattr(similarity_engine, 'MERGE_THRESHOLD', threshold)
+    graph = load_review_graph(USERS, SONGS)
+    reference = ReferenceMatcher(USERS, SONGS)
+    engine = SimilarityEngine(graph)
+    graph.subscribe(engine)
+    rng = random.Random(threshold)
+    for _ in range(4):
+        mutate(graph, reference, rng, 40)
+        for user in rng.sample(list(reference.users), 15):
+            for genre, duration in PROFILES[:2]:
+                assert ranked(graph, user, genre, duration, 5, engine) == \
+                    reference.ranking(reference.listens[user], genre, duration, exclude=user)[:5]
+
+
+def test_lsh_index_matches_exact_top_k(graph) -> None:
+    """With its default bands, the LSH index finds the exact top k."""
+    index = MinHashLSH(graph)
+    assert measure_recall(graph, index, k=10, sample=60) == 1.0
+    for user in graph.get_ordered_vertices('user')[::11]:
+        assert ranked(graph, user, 'pop', 'medium', 5, index) == ranked(graph, user, 'pop', 'medium', 5)
+
+
+def test_subscribed_lsh_index_follows_changes() -> None:
+    """A subscribed LSH index finds the same candidates as an index rebuilt after the changes, and its
+    matches have the scores of the baseline."""
+    graph = load_review_graph(USERS, SONGS)
+    reference = ReferenceMatcher(USERS, SONGS)
+    index = MinHashLSH(graph)
+    graph.subscribe(index)
+    mutate(graph, reference, random.Random(1), 160)
+    rebuilt = MinHashLSH(graph)
+    assert index.users == rebuilt.users
+    for user in reference.users:
+        assert index.candidates(reference.listens[user]) == rebuilt.candidates(reference.listens[user])
+        exact = dict(reference.ranking(reference.listens[user], 'pop', 'medium', exclude=user))
+        assert all(exact[found] == score for found, score in ranked(graph, user, 'pop', 'medium', 5, index))
+
+
+def test_compact_graph_matches_baseline(graph, reference) -> None:
+    """A CompactGraph, with or without an engine, matches as the baseline does."""
+    compact = CompactGraph.from_graph(graph)
+    engine = SimilarityEngine(compact)
+    for user in list(reference.users)[::6]:
+        for genre, duration in PROFILES:
+            expected = reference.match(user, genre, duration)
+            assert normalized(compact.compatible_user_rec_songs(user, genre, duration)) == expected
+            assert normalized(compact.compatible_user_rec_songs(user, genre, duration, engine)) == expected
+
+
+def test_compact_graph_grows_like_graph(graph) -> None:
+    """Listens added to a CompactGraph between reads give the same neighbours as the same listens in a Graph."""
+    compact = CompactGraph.from_graph(graph)
+    rng = random.Random(2)
+    songs = graph.get_ordered_vertices('song')
+    expected = {user: set(graph.get_neighbours(user)) for user in graph.get_ordered_vertices('user')}
+    for step in range(200):
+        user = rng.choice(list(expected))
+        if step % 10 == 0:
+            user = f'late{step}'
+            compact.add_vertex(user, [user, 'Late', '40', 'Nunavut'], 'user')
+            expected[user] = set()
+        song = rng.choice(songs)
+        compact.add_edge(user, song)
+        expected[user].add(song)
+        assert compact.get_neighbours(user) == expected[user]
+        assert user in compact.get_neighbours(song)
+    assert all(compact.get_neighbours(user) == listened for user, listened in expected.items())
+
+
+def test_neighbourhood_engine_matches_graph(graph) -> None:
+    """The engine ranks the songs of a neighbourhood exactly as the graph does."""
+    engine = SimilarityEngine(graph)
+    for user in graph.get_ordered_vertices('user')[::13]:
+        for size in (Neighbourhood(), Neighbourhood(users=3, songs=5)):
+            assert graph.neighbourhood_rec_songs(user, 'pop', 'medium', size, engine) == \
+                graph.neighbourhood_rec_songs(user, 'pop', 'medium', size)
@@ -0,0 +1,67 @@
+"""CSC111 Project 2: Ingestion Regression Tests
+
+Checks that the parallel, chunked ingestion builds the same graph as load_review_graph, in the same
+order, whatever the number of processes or the chunk size, and that it matches as the baseline does.
+"""
+from __future__ import annotations
+
+import pytest
+
+from compact_graph import CompactGraph
+from conftest import PROFILES, SONGS, USERS, normalized
+from graph_functions import Graph
+from ingest import ingest_review_graph, line_ranges
+
+
+def assert_same_graph(expected: Graph, actual: Graph) -> None:
+    """Assert that the two graphs have the same vertices, in the same order, with the same items and edges."""
+    for kind in ('user', 'song'):
+        assert actual.get_ordered_vertices(kind) == expected.get_ordered_vertices(kind)
+    for key in expected.get_ordered_vertices():
+        assert list(actual.get_item(key)) == list(expected.get_item(key))
+        assert actual.get_neighbours(key) == expected.get_neighbours(key)
+
+
+@pytest.mark.parametrize('processes, chunk_bytes', [(1, 1 << 20), (1, 997), (2, 997), (3, 4096)])
+def test_ingest_matches_load_review_graph(graph, processes, chunk_bytes) -> None:
+    """Every split of the user file into chunks gives the graph of load_review_graph, in the same order."""
+    ingested, stats = ingest_review_graph(USERS, SONGS, processes=processes, chunk_bytes=chunk_bytes)
+    assert_same_graph(graph, ingested)
+    assert stats.rows == stats.listens == 2000
+    assert stats.bytes_read == stats.total_bytes
+
+
+def test_ingest_into_graph_matches_baseline(reference) -> None:
+    """An ingested Graph (not the default CompactGraph) matches users as the baseline does."""
+    ingested, _ = ingest_review_graph(USERS, SONGS, graph=Graph(), processes=1, chunk_bytes=2048)
+    for user in list(reference.users)[::7]:
+        for genre, duration in PROFILES:
+            assert normalized(ingested.compatible_user_rec_songs(user, genre, duration)) == \
+                reference.match(user, genre, duration)
+
+
+def test_ingest_skips_unknown_and_malformed_rows(tmp_path) -> None:
+    """Rows with an unknown song or too few fields are counted and skipped, without changing the user order."""
+    users = tmp_path / 'users.csv'
+    users.write_text('zed,Zed,30,Ottawa,1\nzed,Zed,30,Ottawa,no-such-song\nshort,row\n'
+                     'amy,Amy,25,Halifax,2\nzed,Zed,30,Ottawa,2\n', encoding='utf-8')
+    ingested, stats = ingest_review_graph(str(users), SONGS, processes=1, chunk_bytes=8)
+    assert ingested.get_ordered_vertices('user') == ['zed', 'amy']
+    assert ingested.get_neighbours('zed') == {'1', '2'}
+    assert (stats.rows, stats.listens, stats.unknown_songs, stats.malformed) == (5, 3, 1, 1)
+
+
+def test_line_ranges_cover_whole_lines() -> None:
+    """The ranges cover the file exactly once, and every range ends at the end of a line."""
+    with open(USERS, 'rb') as file:
+        data = file.read()
+    ranges = line_ranges(USERS, 1000)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end == begin for (_, end), (begin, _) in zip(ranges, ranges[1:]))
+    assert all(data[end - 1:end] == b'\n' for _, end in ranges)
+
+
+def test_default_graph_is_compact() -> None:
+    """Without a graph argument, the ingested graph is a CompactGraph."""
+    ingested, _ = ingest_review_graph(USERS, SONGS, processes=1)
+    assert isinstance(ingested, CompactGraph)
@@ -0,0 +1,131 @@
+"""CSC111 Project 2: Match Cache Regression Tests
+
+Checks that a cached match is never served for another state of the graph, and that the cache evicts,
+expires and replays errors as documented.
+"""
+from __future__ import annotations
+
+import pytest
+
+from conftest import normalized
+from graph_functions import Graph, GraphOverlay
+from match_cache import MatchCache, query_key
+
+
+def query_match(graph: Graph, songs: list[str], genre: str, duration: str) -> list:
+    """Return the best match of a new user who listens to the given songs, added to an overlay of graph."""
+    overlay = GraphOverlay(graph)
+    overlay.add_vertex('query', ['query'], 'user')
+    overlay.add_edges('query', songs)
+    return overlay.compatible_user_rec_songs('query', genre, duration)
+
+
+def small_graph() -> Graph:
+    """Return a graph where ann listens to songs 1 and 2, and bob to song 2."""
+    graph = Graph()
+    for song in ('1', '2', '3'):
+        graph.add_vertex(song, [song, f'Song {song}', 'Artist', '200000', 'pop'], 'song')
+    for user, songs in (('ann', ['1', '2']), ('bob', ['2'])):
+        graph.add_vertex(user, [user, user.title(), '20', 'Ontario'], 'user')
+        graph.add_edges(user, songs)
+    return graph
+
+
+def test_cached_matches_equal_baseline(graph, reference) -> None:
+    """Hits return the result the baseline computes for the query, whatever the song order or case."""
+    cache = MatchCache()
+    for songs in (['1', '5', '9'], ['42', '7'], ['100', '150', '3', '60']):
+        for genre, duration in (('pop', 'medium'), ('POP', 'Medium')):
+            key = query_key(reversed(songs), genre, duration)
+            result = cache.get_or_compute(graph, key, lambda s=songs, g=genre, d=duration: query_match(graph, s, g, d))
+            ranking = reference.ranking(set(songs), genre, duration)
+            assert result[0] == reference.users[ranking[0][0]] and result[2] == [ranking[0][1]]
+            assert normalized(result)[1] == reference.song_lists(set(songs), ranking[0][0])
+    assert (cache.misses, cache.hits) == (3, 3)
+
+
+def test_mutation_invalidates_cache() -> None:
+    """A change of the graph drops every cached result, so the next lookup sees the change."""
+    graph = small_graph()
+    cache = MatchCache()
+    key = query_key(['3'], 'pop', 'medium')
+
+    def compute() -> list:
+        return query_match(graph, ['3'], 'pop', 'medium')
+
+    with pytest.raises(ValueError):
+        cache.get_or_compute(graph, key, compute)
+    graph.add_edge('bob', '3')
+    assert cache.get_or_compute(graph, key, compute)[0][0] == 'bob'
+    graph.remove_edge('bob', '3')
+    with pytest.raises(ValueError):
+        cache.get_or_compute(graph, key, compute)
+    assert cache.invalidations == 2 and cache.hits == 0
+
+
+def test_other_graph_is_not_served() -> None:
+    """Results of one graph are not served for another graph, even at the same generation."""
+    first, second = small_graph(), small_graph()
+    second.add_vertex('cat', ['cat', 'Cat', '30', 'Yukon'], 'user')
+    cache = MatchCache()
+    assert cache.get_or_compute(first, 'key', lambda: 'first') == 'first'
+    assert cache.get_or_compute(second, 'key', lambda: 'second') == 'second'
+
+
+def test_change_during_compute_is_not_stored() -> None:
+    """A result computed while the graph changed is returned but not cached."""
+    graph = small_graph()
+    cache = MatchCache()
+
+    def compute() -> str:
+        graph.add_edge('bob', '3')
+        return 'stale'
+
+    assert cache.get_or_compute(graph, 'key', compute) == 'stale'
+    assert cache.get_or_compute(graph, 'key', lambda: 'fresh') == 'fresh'
+
+
+def test_least_recently_used_is_evicted() -> None:
+    """A full cache drops the result that was used least recently."""
+    graph = small_graph()
+    cache = MatchCache(max_entries=2)
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get_or_compute(graph, key, lambda k=key: k)
+    assert cache.get_or_compute(graph, 'a', lambda: 'recomputed') == 'a'
+    assert cache.get_or_compute(graph, 'b', lambda: 'recomputed') == 'recomputed'
+    assert cache.evictions == 2
+
+
+def test_results_expire() -> None:
+    """A result older than ttl seconds is computed again."""
+    graph = small_graph()
+    now = [0.0]
+    cache = MatchCache(ttl=10, clock=lambda: now[0])
+    cache.get_or_compute(graph, 'key', lambda: 'old')
+    now[0] = 10.0
+    assert cache.get_or_compute(graph, 'key', lambda: 'new') == 'old'
+    now[0] = 20.5
+    assert cache.get_or_compute(graph, 'key', lambda: 'new') == 'new'
+    assert cache.expirations == 1
+
+
+def test_errors_are_cached_but_others_are_not() -> None:
+    """A ValueError is replayed from the cache, and any other exception is raised every time."""
+    graph = small_graph()
+    cache = MatchCache()
+    calls = []
+
+    def no_match() -> None:
+        calls.append('no match')
+        raise ValueError('no match')
+
+    def broken() -> None:
+        calls.append('broken')
+        raise KeyError('broken')
+
+    for _ in range(2):
+        with pytest.raises(ValueError, match='no match'):
+            cache.get_or_compute(graph, 'missing', no_match)
+        with pytest.raises(KeyError):
+            cache.get_or_compute(graph, 'broken', broken)
+    assert calls == ['no match', 'broken', 'broken']
@@ -0,0 +1,119 @@
+"""CSC111 Project 2: Service Regression Tests
+
+Runs the recommendation service on a free port (with thread workers, so the test needs no extra
+processes), and checks its status codes and that its matches are the ones of the baseline.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import socket
+import threading
+from typing import Any, Iterator, Optional
+
+import pytest
+
+from conftest import PROFILES, SONGS, USERS, ReferenceMatcher
+from service import MAX_BODY_BYTES, RecommendationService
+
+
+@pytest.fixture(scope='module')
+def port() -> Iterator[int]:
+    """The port of a service for the bundled datasets, running on an event loop in another thread."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    service = RecommendationService(USERS, SONGS, workers=2, use_processes=False)
+    yield asyncio.run_coroutine_threadsafe(service.start('127.0.0.1', 0), loop).result(timeout=60)
+    asyncio.run_coroutine_threadsafe(service.stop(), loop).result(timeout=60)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=10)
+    loop.close()
+
+
+def send(port: int, raw: bytes) -> tuple[int, dict[str, Any]]:
+    """Send the given raw request on a new connection, and return the status and JSON body of the response."""
+    with socket.create_connection(('127.0.0.1', port), timeout=30) as connection:
+        connection.sendall(raw)
+        connection.shutdown(socket.SHUT_WR)
+        response = b''
+        while chunk := connection.recv(65536):
+            response += chunk
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def request(port: int, method: str, path: str, body: Optional[Any] = None) -> tuple[int, dict[str, Any]]:
+    """Send one request with the given JSON body, and return the status and JSON body of the response."""
+    encoded = b'' if body is None else json.dumps(body).encode('utf-8')
+    head = f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\nContent-Length: {len(encoded)}\r\n\r\n'
+    return send(port, head.encode('latin-1') + encoded)
+
+
+def test_health(port) -> None:
+    """/health reports the size of the graph."""
+    status, body = request(port, 'GET', '/health')
+    assert status == 200
+    assert (body['status'], body['users'], body['songs']) == ('ok', len(ReferenceMatcher(USERS, SONGS).users), 200)
+
+
+def test_user_matches_equal_baseline(port, reference) -> None:
+    """A query by user returns the baseline's best match first, with its score and song lists."""
+    for user in list(reference.users)[::10]:
+        for genre, duration in PROFILES:
+            status, body = request(port, 'POST', '/match', {'user': user, 'genre': genre, 'duration': duration})
+            assert status == 200
+            expected = reference.match(user, genre, duration)
+            best = body['matches'][0]
+            assert [best['user'], [sorted(best['common_songs']), sorted(best['recommended_songs'])],
+                    [best['score']]] == expected
+
+
+def test_song_matches_equal_baseline(port, reference) -> None:
+    """A query by song list returns the baseline's top k, also when it is answered from the cache."""
+    for songs in (['1', '5', '9'], ['42', '7', '7'], ['100', '150', '3', '60']):
+        for _ in range(2):
+            status, body = request(port, 'POST', '/match', {'songs': songs, 'genre': 'pop', 'duration': 'medium',
+                                                            'k': 3})
+            assert status == 200
+            assert [(match['user'][0], match['score']) for match in body['matches']] == \
+                reference.ranking(set(songs), 'pop', 'medium')[:3]
+
+
+@pytest.mark.parametrize('query', [
+    {'user': 'nobody', 'genre': 'pop', 'duration': 'medium'},
+    {'songs': ['no-such-song'], 'genre': 'pop', 'duration': 'medium'},
+    {'user': 'user1', 'genre': 'pop', 'duration': 'forever'},
+    {'user': 'user1', 'genre': 'pop', 'duration': 'short', 'k': 0},
+    {'genre': 'pop', 'duration': 'short'},
+    ['not', 'an', 'object']
+])
+def test_bad_queries_are_rejected(port, query) -> None:
+    """Malformed queries and unknown users or songs get a 400 with an error message."""
+    status, body = request(port, 'POST', '/match', query)
+    assert status == 400 and body['error']
+
+
+def test_invalid_json_is_rejected(port) -> None:
+    """A body that is not JSON gets a 400."""
+    raw = b'POST /match HTTP/1.1\r\nConnection: close\r\nContent-Length: 5\r\n\r\n{nope'
+    assert send(port, raw) == (400, {'error': 'the body is not valid JSON'})
+
+
+@pytest.mark.parametrize('length', ['abc', '-1', '1e3', '٣'])
+def test_invalid_content_length_is_rejected(port, length) -> None:
+    """A Content-Length that is not a non-negative integer gets a 400, not a dropped connection."""
+    raw = f'POST /match HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}'.encode('utf-8')
+    assert send(port, raw) == (400, {'error': 'invalid Content-Length'})
+
+
+def test_large_body_is_rejected(port) -> None:
+    """A body larger than MAX_BODY_BYTES gets a 413 without being read."""
+    raw = f'POST /match HTTP/1.1\r\nContent-Length: {MAX_BODY_BYTES + 1}\r\n\r\n'.encode('latin-1')
+    assert send(port, raw) == (413, {'error': 'request body too large'})
+
+
+def test_wrong_method_and_path(port) -> None:
+    """A known path with the wrong method gets a 405, and an unknown path a 404."""
+    assert request(port, 'GET', '/match')[0] == 405
+    assert request(port, 'POST', '/health', {})[0] == 405
+    assert request(port, 'GET', '/nowhere')[0] == 404
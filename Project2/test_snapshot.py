@@ -0,0 +1,126 @@
+"""CSC111 Project 2: Snapshot Regression Tests
+
+Checks that a graph reopened from a snapshot matches as the baseline does, that a snapshot is rebuilt
+whenever its source files change (and only then), and that any string survives the round trip.
+"""
+from __future__ import annotations
+import os
+import shutil
+import struct
+
+import pytest
+
+import snapshot
+from conftest import PROFILES, SONGS, USERS, normalized
+from snapshot import MAGIC, load_snapshot
+
+
+@pytest.fixture()
+def sources(tmp_path) -> tuple[str, str, str]:
+    """Copies of the bundled datasets that a test may change, and the path of their snapshot."""
+    users, songs = str(tmp_path / 'users.csv'), str(tmp_path / 'songs.csv')
+    shutil.copyfile(USERS, users)
+    shutil.copyfile(SONGS, songs)
+    return users, songs, str(tmp_path / 'graph.snapshot')
+
+
+@pytest.fixture()
+def loads(monkeypatch) -> list[str]:
+    """The users files the graph is loaded from instead of opened from a snapshot, in order."""
+    loaded = []
+    load = snapshot.load_compact_review_graph
+
+    def counting_load(users: str, songs: str) -> snapshot.CompactGraph:
+        loaded.append(users)
+        return load(users, songs)
+
+    monkeypatch.setattr(snapshot, 'load_compact_review_graph', counting_load)
+    return loaded
+
+
+def test_reopened_snapshot_matches_baseline(sources, loads, reference) -> None:
+    """A graph reopened from its snapshot (without parsing the sources) matches as the baseline does."""
+    users, songs, path = sources
+    load_snapshot(path, users, songs)
+    reopened = load_snapshot(path, users, songs)
+    assert len(loads) == 1
+    assert reopened.get_ordered_vertices('user') == list(reference.users)
+    for user in list(reference.users)[::9]:
+        assert reopened.get_neighbours(user) == reference.listens[user]
+        for genre, duration in PROFILES:
+            assert normalized(reopened.compatible_user_rec_songs(user, genre, duration)) == \
+                reference.match(user, genre, duration)
+
+
+def test_changed_sources_rebuild_snapshot(sources, loads) -> None:
+    """A snapshot of files that changed since it was written is never used."""
+    users, songs, path = sources
+    load_snapshot(path, users, songs)
+    with open(users, 'a', encoding='utf-8') as file:
+        file.write('newcomer,New,20,Regina,1\n')
+    graph = load_snapshot(path, users, songs)
+    assert len(loads) == 2
+    assert graph.get_neighbours('newcomer') == {'1'}
+    assert load_snapshot(path, users, songs).has_vertex('newcomer', 'user')
+    assert len(loads) == 2
+
+
+def test_same_size_edit_rebuilds_snapshot(sources, loads) -> None:
+    """An edit that keeps the size of a source file is caught by its checksum."""
+    users, songs, path = sources
+    load_snapshot(path, users, songs)
+    with open(users, 'r+', encoding='utf-8') as file:
+        data = file.read()
+        file.seek(0)
+        file.write(data.replace('Liam', 'Lian', 1))
+    os.utime(users, ns=(0, os.stat(users).st_mtime_ns + 10 ** 9))
+    assert load_snapshot(path, users, songs).get_item('user1')[1] == 'Lian'
+    assert len(loads) == 2
+
+
+def test_touched_sources_reuse_snapshot(sources, loads) -> None:
+    """Source files with a new modification time but the same contents do not rebuild the snapshot."""
+    users, songs, path = sources
+    load_snapshot(path, users, songs)
+    os.utime(users, ns=(0, os.stat(users).st_mtime_ns + 10 ** 9))
+    load_snapshot(path, users, songs)
+    assert len(loads) == 1
+
+
+def test_other_version_rebuilds_snapshot(sources, loads) -> None:
+    """A snapshot of another format version is rebuilt rather than misread."""
+    users, songs, path = sources
+    load_snapshot(path, users, songs)
+    with open(path, 'r+b') as file:
+        file.seek(len(MAGIC))
+        file.write(struct.pack('<I', snapshot.SNAPSHOT_VERSION - 1))
+    load_snapshot(path, users, songs)
+    load_snapshot(path, users, songs)
+    assert len(loads) == 2
+
+
+def test_any_string_round_trips(tmp_path) -> None:
+    """Keys and fields with NUL bytes, commas, quotes or non-ASCII characters are stored exactly."""
+    users, songs, path = str(tmp_path / 'users.csv'), str(tmp_path / 'songs.csv'), str(tmp_path / 'graph.snapshot')
+    with open(songs, 'w', encoding='utf-8') as file:
+        file.write('1,"Nul\0Title, with ""quotes""",Béla Bartók,200000,pop\n2,,Ø,100,\n')
+    with open(users, 'w', encoding='utf-8') as file:
+        file.write('a\0b,Zoë,20,Québec,1\na\0b,Zoë,20,Québec,2\n"x,y",,31,,2\n')
+    load_snapshot(path, users, songs)
+    reopened = load_snapshot(path, users, songs)
+    assert reopened.get_ordered_vertices('user') == ['a\0b', 'x,y']
+    assert reopened.get_item('a\0b') == ['a\0b', 'Zoë', '20', 'Québec']
+    assert reopened.get_item('1')[1:3] == ['Nul\0Title, with "quotes"', 'Béla Bartók']
+    assert reopened.get_neighbours('x,y') == {'2'} and not reopened.has_vertex('a')
+
+
+def test_reopened_snapshot_can_grow(sources) -> None:
+    """Vertices and edges can be added to a reopened snapshot, and are found by key like the stored ones."""
+    users, songs, path = sources
+    load_snapshot(path, users, songs)
+    reopened = load_snapshot(path, users, songs)
+    reopened.add_vertex('query', ['query', 'Query', '0', ''], 'user')
+    reopened.add_edges('query', ['1', '2', '3'])
+    assert reopened.has_vertex('query', 'user') and reopened.has_vertex('user1', 'user')
+    assert reopened.get_neighbours('query') == {'1', '2', '3'}
+    assert 'query' in reopened.get_neighbours('2')